@@ -0,0 +1,105 @@
+"""Add search vector to products
+
+Revision ID: c5d2a8e4f1b7
+Revises: b3e1f7a2c9d4
+Create Date: 2026-10-18 16:21:05.804113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d2a8e4f1b7'
+down_revision: Union[str, Sequence[str], None] = 'b3e1f7a2c9d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rader per batch i backfillen; varje batch committas för sig
+BACKFILL_BATCH = 5000
+
+VECTOR_SQL = """
+    setweight(to_tsvector('swedish_unaccent', coalesce({row}.name, '')), 'A') ||
+    setweight(to_tsvector('swedish_unaccent', coalesce({row}.brand, '')), 'B') ||
+    setweight(to_tsvector('swedish_unaccent',
+        coalesce((SELECT name FROM categories WHERE id = {row}.category_id), '')), 'C')
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. Svensk konfiguration; unaccent gör att "kram" hittar "kräm" (om tillägget finns)
+    op.execute("""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'swedish_unaccent') THEN
+            CREATE TEXT SEARCH CONFIGURATION swedish_unaccent (COPY = swedish);
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'unaccent') THEN
+                CREATE EXTENSION IF NOT EXISTS unaccent;
+                ALTER TEXT SEARCH CONFIGURATION swedish_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, swedish_stem;
+            END IF;
+        END IF;
+    END $$
+    """)
+
+    # 2. Kolumnen (utan default, så ingen omskrivning av tabellen)
+    op.add_column('products', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    # 3. Triggers: nya och ändrade rader får sin vektor direkt, även under backfillen
+    op.execute(f"""
+    CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {VECTOR_SQL.format(row='NEW')};
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+    CREATE TRIGGER products_search_vector
+    BEFORE INSERT OR UPDATE OF name, brand, category_id ON products
+    FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION categories_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE products SET category_id = category_id WHERE category_id = NEW.id;
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+    CREATE TRIGGER categories_search_vector
+    AFTER UPDATE OF name ON categories
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION categories_search_vector_update()
+    """)
+
+    # 4. Backfill i batchar och index utan att låsa tabellen (utanför migrationens transaktion)
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        max_id = conn.execute(sa.text("SELECT coalesce(max(id), 0) FROM products")).scalar()
+        for start in range(0, max_id + 1, BACKFILL_BATCH):
+            conn.execute(
+                sa.text(f"""
+                    UPDATE products SET search_vector = {VECTOR_SQL.format(row='products')}
+                    WHERE id >= :start AND id < :stop AND search_vector IS NULL
+                """),
+                {"start": start, "stop": start + BACKFILL_BATCH}
+            )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_search_vector "
+            "ON products USING gin (search_vector)"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_search_vector', table_name='products')
+    op.execute("DROP TRIGGER IF EXISTS categories_search_vector ON categories")
+    op.execute("DROP TRIGGER IF EXISTS products_search_vector ON products")
+    op.execute("DROP FUNCTION IF EXISTS categories_search_vector_update()")
+    op.execute("DROP FUNCTION IF EXISTS products_search_vector_update()")
+    op.drop_column('products', 'search_vector')
+    # Textsökningskonfigurationen lämnas kvar (ofarlig, och kan användas av annat)
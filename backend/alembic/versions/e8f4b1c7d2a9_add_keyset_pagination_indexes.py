@@ -0,0 +1,40 @@
+"""Add keyset pagination indexes to products
+
+Revision ID: e8f4b1c7d2a9
+Revises: c5d2a8e4f1b7
+Create Date: 2026-10-18 17:42:13.519270
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8f4b1c7d2a9'
+down_revision: Union[str, Sequence[str], None] = 'c5d2a8e4f1b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Samma uttryck som sorteringsnycklarna i app/models/product.py, annars används inte indexen
+INDEXES = {
+    "ix_products_popularity_keyset": "(-coalesce(popularity_score, 0)), coalesce(name, ''), id",
+    "ix_products_category_popularity_keyset": "category_id, (-coalesce(popularity_score, 0)), coalesce(name, ''), id",
+    "ix_products_name_keyset": "coalesce(name, ''), id",
+    "ix_products_rating_keyset": "coalesce(rating, -1), id",
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY låser inte tabellen för skrivningar, men kan inte köras i en transaktion
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON products ({columns})")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in INDEXES:
+        op.drop_index(name, table_name='products')
@@ -0,0 +1,36 @@
+"""Add trigram GiST index to products for KNN ranking
+
+Revision ID: f3a9c6e2b8d1
+Revises: e8f4b1c7d2a9
+Create Date: 2026-10-18 18:25:41.208913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a9c6e2b8d1'
+down_revision: Union[str, Sequence[str], None] = 'e8f4b1c7d2a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # GIN-indexet (ix_products_name_trgm) klarar filtret q <% name men kan inte lämna ut
+    # raderna sorterade på avstånd; gist_trgm_ops kan det (ORDER BY name <->> q LIMIT n).
+    # CONCURRENTLY låser inte tabellen för skrivningar, men kan inte köras i en transaktion
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_name_trgm_gist "
+            "ON products USING gist (name gist_trgm_ops)"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_name_trgm_gist', table_name='products')
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session, subqueryload, joinedload
-from sqlalchemy import func, desc, asc, distinct
+from sqlalchemy import func, desc, asc, distinct, and_
 from typing import Optional, List
 
 from app.db.session import get_db
 from app.models import Category, Product, ProductPrice, Store
+from app.services.pagination import paginate, sort_spec, price_summary_subquery, InvalidCursor, MAX_PAGE_SIZE
 
 router = APIRouter()
 
@@ -15,8 +16,8 @@ def get_categories(db: Session = Depends(get_db)):
 @router.get("/{slug}")
 def get_category_by_slug(
     slug: str, 
-    page: int = Query(1, ge=1),
-    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
     sort: str = Query("popularity", pattern="^(popularity|price_asc|price_desc|discount_desc|rating_desc|name_asc|newest|default)$"),
     search: Optional[str] = None,
     min_price: Optional[float] = None,
@@ -50,10 +51,11 @@ def get_category_by_slug(
         query = query.filter(Product.brand.in_(brand_list))
 
     if min_price is not None or max_price is not None:
-        query = query.join(ProductPrice)
-        if min_price is not None: query = query.filter(ProductPrice.price >= min_price)
-        if max_price is not None: query = query.filter(ProductPrice.price <= max_price)
-        query = query.distinct()
+        # EXISTS i stället för join + DISTINCT, så att sorteringsnycklarna kan ligga i ORDER BY
+        price_filters = []
+        if min_price is not None: price_filters.append(ProductPrice.price >= min_price)
+        if max_price is not None: price_filters.append(ProductPrice.price <= max_price)
+        query = query.filter(Product.prices.any(and_(*price_filters)))
 
     # FACETS (Märken)
     facet_query = db.query(Product.brand, func.count(Product.id))\
@@ -72,24 +74,19 @@ def get_category_by_slug(
     min_cat_price = price_stats[0] or 0
     max_cat_price = price_stats[1] or 10000
 
-    # SORTERING
-    if sort == "name_asc": query = query.order_by(Product.name.asc())
-    elif sort == "newest": query = query.order_by(Product.created_at.desc())
-    elif sort == "popularity" or sort == "default": query = query.order_by(Product.popularity_score.desc(), Product.name.asc())
-    elif sort == "rating_desc": query = query.order_by(Product.rating.desc())
-    elif sort == "price_asc" or sort == "price_desc":
-        if min_price is None and max_price is None: query = query.join(ProductPrice)
-        query = query.group_by(Product.id)
-        min_p = func.min(ProductPrice.price)
-        if sort == "price_asc": query = query.order_by(min_p.asc())
-        else: query = query.order_by(min_p.desc())
-    elif sort == "discount_desc":
-        if min_price is None and max_price is None: query = query.join(ProductPrice)
-        query = query.group_by(Product.id)
-        max_d = func.max((ProductPrice.regular_price - ProductPrice.price) / ProductPrice.regular_price)
-        query = query.filter(ProductPrice.regular_price > 0).order_by(max_d.desc())
+    # SORTERING (nyckeln för keyset-pagineringen, se services/pagination)
+    if sort == "default": sort = "popularity"
+    prices = None
+    if sort in ("price_asc", "price_desc", "discount_desc"):
+        prices = price_summary_subquery(db)
+        if sort == "discount_desc":
+            # Bara produkter som har ett ordinarie pris att räkna rabatt mot
+            query = query.join(prices, Product.id == prices.c.product_id).filter(prices.c.max_discount.isnot(None))
+        else:
+            query = query.join(prices, Product.id == prices.c.product_id)
 
-    total_products = query.count()
+    # Totalen räknas bara på första sidan; en COUNT per sida är det keyset-pagineringen ska slippa
+    total_products = query.count() if not cursor else None
     
     # subqueryload: Hämtar alla priser för dessa 20 produkter i EN extra fråga (istället för 20 st)
     # joinedload: Hämtar butiksinfo (Store) direkt tillsammans med priset
@@ -97,7 +94,10 @@ def get_category_by_slug(
         subqueryload(Product.prices).joinedload(ProductPrice.store)
     )
 
-    products = query.limit(limit).offset((page - 1) * limit).all()
+    try:
+        products, next_cursor = paginate(query, sort_spec(sort, prices), sort, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     product_results = []
     for product in products:
@@ -141,9 +141,8 @@ def get_category_by_slug(
         },
         "pagination": {
             "total": total_products,
-            "page": page,
             "limit": limit,
-            "total_pages": (total_products + limit - 1) // limit if limit > 0 else 1
+            "next_cursor": next_cursor
         },
         "products": product_results
     }
\ No newline at end of file
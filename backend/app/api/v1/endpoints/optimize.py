@@ -1,9 +1,19 @@
+import json
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from pydantic import BaseModel
+from typing import List, Optional, Literal
+from pydantic import BaseModel, Field
 from app.db.session import get_db
-from app.services.optimizer import calculate_best_basket
+from app.services.optimizer import (
+    calculate_best_basket_async, stream_best_baskets, BasketConstraints,
+    MAX_BATCH_CARTS, MAX_ALTERNATIVES, DEFAULT_PREFER_PENALTY
+)
+from app.services.solver_pool import solver_pool, SolverBusy, SOLVER_RETRY_AFTER
+from app.services.cart_session import (
+    create_cart_session, update_cart_session, get_cart_session, delete_cart_session,
+    CartSessionNotFound, CartSessionUnavailable
+)
 
 router = APIRouter()
 
@@ -15,20 +25,145 @@ class CartItem(BaseModel):
 
 class OptimizeRequest(BaseModel):
     items: List[CartItem]
+    # Max lösningstid i millisekunder. När tiden tar slut returneras bästa korgen hittills
+    # med optimal=False. Utelämnad = ingen gräns.
+    time_budget_ms: Optional[int] = Field(default=None, ge=1)
+    # Antal korgar att visa: vinnaren plus upp till k-1 alternativ med andra butiker
+    k: int = Field(default=1, ge=1, le=MAX_ALTERNATIVES)
+    # Villkor: högst så många butiker, aldrig dessa butiker, och helst dessa butiker
+    # (varje annan butik kostar prefer_penalty kr extra när korgarna jämförs)
+    max_stores: Optional[int] = Field(default=None, ge=1)
+    exclude_store_ids: List[int] = []
+    prefer_store_ids: List[int] = []
+    prefer_penalty: float = Field(default=DEFAULT_PREFER_PENALTY, ge=0)
+    # Leveranssätt: väljer butikernas frakttabeller (ombud eller hemleverans)
+    delivery: Literal["pickup", "home"] = "pickup"
+    # Lägger till cachenivå och tid per fas på vinnaren (felsökning)
+    debug: bool = False
+
+    def constraints(self):
+        return BasketConstraints(
+            max_stores=self.max_stores,
+            exclude_store_ids=tuple(self.exclude_store_ids),
+            prefer_store_ids=tuple(self.prefer_store_ids),
+            prefer_penalty=self.prefer_penalty,
+            delivery=self.delivery
+        )
+
+class BatchOptimizeRequest(BaseModel):
+    carts: List[List[CartItem]] = Field(min_length=1, max_length=MAX_BATCH_CARTS)
+    # Gäller per korg
+    time_budget_ms: Optional[int] = Field(default=None, ge=1)
+
+class CartUpdateRequest(BaseModel):
+    # Nya antal per produkt; 0 tar bort varan ur korgen
+    items: List[CartItem]
+    time_budget_ms: Optional[int] = Field(default=None, ge=1)
+    debug: bool = False
+
+def _busy():
+    return HTTPException(
+        status_code=503,
+        detail="Optimeringen är överbelastad, försök igen strax",
+        headers={"Retry-After": str(SOLVER_RETRY_AFTER)}
+    )
 
 @router.post("/")
-def optimize_basket(request: OptimizeRequest, db: Session = Depends(get_db)):
+async def optimize_basket(request: OptimizeRequest, db: Session = Depends(get_db)):
     """
     Endpoint som tar emot varukorgen och returnerar den optimerade lösningen 
     (Samlad leverans vs Smart Split).
+    Lösningen körs i en separat processpool, så tunga korgar blockerar inte andra anrop.
     """
     if not request.items:
         raise HTTPException(status_code=400, detail="Varukorgen är tom")
 
     # Skicka datan till din service-funktion som gör själva uträkningen
     try:
-        results = calculate_best_basket(request.items, db)
+        results = await calculate_best_basket_async(
+            request.items, db, time_budget_ms=request.time_budget_ms, k=request.k,
+            constraints=request.constraints(), debug=request.debug
+        )
         return results
+    except SolverBusy:
+        raise _busy()
     except Exception as e:
         print(f"Fel vid optimering: {e}")
-        raise HTTPException(status_code=500, detail="Ett fel uppstod vid optimeringen")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Ett fel uppstod vid optimeringen")
+
+@router.post("/batch")
+async def optimize_batch(request: BatchOptimizeRequest, db: Session = Depends(get_db)):
+    """
+    Optimerar många korgar i ett anrop. Svaret strömmas som NDJSON, en rad per korg
+    i den ordning de blir klara: {"index": i, "results": [...]} eller {"index": i, "error": "..."}.
+    index pekar på korgens position i anropet.
+    """
+    if solver_pool.saturated():
+        raise _busy()
+
+    try:
+        stream = await stream_best_baskets(request.carts, db, time_budget_ms=request.time_budget_ms)
+    except Exception as e:
+        print(f"Fel vid batch-optimering: {e}")
+        raise HTTPException(status_code=500, detail="Ett fel uppstod vid optimeringen")
+
+    async def ndjson():
+        async for index, results, error in stream:
+            line = {"index": index, "results": results} if error is None else {"index": index, "error": error}
+            yield json.dumps(line) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+# --- Kundvagnssessioner ---
+# Frontend skapar en session och skickar sedan bara ändringarna. Varje ändring
+# varmstartas från förra optimum, så vanliga små ändringar går snabbt att lösa om.
+
+def _cart_response(token, items, results):
+    return {
+        "token": token,
+        "items": [{"product_id": pid, "quantity": qty} for pid, qty in items.items()],
+        "results": results
+    }
+
+async def _cart_call(call):
+    try:
+        return await call
+    except CartSessionNotFound:
+        raise HTTPException(status_code=404, detail="Kundvagnen hittades inte (eller har gått ut)")
+    except CartSessionUnavailable:
+        raise HTTPException(status_code=503, detail="Kundvagnssessioner är inte tillgängliga just nu")
+    except SolverBusy:
+        raise _busy()
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Fel i kundvagnssession: {e}")
+        raise HTTPException(status_code=500, detail="Ett fel uppstod vid optimeringen")
+
+@router.post("/cart")
+async def create_cart(request: OptimizeRequest, db: Session = Depends(get_db)):
+    """
+    Skapar en kundvagnssession och returnerar token plus optimerad korg.
+    k och villkoren (max_stores, butiker, delivery) sparas och gäller även för senare ändringar.
+    """
+    items = {item.product_id: item.quantity for item in request.items}
+    token, results = await _cart_call(create_cart_session(
+        items, db, request.time_budget_ms, k=request.k, constraints=request.constraints(), debug=request.debug
+    ))
+    return _cart_response(token, items, results)
+
+@router.patch("/cart/{token}")
+async def update_cart(token: str, request: CartUpdateRequest, db: Session = Depends(get_db)):
+    """Ändrar antal (0 = ta bort) för några produkter och returnerar den nya optimala korgen."""
+    changes = {item.product_id: item.quantity for item in request.items}
+    items, results = await _cart_call(update_cart_session(token, changes, db, request.time_budget_ms, debug=request.debug))
+    return _cart_response(token, items, results)
+
+@router.get("/cart/{token}")
+async def read_cart(token: str):
+    items, results = await _cart_call(get_cart_session(token))
+    return _cart_response(token, items, results)
+
+@router.delete("/cart/{token}", status_code=204)
+async def delete_cart(token: str):
+    await _cart_call(delete_cart_session(token))
@@ -1,29 +1,59 @@
+import json
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session, selectinload, joinedload
 from sqlalchemy import or_, desc, asc, func
 
 from app.db.session import get_db
 from app.models import Product, ProductPrice, Store, Category
-from app.services.affiliate import generate_tracking_link  # <--- NY IMPORT
+from app.services.affiliate import tracking_url_for
+from app.services.pagination import (
+    paginate, sort_spec, price_summary_subquery, InvalidCursor, MAX_PAGE_SIZE, EXPORT_BATCH_SIZE
+)
+
+PRODUCT_SORTS = ("popularity", "price_asc", "price_desc", "rating_desc", "name_asc", "newest")
 
 router = APIRouter()
 
-@router.get("/")
-def get_products(
-    db: Session = Depends(get_db),
-    skip: int = 0,
-    limit: int = 50,
-    category_id: Optional[int] = None,
-    category_ids: Optional[List[int]] = Query(None), 
-    search: Optional[str] = None,
-    sort: Optional[str] = None
-):
-    """
-    Hämta produkter med paginering och sortering.
-    Returnerar ett objekt: { "data": [produkter], "total": int }
-    """
-    
+def _list_item(p):
+    """En produkt i listformat (används av listningen och exporten)."""
+    price_list = []
+    for price in p.prices:
+        if price.store:
+            # Förberäknad vid import (se ProductPrice.tracking_url)
+            tracking_url = tracking_url_for(price, price.store)
+
+            price_list.append({
+                "store": price.store.name,
+                "price": price.price,
+                "url": tracking_url  # Använd den genererade länken
+            })
+
+    price_list.sort(key=lambda x: x['price'])
+    rating = getattr(p, "rating", 0)
+
+    # Bygg kategori-strukturen för listan
+    category_data = None
+    if p.category:
+        category_data = {
+            "name": p.category.name,
+            "slug": p.category.slug,
+        }
+
+    return {
+        "id": p.id,
+        "name": p.name,
+        "ean": p.ean,
+        "slug": p.slug,
+        "image_url": p.image_url,
+        "category_id": p.category_id,
+        "category": category_data,
+        "rating": rating,
+        "prices": price_list
+    }
+
+def _filtered_products(db, category_id=None, category_ids=None, search=None):
     # Vi inkluderar även kategori-objektet här så att produktlistor kan bygga länkar direkt
     query = db.query(Product).options(
         selectinload(Product.prices).joinedload(ProductPrice.store),
@@ -40,87 +70,81 @@ def get_products(
     if search:
         search_filter = f"%{search}%"
         query = query.filter(Product.name.ilike(search_filter))
+    return query
 
-    # --- RÄKNA TOTALEN ---
-    total_count = query.count()
-
-    # 3. Sortering
-    if sort == "price_asc" or sort == "price_desc":
-        # Use a subquery for min price to avoid GROUP BY conflicts with eager loading
-        min_price_subq = (
-            db.query(
-                ProductPrice.product_id,
-                func.min(ProductPrice.price).label("min_price")
-            )
-            .group_by(ProductPrice.product_id)
-            .subquery()
-        )
-        query = query.outerjoin(
-            min_price_subq, Product.id == min_price_subq.c.product_id
-        )
-        if sort == "price_asc":
-            query = query.order_by(min_price_subq.c.min_price.asc().nullslast())
-        else:
-            query = query.order_by(min_price_subq.c.min_price.desc().nullslast())
-            
-    elif sort == "rating_desc":
-        query = query.order_by(Product.rating.desc().nullslast())
-        
-    elif sort == "name_asc":
-        query = query.order_by(Product.name.asc())
-        
-    elif sort == "newest":
-        query = query.order_by(Product.id.desc())
+@router.get("/")
+def get_products(
+    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    category_id: Optional[int] = None,
+    category_ids: Optional[List[int]] = Query(None), 
+    search: Optional[str] = None,
+    sort: Optional[str] = None
+):
+    """
+    Hämta produkter med paginering och sortering.
+    Returnerar ett objekt: { "data": [produkter], "total": int | None, "next_cursor": str | None }
 
-    # 4. Paginering
-    if limit == -1:
-        products = query.offset(skip).all()
-    else:
-        products = query.offset(skip).limit(limit).all()
-
-    # 5. Formatera output
-    results = []
-    for p in products:
-        price_list = []
-        for price in p.prices:
-            if price.store:
-                # --- GENERERA TRACKING LÄNK HÄR ---
-                tracking_url = generate_tracking_link(price.url, price.store)
-                
-                price_list.append({
-                    "store": price.store.name,
-                    "price": price.price,
-                    "url": tracking_url  # Använd den genererade länken
-                })
-
-        price_list.sort(key=lambda x: x['price'])
-        rating = getattr(p, "rating", 0) 
-
-        # Bygg kategori-strukturen för listan
-        category_data = None
-        if p.category:
-            category_data = {
-                "name": p.category.name,
-                "slug": p.category.slug,
-            }
+    Nästa sida hämtas med cursor=next_cursor (samma filter och sortering); next_cursor är
+    None på sista sidan. total räknas bara på första sidan (utan cursor) och är None därefter.
+    Hela katalogen hämtas med /products/export.
+    """
+    query = _filtered_products(db, category_id, category_ids, search)
 
-        results.append({
-            "id": p.id,
-            "name": p.name,
-            "ean": p.ean,
-            "slug": p.slug,
-            "image_url": p.image_url,
-            "category_id": p.category_id,
-            "category": category_data,
-            "rating": rating,
-            "prices": price_list
-        })
+    # --- RÄKNA TOTALEN (bara på första sidan) ---
+    total_count = query.count() if not cursor else None
+
+    # 3. Sortering (utan sort: populärast först)
+    sort = sort if sort in PRODUCT_SORTS else "popularity"
+    prices = None
+    if sort in ("price_asc", "price_desc"):
+        # Lägsta pris som subquery, så att sorteringen inte krockar med eager loading
+        prices = price_summary_subquery(db)
+        query = query.outerjoin(prices, Product.id == prices.c.product_id)
+
+    # 4. Paginering
+    try:
+        products, next_cursor = paginate(query, sort_spec(sort, prices), sort, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {
-        "data": results,
-        "total": total_count
+        "data": [_list_item(p) for p in products],
+        "total": total_count,
+        "next_cursor": next_cursor
     }
 
+@router.get("/export")
+def export_products(
+    db: Session = Depends(get_db),
+    category_id: Optional[int] = None,
+    category_ids: Optional[List[int]] = Query(None),
+    search: Optional[str] = None,
+    after_id: int = Query(0, ge=0),
+    until_id: Optional[int] = Query(None, ge=0)
+):
+    """
+    Hela (filtrerade) katalogen som NDJSON, en produkt per rad i id-ordning.
+    Läses i batchar med keyset-paginering, så minnet hålls konstant oavsett katalogens storlek.
+    after_id/until_id begränsar exporten till id i (after_id, until_id], t.ex. en sitemap-del.
+    """
+    query = _filtered_products(db, category_id, category_ids, search)
+    if until_id is not None:
+        query = query.filter(Product.id <= until_id)
+
+    def ndjson():
+        last_id = after_id
+        while True:
+            batch = query.filter(Product.id > last_id).order_by(Product.id).limit(EXPORT_BATCH_SIZE).all()
+            for p in batch:
+                yield json.dumps(_list_item(p)) + "\n"
+            if len(batch) < EXPORT_BATCH_SIZE:
+                return
+            last_id = batch[-1].id
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @router.get("/{id_or_slug}")
 def get_product_details(id_or_slug: str, db: Session = Depends(get_db)):
     """
@@ -148,7 +172,7 @@ def get_product_details(id_or_slug: str, db: Session = Depends(get_db)):
     price_list = []
     for price in product.prices:
         if price.store:
-            tracking_url = generate_tracking_link(price.url, price.store)
+            tracking_url = tracking_url_for(price, price.store)
             
             price_list.append({
                 "store": price.store.name,
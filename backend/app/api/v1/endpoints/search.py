@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, Query
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Literal
 from app.db.session import get_db
 from app.models import Product, ProductPrice, Store, Category
+from app.services.search import ranked_product_ids, resolve_mode, TRGM_THRESHOLD
+from app.services import autocomplete
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -21,62 +24,61 @@ def get_search_suggestions(
 ):
     """
     Returnerar förslag på kategorier, varumärken och produkter.
+    Besvaras från workerns index i minnet (se services/autocomplete) när det är byggt,
+    annars från databasen med samma regel, så att svaret inte beror på om indexet hunnit byggas:
+    kategorier och produkter matchar från början av ett ord i namnet (inte mitt i ett ord),
+    märken från början av märket. Produkterna sorteras populärast först, kategorierna på namn.
+    SEARCH_MODE gäller bara /search, inte förslagen.
     """
-    query = q.lower()
+    suggestions = autocomplete.suggest(q)
+    if suggestions is not None:
+        return suggestions
 
-    # Kategorier
-    categories_query = (
-        db.query(Category)
-        .filter(Category.name.ilike(f"%{query}%"))
-        .limit(3)
-        .all()
-    )
+    query = q.lower().strip()
 
-    categories_data = []
-    for cat in categories_query:
-        parent_name = cat.parent.name if cat.parent else None
-        parent_slug = cat.parent.slug if cat.parent else None
-        
-        categories_data.append({
-            "id": cat.id,
-            "name": cat.name,
-            "slug": cat.slug,
-            "parent_name": parent_name,
-            "parent_slug": parent_slug
-        })
+    # Kategorier (föräldern hämtas i samma fråga)
+    categories_data = [
+        {"id": cid, "name": name, "slug": slug, "parent_name": parent_name, "parent_slug": parent_slug}
+        for cid, name, slug, parent_name, parent_slug in (
+            autocomplete.category_suggestions_query(db)
+            .filter(autocomplete.word_prefix_match(Category.name, q))
+            .order_by(*autocomplete.category_order())
+            .limit(3)
+            .all()
+        )
+    ]
 
-    # Varumärken
+    # Varumärken (i bokstavsordning, som indexet)
     brands_query = (
-        db.query(Product.brand)
-        .filter(Product.brand.ilike(f"{query}%"))
-        .filter(Product.brand.isnot(None))
-        .distinct()
+        autocomplete.brand_suggestions_query(db)
+        .filter(func.lower(Product.brand).startswith(query, autoescape=True))
+        .order_by(func.lower(Product.brand).collate("C"))
         .limit(3)
         .all()
     )
     brands = [b[0] for b in brands_query if b[0]]
 
-    # Produkter
+    # Produkter med lägsta pris och kategori i en aggregerad fråga
     products_query = (
-        db.query(Product)
-        .join(ProductPrice)
-        .filter(Product.name.ilike(f"%{query}%"))
+        autocomplete.product_suggestions_query(db)
+        .filter(autocomplete.word_prefix_match(Product.name, q))
+        .order_by(*autocomplete.product_order())
         .limit(5)
         .all()
     )
 
-    products_data = []
-    for p in products_query:
-        min_price = min((price.price for price in p.prices), default=0)
-        products_data.append({
-            "id": p.id,
-            "name": p.name,
-            "slug": p.slug,
-            "image_url": p.image_url,
-            "brand": p.brand,
+    products_data = [
+        {
+            "id": pid,
+            "name": name,
+            "slug": slug,
+            "image_url": image_url,
+            "brand": brand,
             "min_price": min_price,
-            "category_slug": p.category.slug if p.category else None 
-        })
+            "category_slug": category_slug
+        }
+        for pid, name, slug, image_url, brand, min_price, category_slug, _ in products_query
+    ]
 
     return {
         "categories": categories_data,
@@ -87,21 +89,38 @@ def get_search_suggestions(
 # 2. Huvudsökning (Sökresultat-sidan)
 # ÄNDRING HÄR: @router.get("") istället för @router.get("/")
 @router.get("")
-def search(q: str, db: Session = Depends(get_db)):
+def search(
+    q: str,
+    mode: Optional[Literal["substring", "trigram", "fulltext"]] = None,
+    threshold: float = Query(TRGM_THRESHOLD, ge=0, le=1),
+    db: Session = Depends(get_db)
+):
     """
     Sök endpoint som matchar det format din frontend förväntar sig.
     Returnerar en platt lista av produkter.
+
+    mode=trigram rankar på likhet (tål stavfel, bäst först och sedan populärast) och
+    varje produkt får "score". threshold är lägsta likhet för en träff.
+    mode=fulltext söker med svensk stämning ("krämer" hittar "kräm", ordföljden spelar
+    ingen roll) och rankar på ts_rank_cd, kompletterat med trigramlikhet om pg_trgm finns.
+    Utan mode gäller SEARCH_MODE.
     """
     if not q or len(q) < 2:
         return []
 
-    # Sökning med joins för att få med priser och butiker
-    query_result = db.query(Product, ProductPrice, Store)\
+    scores = None
+    query = db.query(Product, ProductPrice, Store)\
         .join(ProductPrice, Product.id == ProductPrice.product_id)\
-        .join(Store, ProductPrice.store_id == Store.id)\
-        .filter(Product.name.ilike(f"%{q}%"))\
-        .limit(200)\
-        .all()
+        .join(Store, ProductPrice.store_id == Store.id)
+
+    resolved = resolve_mode(db, mode)
+    if resolved in ("trigram", "fulltext"):
+        # Rankningen och gränsen tas fram på produkterna först, priserna hämtas bara för träffarna
+        scores = dict(ranked_product_ids(db, q, threshold=threshold, mode=resolved))
+        query_result = query.filter(Product.id.in_(list(scores))).all() if scores else []
+    else:
+        # Sökning med joins för att få med priser och butiker
+        query_result = query.filter(Product.name.ilike(f"%{q}%")).limit(200).all()
 
     results_map = {}
     
@@ -115,6 +134,8 @@ def search(q: str, db: Session = Depends(get_db)):
                 "image_url": product.image_url,
                 "prices": []
             }
+            if scores is not None:
+                results_map[product.id]["score"] = round(scores[product.id], 3)
         
         results_map[product.id]["prices"].append({
             "store": store.name,
@@ -124,4 +145,7 @@ def search(q: str, db: Session = Depends(get_db)):
             "url": price.url
         })
     
+    if scores is not None:
+        # Samma ordning som rankningen (dict behåller den)
+        return [results_map[pid] for pid in scores if pid in results_map]
     return list(results_map.values())
\ No newline at end of file
@@ -5,14 +5,26 @@ import sys
 # Exempel output: 2025-01-02 10:00:00 [INFO] priskombo.importer: Startar import...
 LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 
+class FieldsFormatter(logging.Formatter):
+    """
+    Strukturerade fält: logger.info("...", extra={"fields": {"nodes": 12}}) skrivs som
+    key=value efter meddelandet, så att de går att söka och filtrera på i loggarna.
+    """
+
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
 def setup_logging():
     """Konfigurerar grundläggande loggning för applikationen."""
+    handler = logging.StreamHandler(sys.stdout) # Skriv till standard output (för Docker)
+    handler.setFormatter(FieldsFormatter(LOG_FORMAT))
     logging.basicConfig(
         level=logging.INFO,  # Fångar INFO, WARNING, ERROR (men inte DEBUG)
-        format=LOG_FORMAT,
-        handlers=[
-            logging.StreamHandler(sys.stdout) # Skriv till standard output (för Docker)
-        ]
+        handlers=[handler]
     )
 
 def get_logger(name: str):
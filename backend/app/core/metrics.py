@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from app.core.logging import get_logger
+
+logger = get_logger("metrics")
+
+# Alla workers räknar upp samma Redis-hash, så /metrics visar summan oavsett vilken worker som svarar
+METRICS_KEY = "metrics:samples"
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+def _format_le(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus-registry (räknare och histogram) utan externa beroenden.
+
+    Mätvärden räknas upp i processen och skickas som deltan till Redis (HINCRBYFLOAT)
+    av en bakgrundstråd, och när /metrics läses. Utan Redis visas bara den egna processen.
+    """
+
+    def __init__(self, key=METRICS_KEY):
+        self.key = key
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._buckets = {}
+        self._totals = defaultdict(float)
+        self._pending = defaultdict(float)
+        self._flusher = None
+
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._meta[name] = ("histogram", help_text)
+        self._buckets[name] = tuple(sorted(buckets)) + (float("inf"),)
+
+    def inc(self, name, amount=1.0, **labels):
+        self._add([(f"{name}{_format_labels(labels)}", amount)])
+
+    def observe(self, name, value, **labels):
+        samples = [
+            (f"{name}_bucket{_format_labels({**labels, 'le': _format_le(bound)})}", 1.0)
+            for bound in self._buckets[name] if value <= bound
+        ]
+        samples.append((f"{name}_sum{_format_labels(labels)}", value))
+        samples.append((f"{name}_count{_format_labels(labels)}", 1.0))
+        self._add(samples)
+
+    def _add(self, samples):
+        with self._lock:
+            for sample, amount in samples:
+                self._totals[sample] += amount
+                self._pending[sample] += amount
+
+    def flush(self, client):
+        """Skickar det som räknats sedan förra gången till Redis. Misslyckas det försöks det igen nästa gång."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+        if not pending or not client:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for sample, amount in pending.items():
+                pipe.hincrbyfloat(self.key, sample, amount)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Kunde inte skicka mätvärden till Redis: {e}")
+            with self._lock:
+                for sample, amount in pending.items():
+                    self._pending[sample] += amount
+
+    def start_flushing(self, client, interval=METRICS_FLUSH_SECONDS):
+        """Startar bakgrundstråden (en per worker-process)."""
+        if self._flusher is not None or not client:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.flush(client)
+
+        self._flusher = threading.Thread(target=loop, name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def samples(self, client=None):
+        """{sample: värde}: summan över alla workers om Redis finns, annars denna process."""
+        if client:
+            self.flush(client)
+            try:
+                return {sample: float(value) for sample, value in client.hgetall(self.key).items()}
+            except Exception as e:
+                logger.warning(f"⚠️ Kunde inte läsa mätvärden från Redis: {e}")
+        with self._lock:
+            return dict(self._totals)
+
+    def render(self, client=None):
+        """Prometheus textformat (version 0.0.4)."""
+        by_metric = defaultdict(list)
+        for sample, value in self.samples(client).items():
+            series = sample.split("{", 1)[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                base = series[:-len(suffix)]
+                if series.endswith(suffix) and self._meta.get(base, ("",))[0] == "histogram":
+                    series = base
+                    break
+            by_metric[series].append((sample, value))
+
+        lines = []
+        for name in sorted(by_metric):
+            kind, help_text = self._meta.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, value in sorted(by_metric[name], key=lambda item: _sort_key(item[0])):
+                lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _sort_key(sample):
+    """Håller ihop varje serie och sorterar histogrammens hinkar på gränsen."""
+    if 'le="' not in sample:
+        return (sample, 0.0)
+    head, rest = sample.split('le="', 1)
+    bound = rest.split('"', 1)[0]
+    return (head + rest.split('"', 1)[1], float("inf") if bound == "+Inf" else float(bound))
+
+
+metrics = MetricsRegistry()
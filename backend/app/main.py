@@ -1,10 +1,17 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.core.logging import setup_logging, get_logger
+from app.core.metrics import metrics
 
 # Services
 from app.services.scheduler import start_scheduler, scheduler, download_and_import_job
+from app.services.basket_cache import redis_client
+from app.services.autocomplete import start_autocomplete
+from app.services.solver_pool import solver_pool
+from app.services.optimizer import shutdown_component_pool
+from app.db.session import SessionLocal
 
 # Router (Samlingsfilen vi skapade)
 from app.api.v1.api import api_router
@@ -22,6 +29,10 @@ async def lifespan(app: FastAPI):
         start_scheduler()
     except Exception as e:
         logger.error(f"Kunde inte starta scheduler: {e}")
+    # Varje worker skickar sina mätvärden till Redis, se /metrics
+    metrics.start_flushing(redis_client)
+    # Sökförslagen byggs i minnet i bakgrunden; tills dess svarar databasen
+    start_autocomplete(SessionLocal, redis_client)
     
     yield  # Här körs applikationen
     
@@ -32,6 +43,11 @@ async def lifespan(app: FastAPI):
             scheduler.shutdown()
     except Exception as e:
         logger.warning(f"Kunde inte stänga scheduler snyggt: {e}")
+    try:
+        solver_pool.shutdown()
+        shutdown_component_pool()
+    except Exception as e:
+        logger.warning(f"Kunde inte stänga lösarprocesserna snyggt: {e}")
 
 # 3. Initiera appen
 app = FastAPI(
@@ -70,6 +86,11 @@ def read_root():
 def health_check():
     return {"status": "ok", "message": "I am awake!"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus-format, summerat över alla workers (via Redis)."""
+    return PlainTextResponse(metrics.render(redis_client), media_type="text/plain; version=0.0.4")
+
 # 7. UTILITY ENDPOINTS (För dev/test)
 @app.post("/force-import")
 def force_import(background_tasks: BackgroundTasks):
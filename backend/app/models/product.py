@@ -1,8 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Text, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Text, DateTime, Index, DDL, event, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from app.db.session import Base
 from datetime import datetime, timezone
 
+# Textsökningskonfigurationen för search_vector: svensk stämning, plus unaccent om tillägget finns
+FULLTEXT_CONFIG = "swedish_unaccent"
+
 class Product(Base):
     __tablename__ = "products"
     id = Column(Integer, primary_key=True, index=True)
@@ -16,10 +20,17 @@ class Product(Base):
     popularity_score = Column(Integer, default=0)
     rating = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Namn (A), märke (B) och kategorinamn (C) för fulltextsökning. Underhålls av triggers
+    # i databasen (se migration c5d2a8e4f1b7), eftersom kategorinamnet ligger i en annan tabell.
+    search_vector = Column(TSVECTOR, nullable=True)
 
     category = relationship("Category", back_populates="products")
     prices = relationship("ProductPrice", back_populates="product")
 
+    __table_args__ = (
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
 class ProductPrice(Base):
     __tablename__ = "product_prices"
     id = Column(Integer, primary_key=True, index=True)
@@ -29,7 +40,74 @@ class ProductPrice(Base):
     regular_price = Column(Float, nullable=True)
     discount_percent = Column(Integer, default=0)
     url = Column(Text)
+    # generate_tracking_link(url, store), förberäknad vid import. Räknas om med
+    # "manage.py rebuild-tracking-links" när butikens affiliate-uppgifter ändras.
+    tracking_url = Column(Text, nullable=True)
     updated_at = Column(DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
 
     product = relationship("Product", back_populates="prices")
     store = relationship("Store", back_populates="prices")
+
+# Sorteringsnycklar för keyset-pagineringen (services/pagination). De är NULL-säkra (coalesce)
+# så att de kan jämföras som en rad: (k1, k2, id) > (v1, v2, v3). Popularitet sorteras fallande
+# men namnet stigande, därför negeras populariteten så att hela nyckeln går åt samma håll.
+popularity_key = -func.coalesce(Product.popularity_score, 0)
+name_key = func.coalesce(Product.name, "")
+rating_key = func.coalesce(Product.rating, -1)
+
+# Index som matchar nycklarna (migration e8f4b1c7d2a9). Prissorteringen bygger på
+# ett aggregat över priserna och kan inte indexeras på samma sätt.
+Index("ix_products_popularity_keyset", popularity_key, name_key, Product.id)
+Index("ix_products_category_popularity_keyset", Product.category_id, popularity_key, name_key, Product.id)
+Index("ix_products_name_keyset", name_key, Product.id)
+Index("ix_products_rating_keyset", rating_key, Product.id)
+
+# Samma konfiguration och triggers som migrationen, för databaser som skapas med create_all (init-db, testerna)
+SEARCH_VECTOR_DDL = [
+    f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{FULLTEXT_CONFIG}') THEN
+            CREATE TEXT SEARCH CONFIGURATION {FULLTEXT_CONFIG} (COPY = swedish);
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'unaccent') THEN
+                CREATE EXTENSION IF NOT EXISTS unaccent;
+                ALTER TEXT SEARCH CONFIGURATION {FULLTEXT_CONFIG}
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, swedish_stem;
+            END IF;
+        END IF;
+    END $$
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{FULLTEXT_CONFIG}', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('{FULLTEXT_CONFIG}', coalesce(NEW.brand, '')), 'B') ||
+            setweight(to_tsvector('{FULLTEXT_CONFIG}',
+                coalesce((SELECT name FROM categories WHERE id = NEW.category_id), '')), 'C');
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER products_search_vector
+    BEFORE INSERT OR UPDATE OF name, brand, category_id ON products
+    FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION categories_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        -- Räknar om produkternas vektor via produkttriggern
+        UPDATE products SET category_id = category_id WHERE category_id = NEW.id;
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER categories_search_vector
+    AFTER UPDATE OF name ON categories
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION categories_search_vector_update()
+    """,
+]
+
+for statement in SEARCH_VECTOR_DDL:
+    event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
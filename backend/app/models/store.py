@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, JSON
 from sqlalchemy.orm import relationship
 from app.db.session import Base
 
@@ -8,6 +8,9 @@ class Store(Base):
     name = Column(String, unique=True)
     base_shipping = Column(Float, default=0.0)
     free_shipping_limit = Column(Float, nullable=True)
+    # Frakttabeller per leveranssätt, ersätter base_shipping/free_shipping_limit för det sättet:
+    # {"pickup": {"tiers": [[0, 49], [299, 29], [599, 0]], "per_item": 0}, "home": {...}}
+    shipping_rules = Column(JSON, nullable=True)
     prices = relationship("ProductPrice", back_populates="store")
     affiliate_network = Column(String)
     affiliate_program_id = Column(String)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Dict, Any
 from pydantic import BaseModel, ConfigDict
 
 class StoreBase(BaseModel):
@@ -8,5 +8,6 @@ class Store(StoreBase):
     id: int
     base_shipping: float = 0
     free_shipping_limit: Optional[float] = None
+    shipping_rules: Optional[Dict[str, Any]] = None
 
     model_config = ConfigDict(from_attributes=True)
@@ -1,10 +1,25 @@
 import urllib.parse
 import os
+from collections import namedtuple
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from app.models import ProductPrice, Store
+from app.core.logging import get_logger
+from app.services.basket_cache import bump_product_versions
+
+logger = get_logger("affiliate")
 
 # Hämta dina unika affiliate-IDn från miljövariabler
 MY_ADTRACTION_CHANNEL_ID = os.getenv("ADTRACTION_CHANNEL_ID")
 MY_ADRECORD_CHANNEL_ID = os.getenv("ADRECORD_CHANNEL_ID")
 
+# Butikens affiliate-uppgifter, det enda generate_tracking_link behöver från butiken.
+# Går att skicka till lösarprocesserna och fungerar som store-argument.
+AffiliateInfo = namedtuple("AffiliateInfo", ["affiliate_network", "affiliate_program_id"])
+
+def affiliate_info(store) -> AffiliateInfo:
+    return AffiliateInfo(store.affiliate_network, store.affiliate_program_id)
+
 def generate_tracking_link(clean_url: str, store) -> str:
     """
     Genererar en tracking-länk baserat på butikens affiliate-nätverk.
@@ -22,4 +37,52 @@ def generate_tracking_link(clean_url: str, store) -> str:
 
     # Lägg till fler nätverk här (Awin, Tradedoubler osv.)
 
-    return clean_url
\ No newline at end of file
+    return clean_url
+
+def tracking_url_for(price, store) -> str:
+    """Prisradens förberäknade länk, eller en nyräknad om raden inte fyllts i än."""
+    if price.tracking_url is not None:
+        return price.tracking_url
+    return generate_tracking_link(price.url, store)
+
+REBUILD_BATCH_SIZE = 1000
+
+def rebuild_tracking_links(db: Session, store_ids=None, batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """
+    Räknar om tracking_url för alla prisrader (eller bara butikerna i store_ids), t.ex. när
+    en butiks affiliate_network/affiliate_program_id har ändrats.
+    Raderna läses med en server-side cursor på en egen anslutning och skrivs i batchar
+    med en commit per batch. Returnerar antalet ändrade rader.
+    """
+    stores = db.query(Store)
+    if store_ids:
+        stores = stores.filter(Store.id.in_(store_ids))
+    affiliates = {store.id: affiliate_info(store) for store in stores}
+    if not affiliates:
+        return 0
+
+    query = (
+        select(ProductPrice.id, ProductPrice.product_id, ProductPrice.store_id, ProductPrice.url, ProductPrice.tracking_url)
+        .where(ProductPrice.store_id.in_(list(affiliates)))
+        .order_by(ProductPrice.id)
+    )
+    updated = 0
+    with db.get_bind().connect() as conn:
+        rows = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+        for batch in rows.partitions():
+            changes = []
+            product_ids = set()
+            for price_id, product_id, store_id, url, current in batch:
+                link = generate_tracking_link(url, affiliates[store_id])
+                if link != current:
+                    changes.append({"id": price_id, "tracking_url": link})
+                    product_ids.add(product_id)
+            if not changes:
+                continue
+            db.execute(update(ProductPrice), changes)
+            db.commit()
+            # Cachade erbjudanden och korgar innehåller länkarna
+            bump_product_versions(product_ids)
+            updated += len(changes)
+            logger.info(f"   🔗 {updated} länkar uppdaterade...")
+    return updated
\ No newline at end of file
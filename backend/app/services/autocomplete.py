@@ -0,0 +1,359 @@
+import bisect
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+from app.models import Product, ProductPrice, Category
+from app.core.logging import get_logger
+from app.services.basket_cache import redis_client
+
+logger = get_logger("autocomplete")
+
+# Importerna publicerar ändrade produkter här; varje worker uppdaterar sitt eget index
+AUTOCOMPLETE_CHANNEL = "autocomplete:changes"
+AUTOCOMPLETE_ENABLED = os.getenv("AUTOCOMPLETE_ENABLED", "true").lower() == "true"
+# Full ombyggnad med jämna mellanrum, ifall ett meddelande missats (t.ex. om Redis var nere)
+AUTOCOMPLETE_REFRESH_SECONDS = int(os.getenv("AUTOCOMPLETE_REFRESH_SECONDS", "3600"))
+# Nya nycklar samlas i en liten sorterad lista och slås ihop med huvudlistan när den blir så här stor
+MAX_DELTA_KEYS = 10_000
+# Prefix med fler nycklar än så här (t.ex. "s") rankas genom att gå igenom produkterna i
+# rankningsordning i stället för att samla och sortera alla träffar
+RANKED_WALK_THRESHOLD = 2_000
+
+ProductEntry = namedtuple(
+    "ProductEntry", ["id", "name", "slug", "image_url", "brand", "min_price", "category_slug", "popularity", "keys"]
+)
+CategoryEntry = namedtuple("CategoryEntry", ["id", "name", "slug", "parent_name", "parent_slug", "keys"])
+
+_WORD_START = re.compile(r"(?<!\w)\w")
+
+
+def search_keys(text):
+    """Texten från varje ordbörjan: "Sony WH-1000" -> {"sony wh-1000", "wh-1000", "1000"}."""
+    text = (text or "").lower().strip()
+    return frozenset(text[m.start():] for m in _WORD_START.finditer(text))
+
+
+def word_prefix_match(column, q):
+    """
+    Samma regel som indexet, i SQL: q matchar från början av något ord i kolumnen
+    ("son" matchar "Sony WH-1000", "1000" också, men inte "Parasony"). \\m är ordbörjan
+    i Postgres regex; re.escape gör resten av q till bokstavlig text.
+    """
+    return column.op("~*")(r"\m" + re.escape(q.lower().strip()))
+
+
+def _range_size(keys, prefix):
+    """Antal nycklar som börjar med prefix."""
+    return bisect.bisect_left(keys, (prefix + "\U0010ffff",)) - bisect.bisect_left(keys, (prefix,))
+
+
+def _scan(keys, prefix, is_valid, found):
+    """Lägger till alla id:n vars nyckel börjar med prefix (hela prefixintervallet, så att rankningen ser alla)."""
+    for i in range(bisect.bisect_left(keys, (prefix,)), len(keys)):
+        key, item_id = keys[i]
+        if not key.startswith(prefix):
+            return
+        if item_id not in found and is_valid(key, item_id):
+            found.add(item_id)
+
+
+# Samma ordning som databasvägen i /search/suggestions (product_order/category_order):
+# gemena namn jämförs i kodpunktsordning, vilket är COLLATE "C" i Postgres, och sist id
+def product_rank(entry):
+    return (-entry.popularity, entry.name.lower(), entry.id)
+
+
+def category_rank(entry):
+    return (entry.name.lower(), entry.id)
+
+
+def product_order():
+    return (func.coalesce(Product.popularity_score, 0).desc(), func.lower(Product.name).collate("C"), Product.id)
+
+
+def category_order():
+    return (func.lower(Category.name).collate("C"), Category.id)
+
+
+class AutocompleteIndex:
+    """
+    Prefixindex i minnet över kategorier, märken och produkter (med lägsta pris).
+
+    Nycklarna är sorterade listor av (nyckel, id) och slås upp med bisect. Ändrade
+    produkter läggs i en delta-lista i stället för att sorteras in i den stora listan;
+    gamla nycklar ligger kvar tills nästa sammanslagning men filtreras bort vid uppslag.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.categories = {}
+        self.products = {}
+        self.brands = {}
+        self._category_keys = []
+        self._product_keys = []
+        self._delta_keys = []
+        self._ranked = []
+        self._brand_keys = []
+        self.built_at = None
+
+    # --- Byggnad ---
+    def build(self, db: Session):
+        """Läser hela katalogen (tre frågor) och ersätter indexet."""
+        categories = {row.id: row for row in _load_categories(db)}
+        products = {entry.id: entry for entry in _load_products(db)}
+        brands = {brand.lower(): brand for (brand,) in brand_suggestions_query(db)}
+
+        category_keys = sorted((key, cid) for cid, entry in categories.items() for key in entry.keys)
+        product_keys = sorted((key, pid) for pid, entry in products.items() for key in entry.keys)
+        ranked = sorted((product_rank(entry), pid) for pid, entry in products.items())
+        with self._lock:
+            self.categories = categories
+            self.products = products
+            self.brands = brands
+            self._category_keys = category_keys
+            self._product_keys = product_keys
+            self._delta_keys = []
+            self._ranked = ranked
+            self._brand_keys = sorted(brands)
+            self.built_at = time.monotonic()
+        logger.info(f"🔤 Autocomplete-index byggt: {len(products)} produkter, {len(categories)} kategorier, {len(brands)} märken")
+
+    def update_products(self, db: Session, product_ids):
+        """Läser om produkterna; de som inte längre har något pris försvinner ur förslagen."""
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        fresh = {entry.id: entry for entry in _load_products(db, product_ids)}
+        with self._lock:
+            for pid in product_ids:
+                old = self.products.pop(pid, None)
+                entry = fresh.get(pid)
+                if entry is None:
+                    continue
+                self.products[pid] = entry
+                for key in entry.keys - (old.keys if old else frozenset()):
+                    bisect.insort(self._delta_keys, (key, pid))
+                if old is None or product_rank(old) != product_rank(entry):
+                    bisect.insort(self._ranked, (product_rank(entry), pid))
+                if entry.brand:
+                    key = entry.brand.lower()
+                    if key not in self.brands:
+                        bisect.insort(self._brand_keys, key)
+                    # Samma stavning som brand_suggestions_query väljer
+                    if key not in self.brands or entry.brand < self.brands[key]:
+                        self.brands[key] = entry.brand
+            if len(self._delta_keys) > MAX_DELTA_KEYS:
+                self._merge_delta()
+
+    def _merge_delta(self):
+        """Slår ihop delta med huvudlistan och rensar bort nycklar som inte längre gäller."""
+        merged = sorted(self._product_keys + self._delta_keys)
+        self._product_keys = [(key, pid) for key, pid in merged if self._product_key_valid(key, pid)]
+        self._delta_keys = []
+        self._ranked = [(rank, pid) for rank, pid in self._ranked if self._rank_valid(rank, pid)]
+
+    def _product_key_valid(self, key, pid):
+        entry = self.products.get(pid)
+        return entry is not None and key in entry.keys
+
+    def _rank_valid(self, rank, pid):
+        entry = self.products.get(pid)
+        return entry is not None and product_rank(entry) == rank
+
+    def _top_products(self, prefix, n):
+        """De n högst rankade produkterna med en nyckel som börjar med prefix."""
+        if _range_size(self._product_keys, prefix) <= RANKED_WALK_THRESHOLD:
+            product_ids = set()
+            _scan(self._product_keys, prefix, self._product_key_valid, product_ids)
+            _scan(self._delta_keys, prefix, self._product_key_valid, product_ids)
+            return heapq.nsmallest(n, (self.products[pid] for pid in product_ids), key=product_rank)
+
+        # Många träffar: i rankningsordning hittas de första n snabbt
+        products, seen = [], set()
+        for rank, pid in self._ranked:
+            if len(products) >= n:
+                break
+            entry = self.products.get(pid)
+            if pid not in seen and self._rank_valid(rank, pid) and any(key.startswith(prefix) for key in entry.keys):
+                seen.add(pid)
+                products.append(entry)
+        return products
+
+    # --- Uppslag ---
+    def suggest(self, q: str, n_categories=3, n_brands=3, n_products=5):
+        """Samma format som /search/suggestions."""
+        prefix = q.lower().strip()
+        with self._lock:
+            category_ids = set()
+            _scan(self._category_keys, prefix, lambda key, cid: True, category_ids)
+            categories = heapq.nsmallest(n_categories, (self.categories[cid] for cid in category_ids), key=category_rank)
+
+            brands = []
+            for i in range(bisect.bisect_left(self._brand_keys, prefix), len(self._brand_keys)):
+                if not self._brand_keys[i].startswith(prefix) or len(brands) >= n_brands:
+                    break
+                brands.append(self.brands[self._brand_keys[i]])
+
+            products = self._top_products(prefix, n_products)
+
+        return {
+            "categories": [
+                {"id": c.id, "name": c.name, "slug": c.slug, "parent_name": c.parent_name, "parent_slug": c.parent_slug}
+                for c in categories
+            ],
+            "brands": brands,
+            "products": [
+                {
+                    "id": p.id, "name": p.name, "slug": p.slug, "image_url": p.image_url,
+                    "brand": p.brand, "min_price": p.min_price, "category_slug": p.category_slug
+                }
+                for p in products
+            ],
+        }
+
+
+def category_suggestions_query(db: Session):
+    """(id, name, slug, parent_name, parent_slug) per kategori, med föräldern i samma fråga."""
+    parent = aliased(Category)
+    return (
+        db.query(Category.id, Category.name, Category.slug, parent.name, parent.slug)
+        .outerjoin(parent, Category.parent_id == parent.id)
+    )
+
+
+def brand_suggestions_query(db: Session):
+    """
+    Ett märke per gemen stavning. Finns flera stavningar ("Sony", "SONY") väljs den
+    minsta i kodpunktsordning, i indexet och i databasvägen.
+    """
+    return (
+        db.query(func.min(Product.brand.collate("C")))
+        .filter(Product.brand.isnot(None))
+        .group_by(func.lower(Product.brand))
+    )
+
+
+def product_suggestions_query(db: Session):
+    """
+    (id, name, slug, image_url, brand, min_price, category_slug, popularity) per produkt
+    med minst ett pris. Priserna aggregeras i frågan, så varje produkt blir en rad.
+    """
+    return (
+        db.query(
+            Product.id, Product.name, Product.slug, Product.image_url, Product.brand,
+            func.min(ProductPrice.price), Category.slug, Product.popularity_score
+        )
+        .join(ProductPrice, ProductPrice.product_id == Product.id)
+        .outerjoin(Category, Product.category_id == Category.id)
+        .group_by(Product.id, Category.slug)
+    )
+
+
+def _load_categories(db: Session):
+    rows = category_suggestions_query(db).all()
+    return [CategoryEntry(cid, name, slug, p_name, p_slug, search_keys(name)) for cid, name, slug, p_name, p_slug in rows]
+
+
+def _load_products(db: Session, product_ids=None):
+    """Produkter med minst ett pris, med lägsta priset och kategorins slug (en fråga)."""
+    query = product_suggestions_query(db)
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(list(product_ids)))
+    return [
+        ProductEntry(pid, name, slug, image_url, brand, min_price, category_slug, popularity or 0, search_keys(name))
+        for pid, name, slug, image_url, brand, min_price, category_slug, popularity in query.yield_per(10_000)
+    ]
+
+
+# --- Index per worker, och meddelanden mellan processer ---
+index = None
+
+
+def suggest(q: str):
+    """Förslag från minnet, eller None om indexet inte är byggt (anroparen frågar då databasen)."""
+    current = index
+    return current.suggest(q) if current is not None else None
+
+
+def notify_products_changed(product_ids, client=None):
+    """Anropas efter commit när produkters namn, märke, kategori eller priser ändrats."""
+    _publish({"products": sorted(set(product_ids))}, client)
+
+
+def notify_rebuild(client=None):
+    """Ber alla workers bygga om indexet (t.ex. när kategoriträdet ändrats)."""
+    _publish({"rebuild": True}, client)
+
+
+def _publish(message, client=None):
+    client = client or redis_client
+    if not client or message.get("products") == []:
+        return
+    try:
+        client.publish(AUTOCOMPLETE_CHANNEL, json.dumps(message))
+    except Exception as e:
+        logger.warning(f"⚠️ Kunde inte skicka autocomplete-ändring: {e}")
+
+
+def handle_message(session_factory, payload):
+    """Applicerar ett meddelande från kanalen på indexet."""
+    global index
+    message = json.loads(payload)
+    db = session_factory()
+    try:
+        if message.get("rebuild") or index is None:
+            fresh = AutocompleteIndex()
+            fresh.build(db)
+            index = fresh
+        else:
+            index.update_products(db, message.get("products", []))
+    finally:
+        db.close()
+
+
+def _listen(session_factory, client, refresh_seconds):
+    global index
+    pubsub = None
+    if client:
+        try:
+            # Prenumerera före byggnaden, så att ändringar under tiden inte missas
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(AUTOCOMPLETE_CHANNEL)
+        except Exception as e:
+            logger.warning(f"⚠️ Autocomplete får inga ändringar via Redis: {e}")
+            pubsub = None
+
+    while True:
+        try:
+            if index is None or time.monotonic() - index.built_at >= refresh_seconds:
+                handle_message(session_factory, json.dumps({"rebuild": True}))
+            if pubsub is None:
+                time.sleep(min(refresh_seconds, 60))
+                continue
+            message = pubsub.get_message(timeout=1.0)
+            if message and message["type"] == "message":
+                handle_message(session_factory, message["data"])
+        except Exception as e:
+            logger.error(f"❌ Autocomplete-indexet kunde inte uppdateras: {e}")
+            time.sleep(5)
+
+
+_listener = None
+
+
+def start_autocomplete(session_factory, client=None, refresh_seconds=AUTOCOMPLETE_REFRESH_SECONDS):
+    """Bygger indexet och lyssnar efter ändringar i en bakgrundstråd (en per worker-process)."""
+    global _listener
+    if _listener is not None or not AUTOCOMPLETE_ENABLED:
+        return
+    _listener = threading.Thread(
+        target=_listen, args=(session_factory, client or redis_client, refresh_seconds),
+        name="autocomplete", daemon=True
+    )
+    _listener.start()
@@ -0,0 +1,362 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+import redis
+from collections import OrderedDict, Counter
+from fastapi.concurrency import run_in_threadpool
+from app.core.logging import get_logger
+
+logger = get_logger("basket_cache")
+
+redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+try:
+    redis_client = redis.from_url(redis_url, decode_responses=True)
+except Exception as e:
+    logger.warning(f"Redis error: {e}")
+    redis_client = None
+
+# Versionsräknare per produkt. Importerna räknar upp dem när priser ändras.
+VERSION_KEY = "product_version:{}"
+RESULT_PREFIX = "basket_optimization_v4"
+RESULT_TTL = 600
+L1_MAX_ENTRIES = 512
+
+# Single-flight mellan workers: ledaren håller låset, följarna pollar efter dess svar
+FLIGHT_LOCK_TTL_MS = 10_000
+FLIGHT_RESULT_TTL_MS = 5_000
+FLIGHT_POLL_SECONDS = 0.05
+
+# Tar bara bort låset om det fortfarande är vårt (det kan ha gått ut och tagits av någon annan)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def bump_product_versions(product_ids, client=None):
+    """
+    Markerar att priserna för produkterna har ändrats. Alla cachade korgar som
+    innehåller någon av dem får då en ny nyckel, övriga korgar ligger kvar.
+    """
+    client = client or redis_client
+    product_ids = set(product_ids)
+    if not client or not product_ids:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for pid in product_ids:
+            pipe.incr(VERSION_KEY.format(pid))
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"⚠️ Kunde inte uppdatera produktversioner: {e}")
+
+
+class BasketCache:
+    """
+    Tvånivåcache för optimerade korgar.
+
+    L1 är en LRU i processen (sparar Redis-anropet), L2 är Redis (delas mellan workers).
+    Nyckeln innehåller varje produkts antal och versionsnummer, så en ändrad produkt
+    ogiltigförklarar exakt de korgar den ingår i. Gamla nycklar försvinner via TTL/LRU.
+
+    Utan Redis finns inga delade versionsräknare och därmed ingen invalidering,
+    så då cachas ingenting (samma beteende som tidigare).
+    """
+
+    def __init__(self, max_entries=L1_MAX_ENTRIES, ttl=RESULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def key_for(self, client, quantity_map):
+        """Bygger nyckeln från aktuella versioner (ett MGET). None om Redis inte svarar."""
+        return self.keys_for(client, [quantity_map])[0]
+
+    def keys_for(self, client, quantity_maps):
+        """Nycklar för flera korgar med ett enda MGET över alla deras produkter."""
+        if not client:
+            return [None] * len(quantity_maps)
+        product_ids = list({pid for quantity_map in quantity_maps for pid in quantity_map})
+        try:
+            versions = dict(zip(product_ids, client.mget([VERSION_KEY.format(pid) for pid in product_ids])))
+        except Exception:
+            return [None] * len(quantity_maps)
+        keys = []
+        for quantity_map in quantity_maps:
+            parts = [f"{pid}:{qty}@{versions[pid] or 0}" for pid, qty in sorted(quantity_map.items())]
+            keys.append(f"{RESULT_PREFIX}:{','.join(parts)}")
+        return keys
+
+    def get(self, client, key):
+        return self.lookup(client, key)[0]
+
+    def lookup(self, client, key):
+        """Som get, men returnerar (resultat, nivå) där nivå är "l1", "l2" eller "miss"."""
+        if key is None:
+            return None, "miss"
+
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > time.monotonic():
+                    self._l1.move_to_end(key)
+                    self.counts["l1_hits"] += 1
+                    return json.loads(payload), "l1"
+                del self._l1[key]
+
+        try:
+            payload = client.get(key)
+        except Exception:
+            payload = None
+        if payload:
+            self._remember(key, payload)
+            self.counts["l2_hits"] += 1
+            return json.loads(payload), "l2"
+
+        self.counts["misses"] += 1
+        return None, "miss"
+
+    def set(self, client, key, results):
+        if key is None:
+            return
+        payload = json.dumps(results)
+        self._remember(key, payload)
+        try:
+            client.setex(key, self.ttl, payload)
+        except Exception as e:
+            logger.warning(f"⚠️ Kunde inte spara korg i Redis: {e}")
+
+    def get_many(self, client, keys):
+        """Som get för flera nycklar: L1 först, resten med ett MGET. None för missar."""
+        results = [None] * len(keys)
+        remaining = []
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._l1.get(key) if key is not None else None
+                if entry is not None and entry[0] > now:
+                    self._l1.move_to_end(key)
+                    self.counts["l1_hits"] += 1
+                    results[i] = json.loads(entry[1])
+                elif key is not None:
+                    remaining.append(i)
+
+        payloads = []
+        if remaining:
+            try:
+                payloads = client.mget([keys[i] for i in remaining])
+            except Exception:
+                payloads = [None] * len(remaining)
+        for i, payload in zip(remaining, payloads):
+            if payload:
+                self._remember(keys[i], payload)
+                self.counts["l2_hits"] += 1
+                results[i] = json.loads(payload)
+            else:
+                self.counts["misses"] += 1
+        return results
+
+    def set_many(self, client, entries):
+        """Sparar {nyckel: resultat} i båda nivåerna, Redis i en pipeline."""
+        entries = {key: json.dumps(results) for key, results in entries.items() if key is not None}
+        if not entries:
+            return
+        for key, payload in entries.items():
+            self._remember(key, payload)
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, payload in entries.items():
+                pipe.setex(key, self.ttl, payload)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Kunde inte spara korgar i Redis: {e}")
+
+    def _remember(self, key, payload):
+        with self._lock:
+            self._l1[key] = (time.monotonic() + self.ttl, payload)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.max_entries:
+                self._l1.popitem(last=False)
+
+    def stats(self):
+        """Träffar per nivå och andel av alla uppslag."""
+        l1, l2, misses = self.counts["l1_hits"], self.counts["l2_hits"], self.counts["misses"]
+        lookups = l1 + l2 + misses
+        return {
+            "l1_hits": l1,
+            "l2_hits": l2,
+            "misses": misses,
+            "l1_hit_ratio": round(l1 / lookups, 4) if lookups else 0.0,
+            "l2_hit_ratio": round(l2 / lookups, 4) if lookups else 0.0,
+            "l1_size": len(self._l1),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+        self.counts.clear()
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Slår ihop identiska samtidiga beräkningar.
+
+    I processen blir första anropet ledare och övriga väntar på dess svar.
+    Mellan workers tar ledaren ett Redis-lås (SET NX) och publicerar svaret under en
+    kort TTL, oavsett om det är optimalt (bara optimala svar hamnar i korgcachen).
+    Följare i andra workers pollar efter svaret och räknar bara själva om ledaren
+    försvinner utan att svara.
+
+    do() är för trådar (sync-kod), do_async() för event-loopen (async-endpoints).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = {}
+        self.counts = Counter()
+
+    def do(self, client, key, compute):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            self.counts["coalesced_local"] += 1
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._across_workers(client, key, compute)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def do_async(self, client, key, compute):
+        """Som do(), men compute är en coroutine-funktion och väntan blockerar inga trådar."""
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            self.counts["coalesced_local"] += 1
+            return await asyncio.shield(flight)
+
+        flight = self._async_flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._across_workers_async(client, key, compute)
+            flight.set_result(result)
+            return result
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # Markera som hämtat även om ingen följare väntade
+            raise
+        finally:
+            del self._async_flights[key]
+
+    def _across_workers(self, client, key, compute):
+        token = self._try_lead(client, key)
+        if token is not None:
+            try:
+                result = compute()
+                self._publish(client, key, result)
+                return result
+            finally:
+                self._release(client, key, token)
+        if client:
+            give_up_at = time.monotonic() + FLIGHT_LOCK_TTL_MS / 1000.0
+            while time.monotonic() < give_up_at:
+                payload, waiting = self._poll(client, key)
+                if payload:
+                    self.counts["coalesced_remote"] += 1
+                    return json.loads(payload)
+                if not waiting:
+                    break
+                time.sleep(FLIGHT_POLL_SECONDS)
+        return compute()
+
+    async def _across_workers_async(self, client, key, compute):
+        # Redis-anropen är blockerande och körs därför i trådpoolen
+        token = await run_in_threadpool(self._try_lead, client, key)
+        if token is not None:
+            try:
+                result = await compute()
+                await run_in_threadpool(self._publish, client, key, result)
+                return result
+            finally:
+                await run_in_threadpool(self._release, client, key, token)
+        if client:
+            give_up_at = time.monotonic() + FLIGHT_LOCK_TTL_MS / 1000.0
+            while time.monotonic() < give_up_at:
+                payload, waiting = await run_in_threadpool(self._poll, client, key)
+                if payload:
+                    self.counts["coalesced_remote"] += 1
+                    return json.loads(payload)
+                if not waiting:
+                    break
+                await asyncio.sleep(FLIGHT_POLL_SECONDS)
+        return await compute()
+
+    @staticmethod
+    def _try_lead(client, key):
+        """Token om vi fick låset, annars None (även när Redis saknas eller inte svarar)."""
+        if not client:
+            return None
+        token = uuid.uuid4().hex
+        try:
+            if client.set(f"basket_flight_lock:{key}", token, nx=True, px=FLIGHT_LOCK_TTL_MS):
+                return token
+        except Exception:
+            pass
+        return None
+
+    @staticmethod
+    def _publish(client, key, result):
+        try:
+            client.set(f"basket_flight_result:{key}", json.dumps(result), px=FLIGHT_RESULT_TTL_MS)
+        except Exception as e:
+            logger.warning(f"⚠️ Kunde inte publicera single-flight-svar: {e}")
+
+    @staticmethod
+    def _release(client, key, token):
+        try:
+            client.eval(_RELEASE_SCRIPT, 1, f"basket_flight_lock:{key}", token)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _poll(client, key):
+        """(svar, ledaren arbetar fortfarande). Ledaren skriver svaret innan låset släpps."""
+        try:
+            lock_held = client.exists(f"basket_flight_lock:{key}")
+            return client.get(f"basket_flight_result:{key}"), bool(lock_held)
+        except Exception:
+            return None, False
+
+
+basket_cache = BasketCache()
+single_flight = SingleFlight()
@@ -0,0 +1,290 @@
+import platform
+import random
+import time
+import tracemalloc
+from datetime import datetime
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+from app.models import Product, ProductPrice, Store
+from app.core.logging import get_logger
+from app.services import optimizer
+from app.services.dev_tools import generate_fake_data
+from app.services.search import (
+    trigram_query, fulltext_query, set_trigram_threshold, resolve_mode, trigram_available, SEARCH_LIMIT, TRGM_THRESHOLD
+)
+
+logger = get_logger("benchmark")
+
+# Fraktprofiler för de syntetiska butikerna: (grundfrakt, fri frakt-gräns) att slumpa mellan
+SHIPPING_PROFILES = {
+    "free": [(0, 0)],
+    "low": [(29, 199), (39, 249), (49, 299)],
+    "high": [(49, 499), (59, 799), (79, 999)],
+    "mixed": [(0, 0), (49, 500), (0, 199), (39, 0), (29, 300)],
+}
+
+BENCH_STORES = 8
+# Priserna hålls nära fraktgränserna, annars når varje vara fri frakt på egen hand
+BENCH_PRICE_RANGE = (20, 400)
+BENCH_STORE_PREFIX = "Bench"
+
+
+def _percentile(values, q):
+    """Percentil med linjär interpolation (q mellan 0 och 100)."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    pos = (len(ordered) - 1) * q / 100.0
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def _summary(values, digits=3):
+    return {
+        "mean": round(sum(values) / len(values), digits),
+        "p50": round(_percentile(values, 50), digits),
+        "p95": round(_percentile(values, 95), digits),
+        "max": round(max(values), digits),
+    }
+
+
+def build_catalog(db: Session, seed: int, offers: int, shipping: str, n_products: int):
+    """
+    Reproducerbar katalog för en kombination av erbjudanden per produkt och fraktprofil.
+    Butikerna får egna namn så att katalogerna inte blandas ihop med varandra eller riktig data.
+    Returnerar (produkt-id:n, butiks-id:n).
+    """
+    rng = random.Random(f"{seed}:{offers}:{shipping}")
+    store_data = []
+    for i in range(max(BENCH_STORES, offers)):
+        base, limit = rng.choice(SHIPPING_PROFILES[shipping])
+        store_data.append({"name": f"{BENCH_STORE_PREFIX} {shipping}-{offers} #{i + 1}", "shipping": base, "limit": limit})
+
+    products = generate_fake_data(
+        db, n_products, seed=rng.randint(0, 2**31), store_data=store_data,
+        offers_per_product=(offers, offers), price_range=BENCH_PRICE_RANGE
+    )
+    names = [s["name"] for s in store_data]
+    store_ids = [sid for (sid,) in db.query(Store.id).filter(Store.name.in_(names))]
+    return [p.id for p in products], store_ids
+
+
+def make_carts(product_ids, cart_size, count, seed):
+    """count slumpade korgar med cart_size olika produkter och 1-3 av varje."""
+    rng = random.Random(f"{seed}:{cart_size}")
+    size = min(cart_size, len(product_ids))
+    return [
+        [{"product_id": pid, "quantity": rng.randint(1, 3)} for pid in rng.sample(product_ids, size)]
+        for _ in range(count)
+    ]
+
+
+def run_scenario(db: Session, carts, engine, repeat=3, time_budget_ms=None):
+    """
+    Kör calculate_best_basket för alla korgar (repeat varv) och mäter latens och sökta noder.
+    Minnet mäts i ett separat varv med tracemalloc, eftersom det saktar ner körningen.
+    """
+    latencies_ms = []
+    nodes = []
+    optimal = 0
+    for round_no in range(repeat):
+        for cart in carts:
+            start = time.perf_counter()
+            results = optimizer.calculate_best_basket(cart, db, engine=engine, time_budget_ms=time_budget_ms)
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+            if round_no == 0 and results:
+                nodes.append(results[0]["search"]["nodes"])
+                optimal += results[0]["optimal"]
+
+    peak_kb = 0.0
+    for cart in carts:
+        tracemalloc.start()
+        try:
+            optimizer.calculate_best_basket(cart, db, engine=engine, time_budget_ms=time_budget_ms)
+            peak_kb = max(peak_kb, tracemalloc.get_traced_memory()[1] / 1024)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "latency_ms": _summary(latencies_ms),
+        "nodes": _summary(nodes or [0], digits=1),
+        "optimal_ratio": round(optimal / len(nodes), 3) if nodes else None,
+        "peak_memory_kb": round(peak_kb, 1),
+    }
+
+
+def remove_catalog(db: Session, product_ids, store_ids):
+    db.query(ProductPrice).filter(ProductPrice.product_id.in_(product_ids)).delete(synchronize_session=False)
+    db.query(Product).filter(Product.id.in_(product_ids)).delete(synchronize_session=False)
+    db.query(Store).filter(Store.id.in_(store_ids)).delete(synchronize_session=False)
+    db.commit()
+
+
+def run_benchmark(db: Session, seed=42, cart_sizes=(2, 5, 10, 20, 50), offers=(2, 4, 8),
+                  shipping=("free", "low", "high"), engines=None, carts_per_scenario=10,
+                  repeat=3, time_budget_ms=None, keep=False):
+    """
+    Bygger en katalog per (erbjudanden per produkt, fraktprofil), kör varje korgstorlek
+    med varje lösare och returnerar ett JSON-vänligt resultat. Redis är avstängt under
+    körningen så att varje anrop faktiskt löses (ingen korg- eller offer-cache).
+    """
+    engines = list(engines or ["auto", *optimizer.SOLVER_ENGINES])
+    report = {
+        "meta": {
+            "seed": seed,
+            "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "carts_per_scenario": carts_per_scenario,
+            "repeat": repeat,
+            "time_budget_ms": time_budget_ms,
+        },
+        "scenarios": [],
+    }
+
+    saved_client = optimizer.redis_client
+    optimizer.redis_client = None
+    try:
+        for offer_count in offers:
+            for profile in shipping:
+                product_ids, store_ids = build_catalog(db, seed, offer_count, profile, n_products=max(cart_sizes) * 2)
+                if not product_ids:
+                    raise RuntimeError("Kunde inte skapa katalog (saknas kategorier? kör 'python manage.py seed')")
+                try:
+                    for size in cart_sizes:
+                        carts = make_carts(product_ids, size, carts_per_scenario, seed)
+                        for engine in engines:
+                            logger.info(f"⏱️  {profile} / {offer_count} erbjudanden / {size} varor / {engine}")
+                            report["scenarios"].append({
+                                "shipping": profile,
+                                "offers_per_product": offer_count,
+                                "cart_size": size,
+                                "engine": engine,
+                                **run_scenario(db, carts, engine, repeat, time_budget_ms),
+                            })
+                finally:
+                    if not keep:
+                        remove_catalog(db, product_ids, store_ids)
+    finally:
+        optimizer.redis_client = saved_client
+
+    return report
+
+
+# --- Sökning ---
+# Produktnamnen byggs av märke + två ord + storlek, deterministiskt från radnumret
+SEARCH_BRANDS = ["Nivea", "L'Oréal", "Sony", "Philips", "Braun", "Garnier", "Dove", "Samsung", "Oral-B", "Rexona"]
+SEARCH_WORDS = [
+    "schampo", "balsam", "dagkräm", "nattkräm", "deodorant", "hörlurar", "eltandborste", "rakapparat",
+    "hårtork", "serum", "solskydd", "tvål", "duschkräm", "läppbalsam", "högtalare", "laddare",
+]
+SEARCH_QUERIES = ["schampo", "nivea kräm", "hörlurr", "eltandbörste", "sony högtalare", "xyzzy"]
+SEARCH_EAN_PREFIX = "bench-search-"
+SEARCH_INSERT_BATCH = 100_000
+
+
+def build_search_catalog(db: Session, n_products: int, seed: int = 42):
+    """n_products syntetiska produkter, infogade med generate_series i batchar (en commit per batch)."""
+    insert = text("""
+        INSERT INTO products (ean, slug, name, brand, popularity_score, rating, created_at)
+        SELECT :prefix || g, :prefix || g,
+               b.brands[1 + (g * 7 + :seed) % array_length(b.brands, 1)] || ' '
+               || b.words[1 + (g * 13 + :seed) % array_length(b.words, 1)] || ' '
+               || b.words[1 + (g * 31 + :seed) % array_length(b.words, 1)] || ' '
+               || (50 + (g * 17) % 450) || ' ml',
+               b.brands[1 + (g * 7 + :seed) % array_length(b.brands, 1)],
+               (g * 37 + :seed) % 1000, 0, now()
+        FROM generate_series(:start, :stop) AS g,
+             (SELECT CAST(:brands AS text[]) AS brands, CAST(:words AS text[]) AS words) AS b
+    """)
+    for start in range(1, n_products + 1, SEARCH_INSERT_BATCH):
+        stop = min(start + SEARCH_INSERT_BATCH - 1, n_products)
+        db.execute(insert, {
+            "prefix": SEARCH_EAN_PREFIX, "seed": seed, "start": start, "stop": stop,
+            "brands": SEARCH_BRANDS, "words": SEARCH_WORDS,
+        })
+        db.commit()
+        logger.info(f"   {stop} / {n_products} produkter...")
+    # Planeraren behöver aktuell statistik för att välja indexet
+    db.execute(text("ANALYZE products"))
+    db.commit()
+
+
+def remove_search_catalog(db: Session):
+    db.execute(text("DELETE FROM products WHERE ean LIKE :prefix"), {"prefix": SEARCH_EAN_PREFIX + "%"})
+    db.commit()
+
+
+def _plan_indexes(plan):
+    """Namnen på alla index som planen (EXPLAIN FORMAT JSON) använder."""
+    found = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        found |= _plan_indexes(child)
+    return found
+
+
+def explain(db: Session, statement):
+    """EXPLAIN (ANALYZE, BUFFERS) för en SQLAlchemy-fråga: (plan, använda index, exekveringstid i ms)."""
+    compiled = statement.compile(dialect=db.get_bind().dialect)
+    row = db.connection().exec_driver_sql(
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + compiled.string, compiled.params
+    ).scalar()
+    report = row[0] if isinstance(row, list) else row
+    return report["Plan"], sorted(_plan_indexes(report["Plan"])), round(report["Execution Time"], 3)
+
+
+def run_search_benchmark(db: Session, n_products=1_000_000, queries=SEARCH_QUERIES, modes=("trigram", "substring"),
+                         threshold=TRGM_THRESHOLD, limit=SEARCH_LIMIT, repeat=5, seed=42, keep=False):
+    """
+    Bygger en syntetisk katalog med n_products produkter och kör varje sökfråga i varje
+    sökläge: latens över repeat körningar, EXPLAIN-planen och vilka index den använder.
+    """
+    if "trigram" in modes and resolve_mode(db, "trigram") != "trigram":
+        raise RuntimeError("pg_trgm saknas i databasen (kör 'alembic upgrade head')")
+
+    with_trigram = trigram_available(db)
+    statements = {
+        "trigram": lambda q: trigram_query(q, limit),
+        "fulltext": lambda q: fulltext_query(q, limit, with_trigram=with_trigram),
+        "substring": lambda q: select(Product.id).where(Product.name.ilike(f"%{q}%")).limit(limit),
+    }
+    report = {
+        "meta": {
+            "seed": seed,
+            "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "products": n_products,
+            "threshold": threshold,
+            "limit": limit,
+            "repeat": repeat,
+        },
+        "queries": [],
+    }
+
+    build_search_catalog(db, n_products, seed)
+    try:
+        for q in queries:
+            for mode in modes:
+                statement = statements[mode](q)
+                if mode == "trigram" or (mode == "fulltext" and with_trigram):
+                    set_trigram_threshold(db, threshold)
+                latencies_ms = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    hits = len(db.execute(statement).all())
+                    latencies_ms.append((time.perf_counter() - start) * 1000)
+                plan, indexes, execution_ms = explain(db, statement)
+                db.commit()
+                logger.info(f"🔎 {mode} '{q}': {hits} träffar, index: {', '.join(indexes) or 'inget'}")
+                report["queries"].append({
+                    "query": q,
+                    "mode": mode,
+                    "hits": hits,
+                    "latency_ms": _summary(latencies_ms),
+                    "indexes": indexes,
+                    "execution_ms": execution_ms,
+                    "plan": plan,
+                })
+    finally:
+        if not keep:
+            remove_search_catalog(db)
+    return report
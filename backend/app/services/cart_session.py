@@ -0,0 +1,119 @@
+import json
+import secrets
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from app.core.logging import get_logger
+from app.services.basket_cache import redis_client
+from app.services.optimizer import calculate_best_basket_async, BasketConstraints
+
+logger = get_logger("cart_session")
+
+# En varukorg i frontend lever en stund; TTL förlängs vid varje ändring
+CART_SESSION_KEY = "cart_session:{}"
+CART_SESSION_TTL = 3600
+
+
+class CartSessionNotFound(Exception):
+    """Token finns inte (eller har gått ut)."""
+
+
+class CartSessionUnavailable(Exception):
+    """Sessioner kräver Redis."""
+
+
+def _hint_from_results(results):
+    """{product_id: store_id} för vinnaren, används som varmstart vid nästa ändring."""
+    if not results:
+        return {}
+    return {
+        product["id"]: detail["store_id"]
+        for detail in results[0]["details"]
+        for product in detail["products"]
+    }
+
+
+def _read(token):
+    if not redis_client:
+        raise CartSessionUnavailable()
+    payload = redis_client.get(CART_SESSION_KEY.format(token))
+    if not payload:
+        raise CartSessionNotFound()
+    session = json.loads(payload)
+    # JSON-nycklar är alltid strängar
+    session["items"] = {int(pid): qty for pid, qty in session["items"].items()}
+    session["hint"] = {int(pid): sid for pid, sid in session["hint"].items()}
+    # Listor i JSON, tupler i BasketConstraints (äldre sessioner saknar k och villkor)
+    session.setdefault("k", 1)
+    session["constraints"] = BasketConstraints(**{
+        field: tuple(value) if isinstance(value, list) else value
+        for field, value in session.get("constraints", {}).items()
+    })
+    return session
+
+
+def _write(token, session):
+    if not redis_client:
+        raise CartSessionUnavailable()
+    session = {**session, "constraints": session["constraints"]._asdict()}
+    redis_client.setex(CART_SESSION_KEY.format(token), CART_SESSION_TTL, json.dumps(session))
+
+
+async def _solve(db: Session, session: dict, time_budget_ms=None, debug=False):
+    """Löser sessionens korg med dess k och villkor, varmstartad från förra optimum."""
+    cart_items = [{"product_id": pid, "quantity": qty} for pid, qty in session["items"].items()]
+    results = await calculate_best_basket_async(
+        cart_items, db, time_budget_ms=time_budget_ms, hint=session["hint"],
+        k=session["k"], constraints=session["constraints"], debug=debug
+    )
+    session["hint"] = _hint_from_results(results)
+    session["results"] = results
+    return results
+
+
+async def create_cart_session(items: dict, db: Session, time_budget_ms=None, k=1, constraints=None, debug=False):
+    """
+    Skapar en session för korgen {product_id: antal}. Returnerar (token, resultat).
+    k och constraints (BasketConstraints) sparas i sessionen och gäller även vid ändringar.
+    """
+    if not redis_client:
+        raise CartSessionUnavailable()
+    token = secrets.token_urlsafe(16)
+    session = {
+        "items": {pid: qty for pid, qty in items.items() if qty > 0},
+        "hint": {},
+        "k": k,
+        "constraints": constraints or BasketConstraints(),
+    }
+    results = await _solve(db, session, time_budget_ms, debug)
+    await run_in_threadpool(_write, token, session)
+    return token, results
+
+
+async def update_cart_session(token: str, changes: dict, db: Session, time_budget_ms=None, debug=False):
+    """
+    Applicerar ändringar {product_id: nytt antal} (0 tar bort varan) och löser om,
+    med förra optimum som startpunkt och sessionens k och villkor. Returnerar (korg, resultat).
+    """
+    session = await run_in_threadpool(_read, token)
+    items = session["items"]
+    for pid, qty in changes.items():
+        if qty > 0:
+            items[pid] = qty
+        else:
+            items.pop(pid, None)
+
+    results = await _solve(db, session, time_budget_ms, debug)
+    await run_in_threadpool(_write, token, session)
+    return items, results
+
+
+async def get_cart_session(token: str):
+    """Returnerar (korg, resultat från senaste ändringen) utan att lösa om."""
+    session = await run_in_threadpool(_read, token)
+    return session["items"], session["results"]
+
+
+async def delete_cart_session(token: str):
+    if not redis_client:
+        raise CartSessionUnavailable()
+    await run_in_threadpool(redis_client.delete, CART_SESSION_KEY.format(token))
@@ -8,6 +8,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 from app.models import Product, Category
 from app.core.logging import get_logger
+from app.services.autocomplete import notify_rebuild
 
 logger = get_logger("categorizer")
 
@@ -44,6 +45,8 @@ def categorize_uncategorized_products(db: Session, limit: int = None):
     logger.info("⚡ STEG 1: Kör SQL-baserad massuppdatering (Regex)...")
     keyword_hits = run_sql_keyword_categorization(db, cat_map)
     logger.info(f"   -> Databasen uppdaterade {keyword_hits} produkter direkt.")
+    # Sökförslagen visar produkternas kategori
+    notify_rebuild()
 
     # ---------------------------------------------------------
     # STEG 2: KÖR AI PÅ RESTEN
@@ -58,6 +61,7 @@ def categorize_uncategorized_products(db: Session, limit: int = None):
     if remaining_count > 0:
         logger.info(f"🤖 STEG 2: Kör AI ({GOOGLE_AI_MODEL}) på återstående produkter...")
         run_ai_categorization_bulk(db, cat_names, cat_map, limit_count=limit)
+        notify_rebuild()
     else:
         logger.info("✨ Inget kvar för AI att göra efter Regex-steget!")
 
@@ -3,12 +3,27 @@ from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from app.models import Product, ProductPrice, Store, Category
 from app.core.logging import get_logger
+from app.services.affiliate import generate_tracking_link
+from app.services.autocomplete import notify_products_changed
 
 logger = get_logger("dev_tools")
 
-def generate_fake_data(db: Session, amount: int = 50):
-    """Genererar testprodukter med märken, butiker och kampanjpriser."""
+DEFAULT_STORES = [
+    {"name": "NetOnNet", "shipping": 0, "limit": 0},
+    {"name": "Elgiganten", "shipping": 49, "limit": 500},
+    {"name": "Apotea", "shipping": 0, "limit": 199},
+    {"name": "Webhallen", "shipping": 39, "limit": 0},
+    {"name": "Lyko", "shipping": 29, "limit": 300}
+]
+
+def generate_fake_data(db: Session, amount: int = 50, seed: int = None, store_data: list = None,
+                       offers_per_product: tuple = (1, 4), price_range: tuple = (100, 5000)):
+    """
+    Genererar testprodukter med märken, butiker och kampanjpriser.
+    Med seed blir datan reproducerbar (används av benchmarken). Returnerar de skapade produkterna.
+    """
     logger.info(f"🧪 Genererar {amount} avancerade fake-produkter...")
+    rng = random.Random(seed)
 
     # 1. Hämta löv-kategorier (de längst ner i trädet, d.v.s de som saknar egna barn)
     all_categories = db.query(Category.id, Category.parent_id, Category.name).all()
@@ -19,19 +34,11 @@ def generate_fake_data(db: Session, amount: int = 50):
     
     if not categories:
         logger.error("❌ Inga underkategorier hittades. Kör 'python manage.py seed' först.")
-        return
+        return []
 
     # 2. Skapa eller hämta butiker
-    store_data = [
-        {"name": "NetOnNet", "shipping": 0, "limit": 0},
-        {"name": "Elgiganten", "shipping": 49, "limit": 500},
-        {"name": "Apotea", "shipping": 0, "limit": 199},
-        {"name": "Webhallen", "shipping": 39, "limit": 0},
-        {"name": "Lyko", "shipping": 29, "limit": 300}
-    ]
-    
     stores = []
-    for s_data in store_data:
+    for s_data in store_data or DEFAULT_STORES:
         store = db.query(Store).filter(Store.name == s_data["name"]).first()
         if not store:
             store = Store(
@@ -55,9 +62,9 @@ def generate_fake_data(db: Session, amount: int = 50):
     adjectives = ["Pro", "Ultra", "Slim", "Max", "Original", "Gaming", "Wireless"]
     nouns = ["X1000", "3000", "Lite", "Edition", "Series 5", "V2"]
 
-    count = 0
+    created = []
     for _ in range(amount):
-        cat = random.choice(categories)
+        cat = rng.choice(categories)
         
         # Hitta passande märke baserat på kategorinamn (enkelt hack)
         cat_key = "Annat"
@@ -68,15 +75,15 @@ def generate_fake_data(db: Session, amount: int = 50):
         elif "träning" in cat.name.lower() or "sko" in cat.name.lower():
             cat_key = "Sport"
             
-        brand = random.choice(brands.get(cat_key, brands["Annat"]))
+        brand = rng.choice(brands.get(cat_key, brands["Annat"]))
         
         # Skapa produktnamn: "Sony Hörlurar Pro X1000"
-        product_name = f"{brand} {cat.name.rstrip('s')} {random.choice(adjectives)} {random.choice(nouns)}"
+        product_name = f"{brand} {cat.name.rstrip('s')} {rng.choice(adjectives)} {rng.choice(nouns)}"
         
         # Skapa EAN (måste vara unik)
-        ean = str(random.randint(7300000000000, 7399999999999))
+        ean = str(rng.randint(7300000000000, 7399999999999))
         while db.query(Product).filter(Product.ean == ean).first():
-            ean = str(random.randint(7300000000000, 7399999999999))
+            ean = str(rng.randint(7300000000000, 7399999999999))
 
         # Bild med text (så man ser vad det är)
         encoded_text = product_name.replace(" ", "+")
@@ -88,26 +95,27 @@ def generate_fake_data(db: Session, amount: int = 50):
             brand=brand,  # <--- HÄR LÄGGER VI TILL MÄRKET
             category_id=cat.id,
             image_url=image_url,
-            rating=round(random.uniform(2.5, 5.0), 1),
-            popularity_score=random.randint(0, 100),
-            created_at=datetime.utcnow() - timedelta(days=random.randint(0, 365))
+            rating=round(rng.uniform(2.5, 5.0), 1),
+            popularity_score=rng.randint(0, 100),
+            created_at=datetime.utcnow() - timedelta(days=rng.randint(0, 365))
         )
         db.add(product)
         db.flush() # Få ID
 
-        # 4. Skapa priser (1 till 4 butiker säljer varan)
-        chosen_stores = random.sample(stores, k=random.randint(1, min(4, len(stores))))
+        # 4. Skapa priser (som standard säljer 1 till 4 butiker varan)
+        low, high = offers_per_product
+        chosen_stores = rng.sample(stores, k=rng.randint(min(low, len(stores)), min(high, len(stores))))
         
         # Baspris för produkten (t.ex. 500 kr)
-        base_price = random.randint(100, 5000)
+        base_price = rng.randint(*price_range)
         
         for store in chosen_stores:
             # Varje butik varierar priset lite (+- 10%)
-            price_variation = random.uniform(0.9, 1.1)
+            price_variation = rng.uniform(0.9, 1.1)
             current_price = round(base_price * price_variation)
             
             # Kampanj? (20% chans)
-            is_campaign = random.random() < 0.2
+            is_campaign = rng.random() < 0.2
             regular_price = None
             discount_percent = 0
             
@@ -115,18 +123,22 @@ def generate_fake_data(db: Session, amount: int = 50):
                 regular_price = round(current_price * 1.3) # Ordinarie var 30% högre
                 discount_percent = int((1 - (current_price / regular_price)) * 100)
             
+            url = f"https://www.{store.name.lower()}.se/produkt/{ean}"
             price_entry = ProductPrice(
                 product_id=product.id,
                 store_id=store.id,
                 price=current_price,
                 regular_price=regular_price,
                 discount_percent=discount_percent,
-                url=f"https://www.{store.name.lower()}.se/produkt/{ean}",
+                url=url,
+                tracking_url=generate_tracking_link(url, store),
                 updated_at=datetime.utcnow()
             )
             db.add(price_entry)
 
-        count += 1
+        created.append(product)
 
     db.commit()
-    logger.info(f"✅ Skapade {count} produkter med märken och priser.")
\ No newline at end of file
+    notify_products_changed(p.id for p in created)
+    logger.info(f"✅ Skapade {len(created)} produkter med märken och priser.")
+    return created
\ No newline at end of file
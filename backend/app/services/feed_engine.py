@@ -7,6 +7,10 @@ from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
 from app.models import Product, ProductPrice, Store
 from app.core.logging import get_logger
+from app.services.basket_cache import bump_product_versions
+from app.services.offer_cache import refresh_product_offers
+from app.services.affiliate import generate_tracking_link
+from app.services.autocomplete import notify_products_changed
 
 logger = get_logger("feed_engine")
 
@@ -144,7 +148,8 @@ def process_feed_bulk(file_path: str, store_name: str, db: Session):
                 "price": price,
                 "regular_price": reg_price,
                 "discount_percent": discount, # <-- LÄGG TILL DENNA
-                "url": row['url']
+                "url": row['url'],
+                "tracking_url": generate_tracking_link(row['url'], store)
             })
     
     # Bulk insert priser (med delete/insert strategi för säkerhet)
@@ -159,6 +164,10 @@ def process_feed_bulk(file_path: str, store_name: str, db: Session):
         
         db.bulk_insert_mappings(ProductPrice, batch)
         db.commit()
+        # Cachade korgar med dessa produkter är nu inaktuella, erbjudandena skrivs om direkt
+        bump_product_versions(pids_in_batch)
+        refresh_product_offers(db, pids_in_batch)
+        notify_products_changed(pids_in_batch)
 
     logger.info(f"✅ Priser uppdaterade för {len(prices_data)} varor.")
 
@@ -3,6 +3,10 @@ from sqlalchemy.orm import Session
 from app.models import Product, ProductPrice, Store
 from datetime import datetime
 from app.core.logging import get_logger
+from app.services.basket_cache import bump_product_versions
+from app.services.offer_cache import refresh_product_offers
+from app.services.affiliate import generate_tracking_link
+from app.services.autocomplete import notify_products_changed
 
 logger = get_logger("importer")
 
@@ -56,6 +60,7 @@ def import_csv_feed(file_path: str, store_name: str, db: Session):
         # Hämta existerande produkter från DB som matchar EANs i denna chunk
         existing_products_query = db.query(Product).filter(Product.ean.in_(eans_in_chunk)).all()
         existing_products_map = {p.ean: p for p in existing_products_query}
+        changed_product_ids = set()
         
         for index, row in df.iterrows():
             try:
@@ -92,17 +97,22 @@ def import_csv_feed(file_path: str, store_name: str, db: Session):
                 ).first()
 
                 if price_entry:
+                    if price_entry.price != price or price_entry.url != url:
+                        changed_product_ids.add(product.id)
                     price_entry.price = price
                     price_entry.url = url
+                    price_entry.tracking_url = generate_tracking_link(url, store)
                     price_entry.updated_at = datetime.utcnow()
                 else:
                     new_price = ProductPrice(
                         product_id=product.id,
                         store_id=store.id,
                         price=price,
-                        url=url
+                        url=url,
+                        tracking_url=generate_tracking_link(url, store)
                     )
                     db.add(new_price)
+                    changed_product_ids.add(product.id)
             
             except Exception as row_error:
                 # Logga fel på rad-nivå men fortsätt med nästa
@@ -112,6 +122,10 @@ def import_csv_feed(file_path: str, store_name: str, db: Session):
 
         # Commit efter varje chunk (sparar minne och transaktionslogg)
         db.commit()
+        # Bara korgar med produkter vars pris ändrats blir inaktuella i cachen
+        bump_product_versions(changed_product_ids)
+        refresh_product_offers(db, changed_product_ids)
+        notify_products_changed(changed_product_ids)
         total_processed += len(df)
         logger.info(f"   Processed chunk {chunk_index + 1} ({total_processed} items total)...")
 
@@ -0,0 +1,99 @@
+import json
+from sqlalchemy.orm import Session
+from app.models import ProductPrice, Product
+from app.core.logging import get_logger
+from app.services.basket_cache import VERSION_KEY, redis_client
+
+logger = get_logger("offer_cache")
+
+# Kompakt erbjudandelista per produkt: {"v", "name", "slug", "offers": [[store_id, price, url, tracking_url], ...]}
+# (v2: tracking_url lades till, poster i det gamla formatet läses aldrig)
+OFFER_KEY = "product_offers:v2:{}"
+# Skyddsnät om en invalidering skulle missas. Normalt ersätts posten av importen.
+OFFER_TTL = 6 * 3600
+
+
+def _query_offers(db: Session, product_ids, versions):
+    """Hämtar erbjudanden från Postgres och bygger cacheposter (även tomma, så de inte frågas om)."""
+    entries = {pid: {"v": versions.get(pid, 0), "name": None, "slug": None, "offers": []} for pid in product_ids}
+    rows = (
+        db.query(
+            ProductPrice.product_id, ProductPrice.store_id, ProductPrice.price, ProductPrice.url,
+            ProductPrice.tracking_url, Product.name, Product.slug
+        )
+        .join(Product)
+        .filter(ProductPrice.product_id.in_(product_ids))
+        .all()
+    )
+    for pid, store_id, price, url, tracking_url, name, slug in rows:
+        entry = entries[pid]
+        entry["name"] = name
+        entry["slug"] = slug
+        entry["offers"].append([store_id, price, url, tracking_url])
+    return entries
+
+
+def _store(client, entries):
+    pipe = client.pipeline(transaction=False)
+    for pid, entry in entries.items():
+        pipe.setex(OFFER_KEY.format(pid), OFFER_TTL, json.dumps(entry))
+    pipe.execute()
+
+
+def load_product_offers(db: Session, product_ids, client):
+    """
+    Returnerar {product_id: post} för produkterna. Versioner och poster hämtas med ett
+    enda MGET; bara produkter som saknas (eller har gammal version) frågas mot Postgres.
+    Utan client (Redis) går allt direkt mot databasen.
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if not client:
+        return _query_offers(db, product_ids, {})
+
+    try:
+        raw = client.mget(
+            [VERSION_KEY.format(pid) for pid in product_ids] + [OFFER_KEY.format(pid) for pid in product_ids]
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Offer-cache otillgänglig: {e}")
+        return _query_offers(db, product_ids, {})
+
+    n = len(product_ids)
+    versions = {pid: int(v or 0) for pid, v in zip(product_ids, raw[:n])}
+    entries = {}
+    misses = []
+    for pid, payload in zip(product_ids, raw[n:]):
+        entry = json.loads(payload) if payload else None
+        # En post skriven före senaste importen kan vara inaktuell
+        if entry is None or entry["v"] != versions[pid]:
+            misses.append(pid)
+        else:
+            entries[pid] = entry
+
+    if misses:
+        # Versionen lästes före databasfrågan, så en import som sker under tiden
+        # gör att posten får gammal version och ignoreras nästa gång.
+        fetched = _query_offers(db, misses, versions)
+        entries.update(fetched)
+        try:
+            _store(client, fetched)
+        except Exception as e:
+            logger.warning(f"⚠️ Kunde inte spara erbjudanden i cachen: {e}")
+    return entries
+
+
+def refresh_product_offers(db: Session, product_ids, client=None):
+    """
+    Write-through från importerna: läser om produkternas erbjudanden och skriver över
+    cacheposterna. Anropas efter commit och efter att versionerna räknats upp.
+    """
+    client = client or redis_client
+    product_ids = list(set(product_ids))
+    if not client or not product_ids:
+        return
+    try:
+        raw = client.mget([VERSION_KEY.format(pid) for pid in product_ids])
+        versions = {pid: int(v or 0) for pid, v in zip(product_ids, raw)}
+        _store(client, _query_offers(db, product_ids, versions))
+    except Exception as e:
+        logger.warning(f"⚠️ Kunde inte uppdatera offer-cachen: {e}")
@@ -1,180 +1,1438 @@
-import json
+import asyncio
 import os
-import redis
+import time
+from array import array
 from sqlalchemy.orm import Session
-from app.models import ProductPrice, Store, Product
-from collections import defaultdict
+from app.models import Store
+from collections import defaultdict, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from app.core.logging import get_logger
-from app.services.affiliate import generate_tracking_link
+from app.core.metrics import metrics
+from app.services.affiliate import generate_tracking_link, affiliate_info
+from app.services.basket_cache import basket_cache, single_flight, redis_client
+from app.services.offer_cache import load_product_offers
+from app.services.solver_pool import solver_pool, SolverBusy, MP_CONTEXT
+from app.services.shipping import (
+    ShippingRule, ShippingTable, shipping_rule, compile_rules, is_flat, tier_price, next_threshold,
+    DEFAULT_DELIVERY
+)
+from fastapi.concurrency import run_in_threadpool
 import sys
 
 logger = get_logger("optimizer")
 
-redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+INF = float('inf')
 
-try:
-    redis_client = redis.from_url(redis_url, decode_responses=True)
-except Exception as e:
-    logger.warning(f"Redis error: {e}")
-    redis_client = None
+# Användarens villkor på korgen:
+# - max_stores: högst så många butiker (paket)
+# - exclude_store_ids: butiker som aldrig får användas
+# - prefer_store_ids: varje använd butik UTANFÖR listan kostar prefer_penalty kr extra i sökningen
+#   (straffet påverkar bara valet, aldrig priserna i svaret)
+# - delivery: leveranssätt ("pickup"/"home"), väljer butikernas frakttabeller
+BasketConstraints = namedtuple(
+    "BasketConstraints",
+    ["max_stores", "exclude_store_ids", "prefer_store_ids", "prefer_penalty", "delivery"],
+    defaults=(None, (), (), 0.0, DEFAULT_DELIVERY)
+)
+DEFAULT_PREFER_PENALTY = 25.0
 
-def calculate_shipping(store, current_total):
-    """Hjälpfunktion för att räkna ut frakt för en butik baserat på summa."""
+def store_penalties(constraints, store_ids):
+    """{store_id: straff} för butikerna som inte är föredragna. Tomt om inget straff gäller."""
+    if not constraints or not constraints.prefer_store_ids or constraints.prefer_penalty <= 0:
+        return {}
+    preferred = set(constraints.prefer_store_ids)
+    return {sid: constraints.prefer_penalty for sid in store_ids if sid not in preferred}
+
+def has_constraints(constraints):
+    return bool(constraints and (
+        constraints.max_stores or constraints.exclude_store_ids or constraints.prefer_store_ids
+        or constraints.delivery != DEFAULT_DELIVERY
+    ))
+
+def delivery_of(constraints):
+    return constraints.delivery if constraints else DEFAULT_DELIVERY
+
+def constraints_key(constraints):
+    """Villkoren som nyckeldel (tom sträng utan villkor), så att olika villkor cachas var för sig."""
+    if not has_constraints(constraints):
+        return ""
+    return "|c{}:{}:{}:{}:{}".format(
+        constraints.max_stores or "",
+        ",".join(map(str, sorted(constraints.exclude_store_ids))),
+        ",".join(map(str, sorted(constraints.prefer_store_ids))),
+        constraints.prefer_penalty if constraints.prefer_store_ids else "",
+        constraints.delivery
+    )
+
+def calculate_shipping(store, current_total, item_count=0):
+    """
+    Hjälpfunktion för att räkna ut frakt för en butik baserat på summa.
+    store är en Store eller ShippingRule; item_count (antal varor) behövs för tillägg per vara.
+    """
     if current_total <= 0:
         return 0.0
-    
-    if store.free_shipping_limit and current_total >= store.free_shipping_limit:
-        return 0.0
-    
-    return store.base_shipping
+    rule = shipping_rule(store)
+    return tier_price(rule, current_total) + rule.per_item * item_count
+
+def build_bounds(products_list, quantity_map, store_lookup=None):
+    """
+    Förberäknar data för den undre gränsen i DP-motorn.
+
+    suffix_min[i]: billigaste möjliga kostnad för produkterna i..slutet (inkl. tillägg per vara).
+    store_reach[i]: max summa varje butik kan få till sig från produkterna i..slutet
+    (används för att avgöra hur långt ned i frakttrappan en butik fortfarande kan nå).
+    """
+    n = len(products_list)
+    suffix_min = [0.0] * (n + 1)
+    store_reach = [{} for _ in range(n + 1)]
+    per_item = {sid: rule.per_item for sid, rule in compile_rules(store_lookup or {}).items()}
+
+    for i in range(n - 1, -1, -1):
+        pid, offers = products_list[i]
+        qty = quantity_map[pid]
+        suffix_min[i] = suffix_min[i + 1] + min(o['price'] + per_item.get(o['store_id'], 0.0) for o in offers) * qty
+
+        reach = dict(store_reach[i + 1])
+        best_in_store = {}
+        for o in offers:
+            sid = o['store_id']
+            best_in_store[sid] = max(best_in_store.get(sid, 0.0), o['price'] * qty)
+        for sid, amount in best_in_store.items():
+            reach[sid] = reach.get(sid, 0.0) + amount
+        store_reach[i] = reach
+
+    return {'suffix_min': suffix_min, 'store_reach': store_reach}
+
+class BasketProblem:
+    """
+    Kompilerad representation av ett korgproblem, byggs EN gång per anrop.
+
+    Butiker får heltalsindex och allt sökningen behöver ligger i platta arrayer,
+    så att den heta loopen i solve_recursive slipper dict-uppslag och allokeringar:
+    - cost_matrix[p * n_stores + s]: (pris + tillägg per vara) × antal för produkt p i butik s (inf om den saknas)
+    - offer_store[p] / offer_cost[p]: produktens erbjudanden, förberäknat sorterade på kostnad
+    - offer_amount[p]: pris × antal, det som räknas mot butikens frakttrappa
+    - suffix_min[p]: billigaste möjliga kostnad för produkterna p..slutet
+    - reach[p * n_stores + s]: max summa butik s kan få från produkterna p..slutet
+    - base_shipping/free_limit: butiker med vanlig fri frakt-gräns (snabba vägen)
+    - tiered: butiker med fler prissteg, räknas via rules[s]
+    - tracked: butiker med fri frakt-gräns vars summa påverkar frakten, används i state_key
+    - open_cost[s]: straff för att använda butik s alls (prefer_store_ids, se BasketConstraints)
+    - max_stores: max antal använda butiker (n_stores om det saknas gräns)
+    - flagged: butiker där bara OM de används spelar roll för resten av sökningen
+    """
+
+    def __init__(self, products_list, store_lookup, quantity_map, constraints=None):
+        self.n_products = len(products_list)
+        self.store_ids = sorted({o['store_id'] for _, offers in products_list for o in offers})
+        self.store_index = {sid: i for i, sid in enumerate(self.store_ids)}
+        self.n_stores = len(self.store_ids)
+
+        self.rules = [shipping_rule(store_lookup[sid]) for sid in self.store_ids]
+        self.tiered = [s for s, rule in enumerate(self.rules) if not is_flat(rule)]
+        # Fri frakt-gräns som float, inf om butiken saknar gräns. Trappstegsbutiker har 0/inf här
+        # och räknas separat, så att de vanliga butikerna slipper trappuppslaget.
+        self.base_shipping = array('d', (0.0 if not is_flat(r) else r.prices[0] for r in self.rules))
+        self.free_limit = array('d', (
+            r.thresholds[1] if is_flat(r) and len(r.thresholds) == 2 else INF for r in self.rules
+        ))
+        self.tracked = [s for s in range(self.n_stores) if self.base_shipping[s] > 0]
+
+        penalties = store_penalties(constraints, self.store_ids)
+        self.open_cost = array('d', (penalties.get(sid, 0.0) for sid in self.store_ids))
+        max_stores = constraints.max_stores if constraints else None
+        self.max_stores = min(max_stores or self.n_stores, self.n_stores)
+        tiered = set(self.tiered)
+        self.flagged = [
+            s for s in range(self.n_stores)
+            if self.base_shipping[s] <= 0 and s not in tiered
+            and (self.open_cost[s] > 0 or self.max_stores < self.n_stores)
+        ]
+
+        n, m = self.n_products, self.n_stores
+        self.cost_matrix = array('d', [INF]) * (n * m)
+        self.offer_store = []
+        self.offer_cost = []
+        self.offer_amount = []
+        self.offer_ref = []
+
+        for p, (pid, offers) in enumerate(products_list):
+            qty = quantity_map[pid]
+            # Tillägget per vara är en ren kostnad per styck och läggs direkt på erbjudandet
+            unit_cost = lambda o: o['price'] + self.rules[self.store_index[o['store_id']]].per_item
+            ordered = sorted(offers, key=lambda o: (unit_cost(o), self.store_index[o['store_id']]))
+            self.offer_store.append(array('i', (self.store_index[o['store_id']] for o in ordered)))
+            self.offer_cost.append(array('d', (unit_cost(o) * qty for o in ordered)))
+            self.offer_amount.append(array('d', (o['price'] * qty for o in ordered)))
+            self.offer_ref.append(ordered)
+            for o in ordered:
+                idx = p * m + self.store_index[o['store_id']]
+                self.cost_matrix[idx] = min(self.cost_matrix[idx], unit_cost(o) * qty)
+
+        self.suffix_min = array('d', [0.0]) * (n + 1)
+        self.reach = array('d', [0.0]) * ((n + 1) * m)
+        for p in range(n - 1, -1, -1):
+            self.suffix_min[p] = self.suffix_min[p + 1] + self.offer_cost[p][0]
+            for s in range(m):
+                self.reach[p * m + s] = self.reach[(p + 1) * m + s]
+            for s, amount in zip(self.offer_store[p], self.offer_amount[p]):
+                # Högsta möjliga summa: om samma butik har flera erbjudanden räknas det dyraste
+                self.reach[p * m + s] = max(self.reach[p * m + s], self.reach[(p + 1) * m + s] + amount)
+
+    def shipping_total(self, totals):
+        """Total frakt (plus straff) för en komplett tilldelning (butikssummor per index)."""
+        total = 0.0
+        for s in range(self.n_stores):
+            t = totals[s]
+            if t > 0:
+                total += self.open_cost[s]
+                if t < self.free_limit[s]:
+                    total += self.base_shipping[s]
+        for s in self.tiered:
+            total += tier_price(self.rules[s], totals[s])
+        return total
+
+    def open_count(self, totals):
+        return sum(1 for s in range(self.n_stores) if totals[s] > 0)
+
+    def closed_min(self, product_idx, totals):
+        """
+        Billigaste möjliga kostnad för produkterna product_idx..slutet när inga fler
+        butiker får öppnas. inf om någon produkt saknas i alla använda butiker.
+        """
+        m = self.n_stores
+        used = [s for s in range(m) if totals[s] > 0]
+        total = 0.0
+        for p in range(product_idx, self.n_products):
+            offset = p * m
+            total += min(self.cost_matrix[offset + s] for s in used)
+        return total
+
+    def solution_cost(self, choices):
+        """Målfunktionen (varor + frakt + straff) för en komplett tilldelning, inf om den bryter mot max_stores."""
+        totals = array('d', [0.0]) * self.n_stores
+        cost = 0.0
+        for p, k in enumerate(choices):
+            totals[self.offer_store[p][k]] += self.offer_amount[p][k]
+            cost += self.offer_cost[p][k]
+        if self.open_count(totals) > self.max_stores:
+            return INF
+        return cost + self.shipping_total(totals)
 
-def solve_recursive(product_idx, products_list, current_store_totals, current_assignments, current_cost_so_far, best_solution, store_lookup, quantity_map):
+    def lower_bound(self, product_idx, totals, cost_so_far):
+        """
+        Admissibel undre gräns för alla lösningar under en nod:
+        redan spenderat + billigaste pris för resterande produkter
+        + frakt för butiker som inte längre kan nå sin fraktfria gräns
+        (trappstegsbutiker: frakten vid högsta summa de kan nå)
+        + straff för använda butiker.
+        När max_stores är nått räknas resten bara mot de använda butikerna.
+        """
+        bound = cost_so_far
+        offset = product_idx * self.n_stores
+        used = 0
+        for s in range(self.n_stores):
+            t = totals[s]
+            if t <= 0:
+                continue
+            used += 1
+            bound += self.open_cost[s]
+            # Även om butiken får alla resterande varor (till högsta pris) når den inte fri frakt
+            if t + self.reach[offset + s] < self.free_limit[s]:
+                bound += self.base_shipping[s]
+        for s in self.tiered:
+            t = totals[s]
+            if t > 0:
+                bound += tier_price(self.rules[s], t + self.reach[offset + s])
+        if used >= self.max_stores and self.max_stores < self.n_stores and product_idx < self.n_products:
+            return bound + self.closed_min(product_idx, totals)
+        return bound + self.suffix_min[product_idx]
+
+    def state_key(self, product_idx, totals):
+        """
+        Kanonisk nyckel för ett delproblem. Resten av sökningen beror bara på vilka
+        butiker vars frakt redan är avgjord och hur långt de övriga har kvar till fri frakt:
+        - 0.0: butiken är oanvänd
+        - -1.0: butiken betalar frakt oavsett (ingen gräns, eller gränsen går inte längre att nå)
+        - gränsen: fri frakt är redan uppnådd
+        - annars summan, eftersom den fortfarande avgör om gränsen nås
+        Butiker utan grundfrakt hoppas över, utom de i flagged där det räcker att veta
+        om de används (straff eller max_stores). Trappstegsbutiker får -1 - frakten när
+        frakten inte längre kan ändras, annars summan.
+        """
+        offset = product_idx * self.n_stores
+        key = [product_idx]
+        for s in self.tracked:
+            t = totals[s]
+            limit = self.free_limit[s]
+            if t <= 0:
+                key.append(0.0)
+            elif t >= limit:
+                key.append(limit)
+            elif t + self.reach[offset + s] < limit:
+                key.append(-1.0)
+            else:
+                key.append(round(t, 2))
+        for s in self.tiered:
+            t = totals[s]
+            if t <= 0:
+                key.append(0.0)
+                continue
+            shipping = tier_price(self.rules[s], t)
+            if shipping == tier_price(self.rules[s], t + self.reach[offset + s]):
+                key.append(-1.0 - shipping)
+            else:
+                key.append(round(t, 2))
+        for s in self.flagged:
+            key.append(1.0 if totals[s] > 0 else 0.0)
+        return tuple(key)
+
+    def choices_for(self, assignments):
+        """Översätter en lista av offer-dicts till index i offer_ref (för att seeda sökningen)."""
+        return array('i', (self.offer_ref[p].index(offer) for p, offer in enumerate(assignments)))
+
+    def assignments_for(self, choices):
+        return [self.offer_ref[p][k] for p, k in enumerate(choices)]
+
+# Max antal delproblem i transpositionstabellen (äldst använda slängs först)
+MEMO_MAX_ENTRIES = 50_000
+# Nära löven är delträden så små att nyckelbygget kostar mer än det sparar
+MEMO_MIN_REMAINING = 3
+
+class SearchState:
+    """
+    Muterbart sökläge för solve_recursive (attribut är snabbare än dict-nycklar).
+
+    Med top_k > 1 samlas de K billigaste lösningarna med olika butiksuppsättningar i
+    top (butiksmask -> (kostnad, val)). best_cost är då beskärningsgränsen, dvs den
+    K:te bästa kostnaden, och transpositionstabellen används inte (den sparar bara
+    bästa fortsättningen från varje delproblem).
+    """
+    __slots__ = (
+        'totals', 'choices', 'best_cost', 'best_choices',
+        'nodes', 'pruned', 'pruned_memo', 'skipped', 'deadline', 'timed_out', 'open_bound',
+        'memo', 'memo_size', 'memo_hits', 'memo_misses', 'top', 'top_k'
+    )
+
+    def __init__(self, problem, best_cost=INF, best_choices=None, deadline=None, memo_size=MEMO_MAX_ENTRIES, top_k=1):
+        self.totals = array('d', [0.0]) * problem.n_stores
+        self.choices = array('i', [0]) * problem.n_products
+        self.best_cost = best_cost
+        self.best_choices = best_choices
+        self.nodes = 0
+        self.pruned = 0
+        self.pruned_memo = 0  # Del av pruned: beskurna mot transpositionstabellen
+        self.skipped = 0  # Grenar som inte prövades för att max_stores var nått
+        self.deadline = deadline
+        self.timed_out = False
+        self.open_bound = INF
+        # Transpositionstabell: state_key -> (restkostnad, resterande val eller None).
+        # Med val är restkostnaden exakt, utan är den en undre gräns.
+        self.memo = OrderedDict() if memo_size else None
+        self.memo_size = memo_size
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.top = {} if top_k > 1 else None
+        self.top_k = top_k
+        if self.top is not None:
+            self.memo = None
+
+def record_alternative(problem, state, cost, choices):
+    """Lägger en komplett lösning i top (bästa per butiksuppsättning, högst top_k st)."""
+    mask = 0
+    for p in range(problem.n_products):
+        mask |= 1 << problem.offer_store[p][choices[p]]
+
+    top = state.top
+    current = top.get(mask)
+    if current is not None and current[0] <= cost:
+        return
+    top[mask] = (cost, array('i', choices))
+    if len(top) > state.top_k:
+        del top[max(top, key=lambda m: top[m][0])]
+    if len(top) == state.top_k:
+        state.best_cost = max(entry[0] for entry in top.values())
+
+def solve_recursive(problem, product_idx, cost_so_far, state):
     """
     En rekursiv Branch and Bound-lösning.
     Garanterar matematiskt lägsta priset.
     """
-    
+    state.nodes += 1
+    totals = state.totals
+
+    # --- TIDSBUDGET ---
+    # När tiden är slut lämnas noden outforskad. Dess undre gräns sparas så att vi
+    # i efterhand vet hur långt ifrån optimum det bästa svaret högst kan vara.
+    if state.deadline is not None and (state.timed_out or time.perf_counter() >= state.deadline):
+        state.timed_out = True
+        state.open_bound = min(state.open_bound, problem.lower_bound(product_idx, totals, cost_so_far))
+        return
+
     # BASFALL: Vi har gått igenom alla produkter
-    if product_idx == len(products_list):
-        # Räkna ut total frakt för denna kombination
-        total_shipping = 0.0
-        for sid, total in current_store_totals.items():
-            if total > 0:
-                store_obj = store_lookup[sid]
-                total_shipping += calculate_shipping(store_obj, total)
-        
-        final_total = current_cost_so_far + total_shipping
-        
+    if product_idx == problem.n_products:
+        final_total = cost_so_far + problem.shipping_total(totals)
+
+        if state.top is not None:
+            if final_total < state.best_cost:
+                record_alternative(problem, state, final_total, state.choices)
+            return
+
         # Om detta är bättre än vårt tidigare bästa rekord, spara det!
-        if final_total < best_solution['cost']:
-            best_solution['cost'] = final_total
-            best_solution['assignments'] = list(current_assignments)
+        if final_total < state.best_cost:
+            state.best_cost = final_total
+            state.best_choices = array('i', state.choices)
         return
 
     # --- PRUNING (Optimering) ---
-    if current_cost_so_far >= best_solution['cost']:
+    if problem.lower_bound(product_idx, totals, cost_so_far) >= state.best_cost:
+        state.pruned += 1
         return
 
-    # Hämta nuvarande produkt och dess erbjudanden
-    pid, offers = products_list[product_idx]
-    qty = quantity_map[pid]
+    # --- TRANSPOSITIONSTABELL ---
+    # Samma delproblem nås ofta via olika grenar (t.ex. A->B och B->A för lika priser)
+    memo = state.memo
+    key = None
+    if memo is not None and problem.n_products - product_idx >= MEMO_MIN_REMAINING:
+        key = problem.state_key(product_idx, totals)
+        entry = memo.get(key)
+        if entry is None:
+            state.memo_misses += 1
+        else:
+            state.memo_hits += 1
+            memo.move_to_end(key)
+            rest_cost, rest_choices = entry
+            if rest_choices is not None:
+                # Exakt: bästa fortsättningen är redan känd, inget mer att hitta här
+                if cost_so_far + rest_cost < state.best_cost:
+                    state.best_cost = cost_so_far + rest_cost
+                    state.choices[product_idx:] = rest_choices
+                    state.best_choices = array('i', state.choices)
+                return
+            if cost_so_far + rest_cost >= state.best_cost:
+                state.pruned += 1
+                state.pruned_memo += 1
+                return
+        best_before = state.best_cost
 
-    # Sortering heuristik: Pris (lågt->högt), sedan föredra redan valda butiker
-    def sort_key(o):
-        is_active_store = 1 if current_store_totals.get(o['store_id'], 0) > 0 else 0
-        return (o['price'], -is_active_store)
+    # Erbjudandena är redan sorterade på pris (lågt->högt) i det kompilerade problemet
+    stores = problem.offer_store[product_idx]
+    costs = problem.offer_cost[product_idx]
+    amounts = problem.offer_amount[product_idx]
+    choices = state.choices
+    # Är max_stores nått får bara redan använda butiker väljas
+    full = problem.max_stores < problem.n_stores and problem.open_count(totals) >= problem.max_stores
 
-    sorted_offers = sorted(offers, key=sort_key)
-
-    for offer in sorted_offers:
-        sid = offer['store_id']
-        price = offer['price']
-        cost_for_items = price * qty
+    for k in range(len(stores)):
+        s = stores[k]
+        cost_for_items = costs[k]
 
         # Uppdatera state
-        old_total = current_store_totals.get(sid, 0.0)
-        current_store_totals[sid] = old_total + cost_for_items
-        current_assignments.append(offer)
-        
-        # Rekursera
-        solve_recursive(
-            product_idx + 1, 
-            products_list, 
-            current_store_totals, 
-            current_assignments, 
-            current_cost_so_far + cost_for_items, 
-            best_solution,
-            store_lookup,
-            quantity_map
-        )
+        old_total = totals[s]
+        if full and old_total <= 0:
+            state.skipped += 1
+            continue
+        totals[s] = old_total + amounts[k]
+        choices[product_idx] = k
+
+        solve_recursive(problem, product_idx + 1, cost_so_far + cost_for_items, state)
 
         # Backtrack
-        current_store_totals[sid] = old_total 
-        current_assignments.pop()
+        totals[s] = old_total
 
+    # Avbruten sökning ger ingen giltig slutsats om delproblemet
+    if key is None or state.timed_out:
+        return
+    if state.best_cost < best_before:
+        # Förbättringen hittades här och allt annat beskars mot den: restkostnaden är exakt
+        memo[key] = (state.best_cost - cost_so_far, state.best_choices[product_idx:])
+    else:
+        # Allt beskars: ingen fortsättning härifrån slår det nuvarande bästa
+        memo[key] = (state.best_cost - cost_so_far, None)
+    memo.move_to_end(key)
+    if len(memo) > state.memo_size:
+        memo.popitem(last=False)
 
-def calculate_best_basket(cart_items: list, db: Session):
-    if not cart_items:
-        return []
 
-    # 0. MAPPA UPP ANTAL
+def run_recursive_engine(products_list, store_lookup, quantity_map, deadline=None, hint=None, k=1, constraints=None):
+    """
+    Motor 1: Branch and Bound via solve_recursive.
+    Startar från heuristikens svar så att sökningen alltid har ett bra svar att
+    falla tillbaka på om tidsbudgeten tar slut.
+    Med k > 1 returneras även 'alternatives': upp till k-1 näst billigaste
+    tilldelningar med andra butiksuppsättningar, billigast först.
+    constraints (BasketConstraints) hanteras i själva sökningen; cost inkluderar då
+    straffen. Finns ingen tillåten korg blir assignments tom.
+    """
+    problem = BasketProblem(products_list, store_lookup, quantity_map, constraints)
+    seed = greedy_solution(products_list, store_lookup, quantity_map, hint)
+    seed_choices = problem.choices_for(seed['assignments'])
+    # Heuristiken känner inte till villkoren: dess svar kan bli dyrare eller otillåtet
+    seed_cost = problem.solution_cost(seed_choices) if constraints else seed['cost']
+    if seed_cost == INF:
+        seed_choices = None
+
+    if k > 1:
+        state = SearchState(problem, deadline=deadline, top_k=k)
+        if seed_choices is not None:
+            record_alternative(problem, state, seed_cost, seed_choices)
+        solve_recursive(problem, 0, 0.0, state)
+
+        ranked = sorted(state.top.values(), key=lambda entry: entry[0])
+        if ranked:
+            state.best_cost, state.best_choices = ranked[0]
+        alternatives = [problem.assignments_for(choices) for _, choices in ranked[1:]]
+    else:
+        state = SearchState(problem, best_cost=seed_cost, best_choices=seed_choices, deadline=deadline)
+        solve_recursive(problem, 0, 0.0, state)
+        alternatives = []
+
+    return {
+        'alternatives': alternatives,
+        'cost': state.best_cost,
+        'assignments': problem.assignments_for(state.best_choices) if state.best_choices is not None else [],
+        'nodes': state.nodes,
+        'pruned': state.pruned,
+        'prunes': {
+            'bound': state.pruned - state.pruned_memo,
+            'memo': state.pruned_memo,
+            'max_stores': state.skipped
+        },
+        'optimal': not state.timed_out,
+        'lower_bound': min(state.best_cost, state.open_bound),
+        'memo_hits': state.memo_hits,
+        'memo_misses': state.memo_misses
+    }
+
+def assignment_cost(assignments, store_lookup, quantity_map):
+    """Totalkostnad (varor + frakt) för en given tilldelning av erbjudanden."""
+    store_totals = defaultdict(float)
+    store_items = defaultdict(int)
+    for offer in assignments:
+        qty = quantity_map[offer['product_id']]
+        store_totals[offer['store_id']] += offer['price'] * qty
+        store_items[offer['store_id']] += qty
+    return sum(store_totals.values()) + sum(
+        calculate_shipping(store_lookup[sid], total, store_items[sid]) for sid, total in store_totals.items()
+    )
+
+def _local_descent(assignments, products_list, store_lookup, quantity_map):
+    """
+    Förbättrar en tilldelning lokalt tills inget drag sänker totalkostnaden:
+    flyttar en produkt i taget, eller stänger en butik och flyttar dess varor
+    till billigaste andra redan använda butik.
+    """
+    best_cost = assignment_cost(assignments, store_lookup, quantity_map)
+
+    improved = True
+    while improved:
+        improved = False
+
+        # 1. Flytta en produkt till ett annat erbjudande
+        for i, (_, offers) in enumerate(products_list):
+            current = assignments[i]
+            for offer in offers:
+                if offer is current:
+                    continue
+                assignments[i] = offer
+                cost = assignment_cost(assignments, store_lookup, quantity_map)
+                if cost < best_cost - 1e-9:
+                    best_cost = cost
+                    current = offer
+                    improved = True
+            assignments[i] = current
+
+        # 2. Stäng en butik
+        used_stores = {o['store_id'] for o in assignments}
+        for closing_sid in used_stores:
+            candidate = list(assignments)
+            feasible = True
+            for i, (_, offers) in enumerate(products_list):
+                if candidate[i]['store_id'] != closing_sid:
+                    continue
+                alternatives = [
+                    o for o in offers
+                    if o['store_id'] != closing_sid and o['store_id'] in used_stores
+                ]
+                if not alternatives:
+                    feasible = False
+                    break
+                candidate[i] = min(alternatives, key=lambda o: o['price'])
+            if not feasible:
+                continue
+            cost = assignment_cost(candidate, store_lookup, quantity_map)
+            if cost < best_cost - 1e-9:
+                best_cost = cost
+                assignments = candidate
+                improved = True
+                break
+
+    return assignments, best_cost
+
+def greedy_solution(products_list, store_lookup, quantity_map, hint=None):
+    """
+    Snabb heuristik (ingen optimalitetsgaranti) som ger en bra övre gräns.
+    Startar med billigaste erbjudandet per produkt och förbättrar lokalt. När det
+    tar stopp provar vi att fylla på en butik tills den når nästa steg i frakttrappan,
+    t.ex. fri frakt (billigaste påslaget först), och förbättrar lokalt därifrån.
+
+    hint ({product_id: store_id}, t.ex. förra optimum för en ändrad korg) ger en
+    extra startpunkt. Efter en liten ändring ligger den oftast nära nya optimum.
+    """
+    if not products_list:
+        return {'cost': 0.0, 'assignments': []}
+    store_lookup = compile_rules(store_lookup)
+
+    start = [min(offers, key=lambda o: o['price']) for _, offers in products_list]
+    assignments, best_cost = _local_descent(start, products_list, store_lookup, quantity_map)
+
+    if hint:
+        warm = []
+        for pid, offers in products_list:
+            at_hint = [o for o in offers if o['store_id'] == hint.get(pid)]
+            warm.append(min(at_hint or offers, key=lambda o: o['price']))
+        warm, warm_cost = _local_descent(warm, products_list, store_lookup, quantity_map)
+        if warm_cost < best_cost - 1e-9:
+            assignments, best_cost = warm, warm_cost
+
+    improved = True
+    while improved:
+        improved = False
+        for sid, rule in store_lookup.items():
+            candidate = list(assignments)
+            store_total = sum(
+                o['price'] * quantity_map[o['product_id']] for o in candidate if o['store_id'] == sid
+            )
+            target = next_threshold(rule, store_total)
+            if target is None:
+                continue
+
+            moves = []
+            for i, (pid, offers) in enumerate(products_list):
+                if candidate[i]['store_id'] == sid:
+                    continue
+                offer = next((o for o in offers if o['store_id'] == sid), None)
+                if offer:
+                    moves.append(((offer['price'] - candidate[i]['price']) * quantity_map[pid], i, offer))
+            moves.sort(key=lambda m: m[0])
+
+            for _, i, offer in moves:
+                if store_total >= target:
+                    break
+                candidate[i] = offer
+                store_total += offer['price'] * quantity_map[offer['product_id']]
+
+            candidate, cost = _local_descent(candidate, products_list, store_lookup, quantity_map)
+            if cost < best_cost - 1e-9:
+                best_cost = cost
+                assignments = candidate
+                improved = True
+                break
+
+    return {'cost': best_cost, 'assignments': assignments}
+
+def run_dp_engine(products_list, store_lookup, quantity_map, deadline=None, hint=None):
+    """
+    Motor 2: Exakt dynamisk programmering över butiksmängder.
+
+    Tillståndet efter varje produkt är (mängden använda butiker, hur långt varje butik
+    kommit mot sin fraktfria gräns). Summor över gränsen är likvärdiga, så de kapas vid gränsen
+    (för trappstegsbutiker vid översta steget).
+    Per butiksmängd sparas bara Pareto-fronten: ett tillstånd som är dyrare OCH har kommit
+    kortare mot fri frakt i alla butiker kan aldrig bli bättre och slängs.
+    """
+    # Dyraste produkterna först: då når butikerna sin fraktfria gräns tidigt,
+    # de kapade summorna sammanfaller och fler tillstånd kan slås ihop.
+    products_list = sorted(
+        products_list,
+        key=lambda item: -max(o['price'] for o in item[1]) * quantity_map[item[0]]
+    )
+    store_lookup = compile_rules(store_lookup)
+    bounds = build_bounds(products_list, quantity_map, store_lookup)
+
+    # Bara butiker vars frakt beror på summan (fler än ett prissteg) behöver spåra den.
+    # Övriga butiker kostar alltid sitt enda fraktpris (ev. 0) så fort de används.
+    store_ids = sorted({o['store_id'] for _, offers in products_list for o in offers})
+    store_bit = {sid: 1 << i for i, sid in enumerate(store_ids)}
+    tracked = [sid for sid in store_ids if len(store_lookup[sid].prices) > 1]
+    tracked_pos = {sid: i for i, sid in enumerate(tracked)}
+    untracked = [sid for sid in store_ids if sid not in tracked_pos]
+
+    def fixed_shipping(mask):
+        return sum(store_lookup[sid].prices[0] for sid in untracked if mask & store_bit[sid])
+
+    def state_bound(product_idx, mask, progress, cost):
+        bound = cost + bounds['suffix_min'][product_idx] + fixed_shipping(mask)
+        reach = bounds['store_reach'][product_idx]
+        for sid in tracked:
+            if mask & store_bit[sid]:
+                bound += tier_price(store_lookup[sid], progress[tracked_pos[sid]] + reach.get(sid, 0.0))
+        return bound
+
+    # Övre gräns från heuristiken (en giltig lösning, och svaret om tiden tar slut)
+    seed = greedy_solution(products_list, store_lookup, quantity_map, hint)
+    upper_bound = seed['cost'] + 1e-9
+
+    # front: mask -> lista av [progress, cost, trail], där trail är en länkad lista (föregående, offer)
+    front = {0: [(tuple(0.0 for _ in tracked), 0.0, None)]}
+    nodes = 1
+    pruned = 0
+    dominated_count = 0
+
+    for product_idx, (pid, offers) in enumerate(products_list):
+        qty = quantity_map[pid]
+        next_front = defaultdict(list)
+
+        for mask, entries in front.items():
+            for progress, cost, trail in entries:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    # Gränsen växer aldrig nedåt längs en övergång, så minsta gränsen
+                    # i nuvarande lager begränsar allt som inte hunnit utforskas.
+                    open_bound = min(
+                        state_bound(product_idx, m, p, c)
+                        for m, front_entries in front.items()
+                        for p, c, _ in front_entries
+                    )
+                    return {
+                        'cost': seed['cost'],
+                        'assignments': seed['assignments'],
+                        'nodes': nodes,
+                        'pruned': pruned,
+                        'prunes': {'bound': pruned - dominated_count, 'dominated': dominated_count},
+                        'optimal': False,
+                        'lower_bound': min(seed['cost'], open_bound)
+                    }
+
+                for offer in offers:
+                    sid = offer['store_id']
+                    amount = offer['price'] * qty
+                    new_mask = mask | store_bit[sid]
+                    new_cost = cost + amount + store_lookup[sid].per_item * qty
+                    new_progress = progress
+                    if sid in tracked_pos:
+                        pos = tracked_pos[sid]
+                        limit = store_lookup[sid].thresholds[-1]
+                        capped = min(round(progress[pos] + amount, 2), limit)
+                        new_progress = progress[:pos] + (capped,) + progress[pos + 1:]
+
+                    nodes += 1
+                    if state_bound(product_idx + 1, new_mask, new_progress, new_cost) > upper_bound:
+                        pruned += 1
+                        continue
+
+                    bucket = next_front[new_mask]
+                    dominated = False
+                    for other_progress, other_cost, _ in bucket:
+                        if other_cost <= new_cost and all(a >= b for a, b in zip(other_progress, new_progress)):
+                            dominated = True
+                            break
+                    if dominated:
+                        pruned += 1
+                        dominated_count += 1
+                        continue
+
+                    # Släng befintliga tillstånd som det nya dominerar
+                    bucket[:] = [
+                        e for e in bucket
+                        if not (new_cost <= e[1] and all(a >= b for a, b in zip(new_progress, e[0])))
+                    ]
+                    bucket.append((new_progress, new_cost, (trail, offer)))
+
+        front = next_front
+
+    best_solution = {
+        'cost': seed['cost'],
+        'assignments': seed['assignments'],
+        'nodes': nodes,
+        'pruned': pruned,
+        'prunes': {'bound': pruned - dominated_count, 'dominated': dominated_count},
+        'optimal': True
+    }
+    # Alla sluttillstånd poängsätts på en gång: frakten för de spårade butikerna
+    # räknas vektoriserat över en matris med en rad per tillstånd
+    best_trail = None
+    finals = [(mask, progress, cost, trail) for mask, entries in front.items() for progress, cost, trail in entries]
+    if finals:
+        final_totals = [cost + fixed_shipping(mask) for mask, _, cost, _ in finals]
+        if tracked:
+            table = ShippingTable([store_lookup[sid] for sid in tracked])
+            tracked_shipping = table.evaluate([progress for _, progress, _, _ in finals]).sum(axis=1)
+            final_totals = [t + float(ship) for t, ship in zip(final_totals, tracked_shipping)]
+        best_idx = min(range(len(finals)), key=final_totals.__getitem__)
+        if final_totals[best_idx] < best_solution['cost'] - 1e-9:
+            best_solution['cost'] = final_totals[best_idx]
+            best_trail = finals[best_idx][3]
+
+    # Hittade DP:n inget bättre än heuristiken var heuristikens svar redan optimalt
+    if best_trail is not None:
+        assignments = []
+        while best_trail is not None:
+            best_trail, offer = best_trail
+            assignments.append(offer)
+        best_solution['assignments'] = assignments[::-1]
+
+    best_solution['lower_bound'] = best_solution['cost']
+    return best_solution
+
+def _shipping_dominates(a, b, strictly_cheaper):
+    """
+    Kan butik a alltid ta över butik b:s varor utan att frakten blir dyrare?
+    Med exakt samma priser räcker det att a:s fraktregler är minst lika bra.
+    Är a billigare kan a:s summa hamna under sin fraktgräns trots att b nådde sin,
+    så då måste a:s gräns plus frakt ligga under b:s gräns (eller frakten vara 0).
+    Med frakttrappor krävs att a:s trappa aldrig ligger över b:s (och samma priser).
+    """
+    if a.per_item > b.per_item:
+        return False
+    if a.prices[0] == 0:
+        return True
+    if not (is_flat(a) and is_flat(b)):
+        if strictly_cheaper:
+            return False
+        breakpoints = set(a.thresholds + b.thresholds) - {0.0}
+        return a.prices[0] <= b.prices[0] and all(tier_price(a, t) <= tier_price(b, t) for t in breakpoints)
+
+    base_a, base_b = a.prices[0], b.prices[0]
+    limit_a = a.thresholds[1] if len(a.thresholds) == 2 else INF
+    limit_b = b.thresholds[1] if len(b.thresholds) == 2 else INF
+    if base_a > base_b:
+        return False
+    if not strictly_cheaper:
+        return limit_a <= limit_b
+    return limit_b == INF or limit_a + base_a <= limit_b
+
+def search_space(products_list):
+    """(antal erbjudanden, antal möjliga kombinationer) för en products_list."""
+    space = 1.0
+    for _, offers in products_list:
+        space *= len(offers)
+    return sum(len(offers) for _, offers in products_list), space
+
+def eliminate_dominated(products_list, store_lookup, quantity_map):
+    """
+    Förbehandling som bara tar bort det som BEVISLIGEN aldrig behövs i en optimal lösning.
+
+    1. Dominerade butiker: om butik A säljer allt som B säljer, till samma eller lägre pris
+       och med minst lika bra frakt, kan varje lösning som använder B flyttas till A.
+    2. Dominerade erbjudanden: att byta ett erbjudande mot ett billigare alternativ kan högst
+       kosta frakten i den egna butiken (om den då missar fri frakt) plus frakten i
+       alternativets butik (om den måste öppnas). Är prisskillnaden minst så stor stryks det.
+       Priserna jämförs inklusive tillägg per vara; med frakttrappa är det som står på spel
+       skillnaden mellan högsta och lägsta steget.
+
+    Returnerar (ny products_list, statistik om hur mycket sökrymden krympte).
+    """
+    offers_before, space_before = search_space(products_list)
+    store_lookup = compile_rules(store_lookup)
+
+    # --- 1. BUTIKER ---
+    store_prices = defaultdict(dict)
+    for pid, offers in products_list:
+        for o in offers:
+            current = store_prices[o['store_id']].get(pid)
+            if current is None or o['price'] < current:
+                store_prices[o['store_id']][pid] = o['price']
+
+    removed_stores = set()
+    for sid_b in sorted(store_prices):
+        prices_b = store_prices[sid_b]
+        for sid_a in sorted(store_prices):
+            if sid_a == sid_b or sid_a in removed_stores:
+                continue
+            prices_a = store_prices[sid_a]
+            if any(pid not in prices_a or prices_a[pid] > price for pid, price in prices_b.items()):
+                continue
+            strictly_cheaper = any(prices_a[pid] < price for pid, price in prices_b.items())
+            if _shipping_dominates(store_lookup[sid_a], store_lookup[sid_b], strictly_cheaper):
+                removed_stores.add(sid_b)
+                break
+
+    # --- 2. ERBJUDANDEN ---
+    def shipping_at_risk(rule):
+        # Frakten ett erbjudande kan "rädda" i sin egen butik genom att hjälpa den nå fri frakt
+        return rule.prices[0] - rule.prices[-1]
+
+    def unit_cost(offer):
+        return offer['price'] + store_lookup[offer['store_id']].per_item
+
+    reduced = []
+    for pid, offers in products_list:
+        qty = quantity_map[pid]
+        kept = []
+        for offer in sorted(offers, key=unit_cost):
+            if offer['store_id'] in removed_stores:
+                continue
+            rule = store_lookup[offer['store_id']]
+            dominated = any(
+                (unit_cost(offer) - unit_cost(alt)) * qty >= shipping_at_risk(rule) + (
+                    0.0 if alt['store_id'] == offer['store_id']
+                    else store_lookup[alt['store_id']].prices[0]
+                )
+                for alt in kept
+            )
+            if not dominated:
+                kept.append(offer)
+        reduced.append((pid, kept))
+
+    offers_after, space_after = search_space(reduced)
+
+    stats = {
+        "offers_before": offers_before,
+        "offers_after": offers_after,
+        "stores_removed": len(removed_stores),
+        "search_space_before": space_before,
+        "search_space_after": space_after
+    }
+    return reduced, stats
+
+# Tillgängliga lösare. Alla tar (products_list, store_lookup, quantity_map, deadline, hint)
+# och returnerar {'cost', 'assignments', 'nodes', 'pruned', 'prunes', 'optimal', 'lower_bound'}.
+# prunes delar upp pruned per orsak (t.ex. 'bound', 'memo', 'dominated').
+SOLVER_ENGINES = {
+    "recursive": run_recursive_engine,
+    "dp": run_dp_engine,
+}
+
+# Arbetsmått (antal produkter × antal erbjudanden) där DP-motorn tar över
+DP_ENGINE_MIN_WORK = 150
+
+def choose_engine(products_list):
+    """Väljer lösare utifrån korgens storlek gånger antalet erbjudanden."""
+    offer_count = sum(len(offers) for _, offers in products_list)
+    if len(products_list) * offer_count >= DP_ENGINE_MIN_WORK:
+        return "dp"
+    return "recursive"
+
+# Komponenter med minst så här mycket arbete löses i egna processer (om det finns minst två)
+PARALLEL_COMPONENT_MIN_WORK = 400
+MAX_COMPONENT_WORKERS = 4
+
+_component_pool = None
+
+def _get_component_pool():
+    """Processpoolen skapas först när den behövs, en per worker-process (med spawn, som solver_pool)."""
+    global _component_pool
+    if _component_pool is None:
+        _component_pool = ProcessPoolExecutor(
+            max_workers=min(MAX_COMPONENT_WORKERS, os.cpu_count() or 1), mp_context=MP_CONTEXT
+        )
+    return _component_pool
+
+def shutdown_component_pool():
+    """Stänger komponentpoolen när servern stängs ner."""
+    global _component_pool
+    pool, _component_pool = _component_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def split_components(products_list):
+    """
+    Delar upp korgen i oberoende delar: produkter hamnar i samma komponent om de
+    (via en kedja av produkter) delar någon butik. Frakten räknas per butik, så
+    komponenterna kan lösas var för sig och kostnaderna bara adderas.
+    """
+    parent = {}
+
+    def find(sid):
+        while parent[sid] != sid:
+            parent[sid] = parent[parent[sid]]
+            sid = parent[sid]
+        return sid
+
+    for _, offers in products_list:
+        first = offers[0]['store_id']
+        parent.setdefault(first, first)
+        for o in offers[1:]:
+            parent.setdefault(o['store_id'], o['store_id'])
+            root_a, root_b = find(first), find(o['store_id'])
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+    components = defaultdict(list)
+    for item in products_list:
+        components[find(item[1][0]['store_id'])].append(item)
+    return list(components.values())
+
+def _solve_component(engine, products_list, store_lookup, quantity_map, deadline, hint=None):
+    if engine == "auto":
+        engine = choose_engine(products_list)
+    solution = SOLVER_ENGINES[engine](products_list, store_lookup, quantity_map, deadline, hint)
+    solution['engine'] = engine
+    return solution
+
+def solve_components(products_list, store_lookup, quantity_map, engine="auto", deadline=None, parallel=True, hint=None):
+    """
+    Löser varje oberoende komponent för sig och slår ihop resultaten.
+    Sökkostnaden blir då summan av delarnas i stället för produkten.
+    Stora komponenter körs parallellt i processpoolen (om inte parallel=False,
+    t.ex. när vi redan kör i en lösarprocess).
+    """
+    components = split_components(products_list)
+
+    def work(component):
+        return len(component) * sum(len(offers) for _, offers in component)
+
+    large = [c for c in components if work(c) >= PARALLEL_COMPONENT_MIN_WORK]
+    futures = {}
+    if parallel and len(large) >= 2:
+        pool = _get_component_pool()
+        rules = compile_rules(store_lookup)
+        for component in large:
+            futures[id(component)] = pool.submit(_solve_component, engine, component, rules, quantity_map, deadline, hint)
+
+    solutions = []
+    for component in components:
+        if id(component) in futures:
+            continue
+        solutions.append(_solve_component(engine, component, store_lookup, quantity_map, deadline, hint))
+    solutions.extend(f.result() for f in futures.values())
+
+    prunes = defaultdict(int)
+    for sol in solutions:
+        for reason, count in sol.get('prunes', {}).items():
+            prunes[reason] += count
+
+    return {
+        'cost': sum(sol['cost'] for sol in solutions),
+        'assignments': [offer for sol in solutions for offer in sol['assignments']],
+        'nodes': sum(sol['nodes'] for sol in solutions),
+        'pruned': sum(sol['pruned'] for sol in solutions),
+        'prunes': dict(prunes),
+        # Bara sökmotorn har en transpositionstabell
+        'memo_hits': sum(sol.get('memo_hits', 0) for sol in solutions),
+        'memo_misses': sum(sol.get('memo_misses', 0) for sol in solutions),
+        'optimal': all(sol['optimal'] for sol in solutions),
+        'lower_bound': sum(sol['lower_bound'] for sol in solutions),
+        'engine': ",".join(sorted({sol['engine'] for sol in solutions})) or engine,
+        'components': len(components)
+    }
+
+
+def _quantity_map(cart_items):
     quantity_map = {}
     for item in cart_items:
         pid = item.product_id if hasattr(item, "product_id") else item.get("product_id")
         qty = item.quantity if hasattr(item, "quantity") else item.get("quantity", 1)
         quantity_map[pid] = qty
+    return quantity_map
 
-    product_ids = list(quantity_map.keys())
+def _deadline(time_budget_ms):
+    # Tidsbudgeten räknas från anropet, så datahämtningen äter också av den
+    if time_budget_ms:
+        return time.perf_counter() + time_budget_ms / 1000.0
+    return None
 
-    # 1. CACHE-CHECK
-    sorted_items = sorted(quantity_map.items())
-    cache_key_str = ",".join([f"{pid}:{qty}" for pid, qty in sorted_items])
-    cache_key = f"basket_optimization_v3:{cache_key_str}" # V3 för ny logik
+def _cache_key(quantity_map, k, constraints=None):
+    # Svaret med alternativ eller villkor är ett annat svar, så k och villkoren ingår i nyckeln
+    key = basket_cache.key_for(redis_client, quantity_map)
+    if key is None:
+        return None
+    if k > 1:
+        key = f"{key}|k{k}"
+    return key + constraints_key(constraints)
 
-    if redis_client:
-        try:
-            cached_result = redis_client.get(cache_key)
-            if cached_result:
-                return json.loads(cached_result)
-        except Exception:
-            pass
-
-    # 2. Hämta data
-    prices = (
-        db.query(ProductPrice, Store, Product)
-        .join(Store)
-        .join(Product)
-        .filter(ProductPrice.product_id.in_(product_ids))
-        .all()
+def _flight_key(cache_key, quantity_map, engine, time_budget_ms, k, constraints=None):
+    cart_key = cache_key or ",".join(f"{pid}:{qty}" for pid, qty in sorted(quantity_map.items()))
+    return f"{cart_key}|{engine}|{time_budget_ms}|{k}{constraints_key(constraints)}"
+
+# Anrop som tar längre tid än så (ms) loggas som varning
+OPTIMIZE_SLOW_MS = float(os.getenv("OPTIMIZE_SLOW_MS", "500"))
+
+metrics.counter("priskombo_optimize_requests_total", "Optimeringsanrop per cachenivå (l1, l2, coalesced, miss)")
+metrics.histogram("priskombo_optimize_phase_seconds", "Tid per fas i optimeringen (cache, db, solve, format, total)")
+metrics.histogram(
+    "priskombo_optimize_nodes", "Sökta noder per löst korg",
+    buckets=(10, 100, 1_000, 10_000, 100_000, 1_000_000)
+)
+metrics.counter("priskombo_optimize_pruned_total", "Beskurna grenar per orsak")
+metrics.counter("priskombo_optimize_offers_total", "Erbjudanden före och efter dominansfiltret")
+metrics.counter("priskombo_optimize_slow_total", "Optimeringsanrop långsammare än OPTIMIZE_SLOW_MS")
+
+def _ms_since(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def _finish(results, trace, started, debug=False):
+    """
+    Mätvärden, strukturerad logg och (med debug) ett debug-block på vinnaren.
+    trace har cachenivån ("l1", "l2", "coalesced" eller "miss") och tiderna för cache och db.
+    Sökstatistiken räknas bara när korgen faktiskt löstes i det här anropet.
+    """
+    tier = trace["cache"]
+    search = results[0]["search"] if results and tier == "miss" else {}
+    timings = {
+        "cache": trace.get("cache_ms"),
+        "db": trace.get("db_ms"),
+        "solve": search.get("solve_ms"),
+        "format": search.get("format_ms"),
+        "total": _ms_since(started),
+    }
+    timings = {phase: ms for phase, ms in timings.items() if ms is not None}
+
+    metrics.inc("priskombo_optimize_requests_total", cache=tier)
+    for phase, ms in timings.items():
+        metrics.observe("priskombo_optimize_phase_seconds", ms / 1000, phase=phase)
+    fields = {"cache": tier, "products": trace["products"], **{f"{phase}_ms": ms for phase, ms in timings.items()}}
+    if search:
+        metrics.observe("priskombo_optimize_nodes", search["nodes"])
+        for reason, count in search["prunes"].items():
+            metrics.inc("priskombo_optimize_pruned_total", count, reason=reason)
+        metrics.inc("priskombo_optimize_offers_total", search["offers_before"], stage="before")
+        metrics.inc("priskombo_optimize_offers_total", search["offers_after"], stage="after")
+        fields.update(
+            engine=search["engine"], nodes=search["nodes"], pruned=search["pruned"],
+            offers_before=search["offers_before"], offers_after=search["offers_after"],
+            optimal=results[0]["optimal"]
+        )
+
+    if timings["total"] >= OPTIMIZE_SLOW_MS:
+        metrics.inc("priskombo_optimize_slow_total")
+        logger.warning("🐢 Långsam optimering", extra={"fields": fields})
+    else:
+        logger.debug("Optimering klar", extra={"fields": fields})
+
+    if debug and results:
+        # Resultatlistan kan delas med cachen och andra väntande anrop: kopiera vinnaren
+        results = [dict(results[0], debug={"cache": tier, "timings_ms": timings}), *results[1:]]
+    return results
+
+def calculate_best_basket(cart_items: list, db: Session, engine: str = "auto", time_budget_ms: int = None, k: int = 1, constraints: BasketConstraints = None, debug: bool = False):
+    """
+    debug=True lägger till {"cache", "timings_ms"} på vinnaren: cachenivån som svarade
+    och tiden per fas. Sökstatistiken finns alltid under "search".
+    """
+    if not cart_items:
+        return []
+
+    started = time.perf_counter()
+    deadline = _deadline(time_budget_ms)
+
+    # 0. MAPPA UPP ANTAL
+    quantity_map = _quantity_map(cart_items)
+    trace = {"products": len(quantity_map)}
+
+    # 1. CACHE-CHECK (L1 i processen, sedan Redis)
+    # Nyckeln innehåller produkternas versioner, så en import gör bara berörda korgar inaktuella
+    cache_key = _cache_key(quantity_map, k, constraints)
+    cached_result, trace["cache"] = basket_cache.lookup(redis_client, cache_key)
+    trace["cache_ms"] = _ms_since(started)
+    if cached_result:
+        return _finish(cached_result, trace, started, debug)
+
+    # Identiska samtidiga anrop (i processen och mellan workers) väntar på den första beräkningen
+    results = single_flight.do(
+        redis_client,
+        _flight_key(cache_key, quantity_map, engine, time_budget_ms, k, constraints),
+        lambda: _optimize_basket(db, quantity_map, engine, deadline, cache_key, k, constraints, trace)
+    )
+    if "db_ms" not in trace:
+        # Svaret kom från ett annat anrops beräkning
+        trace["cache"] = "coalesced"
+    return _finish(results, trace, started, debug)
+
+async def calculate_best_basket_async(cart_items: list, db: Session, engine: str = "auto", time_budget_ms: int = None, hint: dict = None, k: int = 1, constraints: BasketConstraints = None, debug: bool = False):
+    """
+    Samma resultat som calculate_best_basket, för async-endpoints: Redis och Postgres
+    anropas i trådpoolen, sessionen släpps när datan är hämtad och själva lösningen
+    körs i solver_pool. Kastar SolverBusy om poolen och dess kö är fulla.
+    hint ({product_id: store_id}) varmstartar sökningen, se greedy_solution.
+    """
+    if not cart_items:
+        return []
+
+    started = time.perf_counter()
+    deadline = _deadline(time_budget_ms)
+    quantity_map = _quantity_map(cart_items)
+    trace = {"products": len(quantity_map)}
+
+    cache_key = await run_in_threadpool(_cache_key, quantity_map, k, constraints)
+    cached_result, trace["cache"] = await run_in_threadpool(basket_cache.lookup, redis_client, cache_key)
+    trace["cache_ms"] = _ms_since(started)
+    if cached_result:
+        return _finish(cached_result, trace, started, debug)
+
+    async def compute():
+        loading = time.perf_counter()
+        raw_product_map, store_rules = await run_in_threadpool(
+            _load_and_release, db, quantity_map, delivery_of(constraints)
+        )
+        trace["db_ms"] = _ms_since(loading)
+        results, optimal = await solver_pool.run(
+            solve_basket, raw_product_map, store_rules, quantity_map, engine, deadline, False, hint, k, constraints
+        )
+        if results and optimal:
+            await run_in_threadpool(basket_cache.set, redis_client, cache_key, results)
+        return results
+
+    results = await single_flight.do_async(
+        redis_client, _flight_key(cache_key, quantity_map, engine, time_budget_ms, k, constraints), compute
     )
+    if "db_ms" not in trace:
+        trace["cache"] = "coalesced"
+    return _finish(results, trace, started, debug)
+
+def _load_and_release(db: Session, quantity_map: dict, delivery: str = DEFAULT_DELIVERY):
+    try:
+        return load_basket(db, quantity_map, delivery)
+    finally:
+        # Lösningen kan ta tid, ingen anledning att hålla en databasanslutning under tiden
+        db.close()
+
+def _optimize_basket(db: Session, quantity_map: dict, engine: str, deadline, cache_key, k=1, constraints=None, trace=None):
+    loading = time.perf_counter()
+    raw_product_map, store_rules = load_basket(db, quantity_map, delivery_of(constraints))
+    if trace is not None:
+        trace["db_ms"] = _ms_since(loading)
+    results, optimal = solve_basket(raw_product_map, store_rules, quantity_map, engine, deadline, k=k, constraints=constraints)
+
+    # 8. SPARA TILL CACHE (bara bevisat optimala svar)
+    if results and optimal:
+        basket_cache.set(redis_client, cache_key, results)
+
+    return results
+
+# Max antal korgar (vinnare + alternativ) per anrop
+MAX_ALTERNATIVES = 5
+
+# Max antal korgar i ett batch-anrop
+MAX_BATCH_CARTS = 500
+BATCH_BUSY_RETRY_SECONDS = 0.05
+
+def _prepare_batch(db: Session, quantity_maps: list):
+    """
+    Cacheuppslag för alla korgar (ett MGET för versioner, ett för resultat) och
+    EN laddning av erbjudanden för unionen av produkterna i korgarna som saknas.
+    """
+    keys = basket_cache.keys_for(redis_client, quantity_maps)
+    results = basket_cache.get_many(redis_client, keys)
+
+    todo = []
+    union = {}
+    for i, quantity_map in enumerate(quantity_maps):
+        if not quantity_map:
+            results[i] = []
+        elif results[i] is None:
+            todo.append(i)
+            union.update(quantity_map)
+
+    raw_product_map, store_rules = load_basket(db, union) if union else ({}, {})
+    return keys, results, todo, raw_product_map, store_rules
+
+def _cart_slice(raw_product_map, store_rules, quantity_map):
+    """Plockar ut en korgs erbjudanden och butiker ur batchens gemensamma data."""
+    offers = {pid: raw_product_map[pid] for pid in quantity_map if pid in raw_product_map}
+    store_ids = {o['store_id'] for cart_offers in offers.values() for o in cart_offers}
+    return offers, {sid: store_rules[sid] for sid in store_ids}
+
+def calculate_best_baskets(carts: list, db: Session, engine: str = "auto", time_budget_ms: int = None):
+    """
+    Batchvariant av calculate_best_basket: en resultatlista per korg, i samma ordning.
+    Erbjudandena hämtas en gång för alla korgar. Tidsbudgeten gäller per korg.
+    """
+    quantity_maps = [_quantity_map(cart) for cart in carts]
+    keys, results, todo, raw_product_map, store_rules = _prepare_batch(db, quantity_maps)
+
+    to_cache = {}
+    for i in todo:
+        offers, cart_rules = _cart_slice(raw_product_map, store_rules, quantity_maps[i])
+        results[i], optimal = solve_basket(offers, cart_rules, quantity_maps[i], engine, _deadline(time_budget_ms))
+        if results[i] and optimal:
+            to_cache[keys[i]] = results[i]
+
+    basket_cache.set_many(redis_client, to_cache)
+    return results
+
+async def stream_best_baskets(carts: list, db: Session, engine: str = "auto", time_budget_ms: int = None):
+    """
+    Async batch: laddar all data direkt (och släpper sessionen), och returnerar sedan
+    en async-generator som ger (index, resultat, fel) i den ordning korgarna blir klara.
+    Lösningarna körs parallellt i solver_pool, högst en per lösarprocess åt gången
+    så att batchen inte tränger undan enskilda anrop.
+    """
+    quantity_maps = [_quantity_map(cart) for cart in carts]
+    keys, results, todo, raw_product_map, store_rules = await run_in_threadpool(
+        _prepare_batch_and_release, db, quantity_maps
+    )
+    limit = asyncio.Semaphore(solver_pool.max_workers)
+
+    async def solve(i):
+        offers, cart_rules = _cart_slice(raw_product_map, store_rules, quantity_maps[i])
+        try:
+            async with limit:
+                while True:
+                    try:
+                        cart_results, optimal = await solver_pool.run(
+                            solve_basket, offers, cart_rules, quantity_maps[i], engine, _deadline(time_budget_ms), False
+                        )
+                        break
+                    except SolverBusy:
+                        # Strömmen har redan börjat, så vi väntar in en ledig plats i stället för att ge upp
+                        await asyncio.sleep(BATCH_BUSY_RETRY_SECONDS)
+            if cart_results and optimal:
+                await run_in_threadpool(basket_cache.set, redis_client, keys[i], cart_results)
+            return i, cart_results, None
+        except Exception as e:
+            logger.error(f"❌ Batch-korg {i} misslyckades: {e}")
+            return i, None, "Ett fel uppstod vid optimeringen"
+
+    async def stream():
+        # Cachade korgar först, de är redan klara
+        for i, cart_results in enumerate(results):
+            if cart_results is not None:
+                yield i, cart_results, None
+
+        tasks = [asyncio.ensure_future(solve(i)) for i in todo]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Klienten kan ha kopplat ner mitt i strömmen
+            for task in tasks:
+                task.cancel()
+
+    return stream()
+
+def _prepare_batch_and_release(db: Session, quantity_maps: list):
+    try:
+        return _prepare_batch(db, quantity_maps)
+    finally:
+        db.close()
+
+def load_basket(db: Session, quantity_map: dict, delivery: str = DEFAULT_DELIVERY):
+    """
+    Hämtar erbjudanden och fraktregler för korgen som rena data (dicts och ShippingRule),
+    så att lösningen kan köras utan databas, även i en annan process.
+    Fraktreglerna gäller leveranssättet delivery.
+    """
+    product_ids = list(quantity_map.keys())
 
-    all_stores = {}
-    raw_product_map = defaultdict(list)
+    # 2. Hämta data: erbjudanden per produkt från cachen, bara missar går till Postgres
+    offer_entries = load_product_offers(db, product_ids, redis_client)
+    store_ids = {offer[0] for entry in offer_entries.values() for offer in entry["offers"]}
+    all_stores = {store.id: store for store in db.query(Store).filter(Store.id.in_(store_ids))} if store_ids else {}
+
+    raw_product_map = {}
+    # Prisrader utan förberäknad tracking_url får sin länk först om erbjudandet hamnar i svaret, se offer_url
+    affiliates = {sid: affiliate_info(store) for sid, store in all_stores.items()}
 
     # 3. Strukturera data
-    for price, store, product in prices:
-        all_stores[store.id] = store
-        tracking_url = generate_tracking_link(price.url, store)
-        
-        raw_product_map[price.product_id].append({
-            "product_id": price.product_id,
-            "product_name": product.name,
-            "product_slug": product.slug,
-            "store_id": store.id,
-            "store_name": store.name,
-            "price": price.price,
-            "url": tracking_url,
-            "shipping_rules": store 
-        })
-
-    # 4. PRE-PROCESSING för rekursionen
-    MAX_REASONABLE_SHIPPING = 250.0 
+    for pid, entry in offer_entries.items():
+        offers = []
+        for store_id, price, url, tracking_url in entry["offers"]:
+            store = all_stores[store_id]
+
+            offers.append({
+                "product_id": pid,
+                "product_name": entry["name"],
+                "product_slug": entry["slug"],
+                "store_id": store_id,
+                "store_name": store.name,
+                "price": price,
+                "url": url if tracking_url is None else tracking_url,
+                "affiliate": affiliates[store_id] if tracking_url is None else None
+            })
+        if offers:
+            raw_product_map[pid] = offers
+
+    store_rules = compile_rules(all_stores, delivery)
+    return raw_product_map, store_rules
+
+def offer_url(offer):
+    """Erbjudandets tracking-länk. Skapas bara för erbjudanden som visas, inte för alla som söks igenom."""
+    affiliate = offer.get("affiliate")
+    if affiliate is None:
+        return offer.get("url")
+    return generate_tracking_link(offer.get("url"), affiliate)
+
+def best_single_store(raw_product_map: dict, all_stores: dict, quantity_map: dict):
+    """
+    Billigaste korgen där allt köps i samma butik, eller None om ingen butik har allt.
+    Bygger ett index butik -> {produkt: billigaste erbjudande} i ett svep över erbjudandena
+    (använder alla erbjudanden, även de som dominans-filtret tog bort) och räknar
+    frakten för alla kandidatbutiker på en gång.
+    """
+    store_index = defaultdict(dict)
+    for pid, offers in raw_product_map.items():
+        for offer in offers:
+            by_product = store_index[offer['store_id']]
+            current = by_product.get(pid)
+            if current is None or offer['price'] < current['price']:
+                by_product[pid] = offer
+
+    # Butiker som saknar varor är inga kandidater
+    candidates = [sid for sid, by_product in store_index.items() if len(by_product) >= len(quantity_map)]
+    if not candidates:
+        return None
+
+    rules = [shipping_rule(all_stores[sid]) for sid in candidates]
+    item_count = sum(quantity_map.values())
+    sub_totals = [
+        sum(offer['price'] * quantity_map[pid] for pid, offer in store_index[sid].items())
+        for sid in candidates
+    ]
+    shipping = ShippingTable(rules).evaluate(sub_totals)
+    costs = [
+        sub_total + float(ship) + rule.per_item * item_count
+        for sub_total, ship, rule in zip(sub_totals, shipping, rules)
+    ]
+    best = min(range(len(candidates)), key=costs.__getitem__)
+    return [store_index[candidates[best]][pid] for pid in quantity_map]
+
+def solve_basket(raw_product_map: dict, all_stores: dict, quantity_map: dict, engine: str = "auto", deadline=None, parallel=True, hint=None, k=1, constraints=None):
+    """
+    Löser en hämtad korg (ren beräkning, ingen databas eller cache).
+    hint är {product_id: store_id} från en tidigare lösning (varmstart).
+    k > 1 ger upp till k-1 alternativa korgar (andra butiker) efter vinnaren.
+    constraints (BasketConstraints) begränsar vilka butiker som får användas.
+    Returnerar (resultatlista, optimal).
+    """
+    started = time.perf_counter()
+    product_ids = list(quantity_map.keys())
+    all_stores = compile_rules(all_stores)
+
+    # Uteslutna butiker finns inte för lösaren (och inte för Samlad leverans nedan)
+    if constraints and constraints.exclude_store_ids:
+        excluded = set(constraints.exclude_store_ids)
+        raw_product_map = {
+            pid: [o for o in offers if o['store_id'] not in excluded]
+            for pid, offers in raw_product_map.items()
+        }
+    # max_stores och straff kopplar ihop butikerna: ingen dominans- eller komponentuppdelning
+    coupled = k > 1 or bool(constraints and (constraints.max_stores or store_penalties(constraints, all_stores)))
+
+    # 4. PRE-PROCESSING för lösaren
     products_list = []
     
     for pid in product_ids:
         offers = raw_product_map.get(pid)
         if not offers:
             continue
-        min_price = min(o['price'] for o in offers)
-        threshold = min_price + MAX_REASONABLE_SHIPPING
-        valid_offers = [o for o in offers if o['price'] <= threshold]
-        products_list.append((pid, valid_offers))
+        products_list.append((pid, offers))
 
+    if coupled:
+        # Filtret bevarar bara det obegränsade optimum. Alternativen och villkoren
+        # kan behöva butiker som filtret annars skulle ta bort.
+        offers, space = search_space(products_list)
+        reduction_stats = {
+            "offers_before": offers,
+            "offers_after": offers,
+            "stores_removed": 0,
+            "search_space_before": space,
+            "search_space_after": space
+        }
+    else:
+        products_list, reduction_stats = eliminate_dominated(products_list, all_stores, quantity_map)
     products_list.sort(key=lambda x: len(x[1]))
 
-    # 5. KÖR REKURSIV LÖSARE (Hittar den absoluta vinnaren)
-    best_solution = {'cost': float('inf'), 'assignments': []}
-    
-    solve_recursive(
-        product_idx=0, 
-        products_list=products_list, 
-        current_store_totals={}, 
-        current_assignments=[], 
-        current_cost_so_far=0.0, 
-        best_solution=best_solution, 
-        store_lookup=all_stores,
-        quantity_map=quantity_map
-    )
+    # 5. KÖR LÖSAREN (Hittar den absoluta vinnaren), en gång per oberoende komponent
+    if coupled:
+        # Alternativen samlas under en och samma sökning och villkoren gäller hela korgen,
+        # så komponenterna kan inte delas upp. DP-motorn saknar stöd för villkoren.
+        best_solution = run_recursive_engine(products_list, all_stores, quantity_map, deadline, hint, k, constraints)
+        best_solution['engine'] = "recursive"
+        best_solution['components'] = 1
+    else:
+        best_solution = solve_components(products_list, all_stores, quantity_map, engine, deadline, parallel, hint)
+    solved = time.perf_counter()
 
     # 6. FORMATERA VINNAREN
     results = []
@@ -193,21 +1451,24 @@ def calculate_best_basket(cart_items: list, db: Session):
             for sid, items in store_groups.items():
                 store = all_stores[sid]
                 sub_total = sum(item["price"] * quantity_map[item["product_id"]] for item in items)
-                shipping = calculate_shipping(store, sub_total)
+                item_count = sum(quantity_map[item["product_id"]] for item in items)
+                # Frakten inkluderar eventuella tillägg per vara
+                shipping = calculate_shipping(store, sub_total, item_count)
                 
                 store_names.append(store.name)
                 calc_total += sub_total + shipping
                 
                 details.append({
                     "store": store.name,
-                    "products_count": sum(quantity_map[item["product_id"]] for item in items),
+                    "store_id": sid,
+                    "products_count": item_count,
                     "products": [
                         {
                             "id": item["product_id"],
                             "name": item["product_name"],
                             "slug": item["product_slug"],
                             "price": item["price"],
-                            "url": item.get("url")
+                            "url": offer_url(item)
                         } for item in items
                     ],
                     "products_cost": sub_total,
@@ -229,51 +1490,34 @@ def calculate_best_basket(cart_items: list, db: Session):
             
         # Lägg till vinnaren först
         winner_result = build_result_object(best_solution['assignments'])
+        # optimal=False betyder att tidsbudgeten tog slut; gap är max avstånd till optimum (kr)
+        winner_result["optimal"] = best_solution['optimal']
+        winner_result["gap"] = round(best_solution['cost'] - best_solution['lower_bound'], 2)
+        # Sökstatistik så vi kan se hur mycket den undre gränsen beskär
+        winner_result["search"] = {
+            "engine": best_solution['engine'],
+            "components": best_solution['components'],
+            "nodes": best_solution['nodes'],
+            "pruned": best_solution['pruned'],
+            "prunes": best_solution['prunes'],
+            "memo_hits": best_solution['memo_hits'],
+            "memo_misses": best_solution['memo_misses'],
+            **reduction_stats,
+            "solve_ms": round((solved - started) * 1000, 2)
+        }
         results.append(winner_result)
         
-        # 7. (NYTT) OM VINNAREN ÄR EN SPLIT -> HITTA BÄSTA SAMLADE LEVERANS
-        if winner_result["type"] != "Samlad leverans":
-            
-            best_single_store_option = None
-            min_single_cost = float('inf')
-            
-            # Gruppera ALLA offers per butik (använd raw_product_map för att inte missa filtrerade butiker)
-            store_inventories = defaultdict(list)
-            for pid, offers in raw_product_map.items():
-                for offer in offers:
-                    store_inventories[offer['store_id']].append(offer)
-            
-            required_qty_count = len(quantity_map)
-            
-            for sid, offers in store_inventories.items():
-                # Kolla att butiken har alla unika produkter som krävs
-                unique_pids_in_store = {o['product_id'] for o in offers}
-                if len(unique_pids_in_store) < required_qty_count:
-                    continue # Butiken saknar varor
-                
-                # Butiken har allt! Välj ut de specifika erbjudandena (om dubbletter finns, ta första)
-                current_store_items = []
-                
-                for pid in product_ids:
-                    # Hitta erbjudandet för denna produkt i denna butik
-                    match = next((o for o in offers if o['product_id'] == pid), None)
-                    if match:
-                        current_store_items.append(match)
-                
-                # Räkna ut kostnad för denna enskilda butik
-                # Vi kan återanvända build_result_object för att få korrekt fraktuträkning
-                single_res = build_result_object(current_store_items, type_override="Samlad leverans")
-                
-                if single_res["total_cost"] < min_single_cost:
-                    min_single_cost = single_res["total_cost"]
-                    best_single_store_option = single_res
-            
-            # Om vi hittade en samlad leverans, lägg till den som #2
-            if best_single_store_option:
-                results.append(best_single_store_option)
+        # 7. ALTERNATIV (k > 1), billigast först, med andra butiksuppsättningar än vinnaren
+        for alternative in best_solution.get('alternatives', []):
+            single = len({o['store_id'] for o in alternative}) == 1
+            results.append(build_result_object(alternative, type_override="Samlad leverans" if single else "Alternativ"))
+
+        # 7b. OM VINNAREN ÄR EN SPLIT -> HITTA BÄSTA SAMLADE LEVERANS (om den inte redan finns bland alternativen)
+        if not any(r["type"] == "Samlad leverans" for r in results):
+            single_store_items = best_single_store(raw_product_map, all_stores, quantity_map)
+            if single_store_items:
+                results.append(build_result_object(single_store_items, type_override="Samlad leverans"))
 
-    # 8. SPARA TILL CACHE
-    if redis_client and results:
-        redis_client.setex(cache_key, 600, json.dumps(results)) 
+        winner_result["search"]["format_ms"] = round((time.perf_counter() - solved) * 1000, 2)
 
-    return results
\ No newline at end of file
+    return results, best_solution['optimal']
\ No newline at end of file
@@ -0,0 +1,100 @@
+import base64
+import json
+from collections import namedtuple
+from sqlalchemy import func, case, tuple_
+from sqlalchemy.orm import Session
+from app.models import Product, ProductPrice
+from app.models.product import popularity_key, name_key, rating_key
+
+# Största sidan som listningarna lämnar ut; hela katalogen hämtas via /products/export
+MAX_PAGE_SIZE = 200
+EXPORT_BATCH_SIZE = 1000
+
+SortSpec = namedtuple("SortSpec", ["keys", "descending"])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def price_summary_subquery(db: Session):
+    """Lägsta pris och största rabatt (andel av ordinarie pris) per produkt."""
+    discount = case(
+        (ProductPrice.regular_price > 0, (ProductPrice.regular_price - ProductPrice.price) / ProductPrice.regular_price)
+    )
+    return (
+        db.query(
+            ProductPrice.product_id,
+            func.min(ProductPrice.price).label("min_price"),
+            func.max(discount).label("max_discount"),
+        )
+        .group_by(ProductPrice.product_id)
+        .subquery()
+    )
+
+
+def sort_spec(sort: str, prices=None) -> SortSpec:
+    """
+    Nyckeln för en sortering, alltid med id sist så att ordningen är entydig.
+    prices är price_summary_subquery (behövs bara för pris- och rabattsorteringarna).
+    Produkter utan pris hamnar sist vid prissortering.
+    """
+    if sort in ("price_asc", "price_desc"):
+        if sort == "price_asc":
+            return SortSpec((func.coalesce(prices.c.min_price, float("inf")), Product.id), False)
+        return SortSpec((func.coalesce(prices.c.min_price, -1.0), Product.id), True)
+    if sort == "discount_desc":
+        return SortSpec((func.coalesce(prices.c.max_discount, -1.0), Product.id), True)
+    if sort == "rating_desc":
+        return SortSpec((rating_key, Product.id), True)
+    if sort == "name_asc":
+        return SortSpec((name_key, Product.id), False)
+    if sort == "newest":
+        return SortSpec((Product.id,), True)
+    return SortSpec((popularity_key, name_key, Product.id), False)
+
+
+def encode_cursor(sort: str, values) -> str:
+    payload = json.dumps({"sort": sort, "after": list(values)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str):
+    """Nyckelvärdena i cursorn. InvalidCursor om den är trasig eller gjord för en annan sortering."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = payload["after"]
+    except Exception:
+        raise InvalidCursor("Ogiltig cursor")
+    if payload.get("sort") != sort or not isinstance(values, list):
+        raise InvalidCursor("Cursorn hör till en annan sortering")
+    return values
+
+
+def paginate(query, spec: SortSpec, sort: str, limit: int, cursor: str = None):
+    """
+    Keyset-paginering: ([produkter], next_cursor). Sidan börjar direkt efter cursorns
+    nyckel i stället för att räkna sig förbi tidigare rader med OFFSET, så djupa sidor
+    kostar lika lite som den första. next_cursor är None på sista sidan.
+    """
+    if cursor:
+        values = decode_cursor(cursor, sort)
+        if len(values) != len(spec.keys):
+            raise InvalidCursor("Ogiltig cursor")
+        row, after = tuple_(*spec.keys), tuple_(*values)
+        query = query.filter(row < after if spec.descending else row > after)
+
+    order = [key.desc() if spec.descending else key.asc() for key in spec.keys]
+    rows = (
+        query.add_columns(*[key.label(f"sort_key_{i}") for i, key in enumerate(spec.keys)])
+        .order_by(*order)
+        .limit(limit + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort, rows[-1][1:])
+    return [row[0] for row in rows], next_cursor
+
@@ -0,0 +1,106 @@
+import os
+from sqlalchemy import Float, func, literal, select, text, cast, or_
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.orm import Session
+from app.models import Product
+from app.models.product import FULLTEXT_CONFIG
+from app.core.logging import get_logger
+
+logger = get_logger("search")
+
+# Sökläge: "substring" (ILIKE '%q%', fungerar utan tillägg), "trigram" (pg_trgm, rankat)
+# eller "fulltext" (svensk stämning via search_vector, kompletterat med trigram om det finns)
+SEARCH_MODES = ("substring", "trigram", "fulltext")
+DEFAULT_SEARCH_MODE = os.getenv("SEARCH_MODE", "substring")
+
+# Lägsta word_similarity för en träff (0-1). Lägre = mer stavfelstolerant men fler och sämre träffar.
+TRGM_THRESHOLD = float(os.getenv("SEARCH_TRGM_THRESHOLD", "0.4"))
+SEARCH_LIMIT = 50
+# Trigramlikhetens vikt i fulltext-rankningen; ts_rank_cd ligger oftast i intervallet 0-1
+FULLTEXT_TRGM_WEIGHT = float(os.getenv("SEARCH_FULLTEXT_TRGM_WEIGHT", "0.5"))
+
+
+def trigram_query(q: str, limit: int = SEARCH_LIMIT):
+    """
+    Rankade produkt-id:n för q: (id, score), bäst först och sedan populärast.
+
+    Sorteringen är på avståndet name <->> q (1 - word_similarity(q, name)), som
+    GiST-indexet ix_products_name_trgm_gist (migration f3a9c6e2b8d1) kan lämna ut i
+    ordning: en KNN-sökning som slutar efter LIMIT träffar i stället för att räkna
+    likheten för alla rader som klarar tröskeln (q <% name) och sortera dem.
+    Tröskeln sätts med set_trigram_threshold.
+    """
+    distance = Product.name.op("<->>", return_type=Float)(q)
+    return (
+        select(Product.id, (1 - distance).label("score"))
+        .where(literal(q).op("<%")(Product.name))
+        .order_by(distance, Product.popularity_score.desc(), Product.id)
+        .limit(limit)
+    )
+
+
+def fulltext_query(q: str, limit: int = SEARCH_LIMIT, with_trigram: bool = False):
+    """
+    Rankade produkt-id:n för q med fulltextsökning: (id, score), bäst först och sedan populärast.
+
+    websearch_to_tsquery tål godtycklig användarinmatning ("nivea kräm", "schampo -balsam")
+    och stämningen gör att böjningar matchar ("krämer" hittar "kräm"). search_vector @@ tsq
+    går mot GIN-indexet ix_products_search_vector. Med with_trigram räknas även stavfel
+    (q <% name) som träffar och likheten viktas in i poängen.
+    """
+    tsq = func.websearch_to_tsquery(cast(FULLTEXT_CONFIG, REGCONFIG), q)
+    score = func.ts_rank_cd(Product.search_vector, tsq)
+    condition = Product.search_vector.op("@@")(tsq)
+    if with_trigram:
+        score = score + FULLTEXT_TRGM_WEIGHT * func.word_similarity(q, Product.name)
+        condition = or_(condition, literal(q).op("<%")(Product.name))
+    return (
+        select(Product.id, score.label("score"))
+        .where(condition)
+        .order_by(score.desc(), Product.popularity_score.desc(), Product.id)
+        .limit(limit)
+    )
+
+
+def set_trigram_threshold(db: Session, threshold: float = TRGM_THRESHOLD):
+    """Gäller bara den pågående transaktionen (set_config med is_local)."""
+    db.execute(select(func.set_config("pg_trgm.word_similarity_threshold", str(threshold), True)))
+
+
+def ranked_product_ids(
+    db: Session, q: str, limit: int = SEARCH_LIMIT, threshold: float = TRGM_THRESHOLD, mode: str = "trigram"
+):
+    """[(product_id, score)] från trigram_query, eller fulltext_query om mode="fulltext"."""
+    with_trigram = mode == "trigram" or trigram_available(db)
+    if with_trigram:
+        set_trigram_threshold(db, threshold)
+    if mode == "fulltext":
+        statement = fulltext_query(q, limit, with_trigram=with_trigram)
+    else:
+        statement = trigram_query(q, limit)
+    return [(pid, float(score)) for pid, score in db.execute(statement)]
+
+
+_trigram_available = None
+
+
+def trigram_available(db: Session) -> bool:
+    """Om pg_trgm är installerat i databasen (kontrolleras en gång per process)."""
+    global _trigram_available
+    if _trigram_available is None:
+        _trigram_available = db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+        if not _trigram_available:
+            logger.warning("⚠️ pg_trgm saknas i databasen, trigramsökning faller tillbaka till substring")
+    return _trigram_available
+
+
+def resolve_mode(db: Session, mode: str = None) -> str:
+    """
+    Sökläget som faktiskt används. Saknas pg_trgm i databasen (t.ex. lokalt utan
+    migrationerna) faller trigram tillbaka till substring, med en varning per process.
+    Fulltext kräver inget tillägg och rankar då bara på ts_rank_cd.
+    """
+    mode = mode or DEFAULT_SEARCH_MODE
+    if mode != "trigram":
+        return mode
+    return "trigram" if trigram_available(db) else "substring"
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from app.models import Category, Product
 from app.core.logging import get_logger
+from app.services.autocomplete import notify_rebuild
 
 logger = get_logger("seeder")
 
@@ -122,6 +123,7 @@ def seed_categories(db: Session):
     logger.info("🌱 Synkroniserar kategoriträd rekursivt...")
     seed_recursive(db, CATEGORY_DATA, None)
     db.commit()
+    notify_rebuild()
     logger.info("✅ Kategoristruktur klar.")
 
 def check_or_create(db: Session, name: str, slug: str, parent_id: int = None):
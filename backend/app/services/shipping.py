@@ -0,0 +1,113 @@
+import bisect
+from collections import namedtuple
+import numpy as np
+from app.core.logging import get_logger
+
+logger = get_logger("shipping")
+
+# Leveranssätt. En butik utan egen tabell för leveranssättet använder
+# base_shipping/free_shipping_limit (samma frakt för båda).
+DELIVERY_MODES = ("pickup", "home")
+DEFAULT_DELIVERY = "pickup"
+
+# Fraktregel för en butik och ett leveranssätt, i en form som går att skicka till andra processer.
+# prices[i] gäller från ordervärdet thresholds[i] (thresholds[0] är alltid 0) och sjunker aldrig
+# uppåt i trappan, annars håller inte lösarnas undre gränser. per_item läggs på per vara (styck).
+ShippingRule = namedtuple("ShippingRule", ["name", "thresholds", "prices", "per_item"])
+
+
+def flat_rule(name, base_shipping, free_shipping_limit):
+    """Den gamla modellen: base_shipping tills free_shipping_limit nås (0/None = ingen gräns)."""
+    base = float(base_shipping or 0.0)
+    if free_shipping_limit and base > 0:
+        return ShippingRule(name, (0.0, float(free_shipping_limit)), (base, 0.0), 0.0)
+    return ShippingRule(name, (0.0,), (base,), 0.0)
+
+
+def parse_rule(name, table):
+    """
+    Bygger en ShippingRule från en tabell i Store.shipping_rules:
+    {"tiers": [[från_ordervärde, frakt], ...], "per_item": kr}
+    Kastar ValueError om tabellen är ogiltig.
+    """
+    tiers = sorted((float(start), float(price)) for start, price in table.get("tiers") or [[0, 0]])
+    if tiers[0][0] != 0:
+        raise ValueError("första trappsteget måste börja på 0")
+    if any(price < 0 for _, price in tiers):
+        raise ValueError("negativ frakt")
+    if any(b[1] > a[1] for a, b in zip(tiers, tiers[1:])):
+        raise ValueError("frakten får inte öka med ordervärdet")
+    per_item = float(table.get("per_item") or 0.0)
+    if per_item < 0:
+        raise ValueError("negativt tillägg per vara")
+
+    # Steg utan prisändring tillför inget
+    merged = [tiers[0]]
+    for start, price in tiers[1:]:
+        if price < merged[-1][1]:
+            merged.append((start, price))
+    return ShippingRule(name, tuple(t[0] for t in merged), tuple(t[1] for t in merged), per_item)
+
+
+def shipping_rule(store, delivery=DEFAULT_DELIVERY):
+    """Regeln för en butik (Store eller redan kompilerad ShippingRule) och ett leveranssätt."""
+    if isinstance(store, ShippingRule):
+        return store
+    table = (getattr(store, "shipping_rules", None) or {}).get(delivery)
+    if table:
+        try:
+            return parse_rule(store.name, table)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"⚠️ Ogiltig frakttabell för {store.name} ({delivery}): {e}")
+    return flat_rule(store.name, store.base_shipping, store.free_shipping_limit)
+
+
+def compile_rules(store_lookup, delivery=DEFAULT_DELIVERY):
+    """{store_id: ShippingRule}. Billigt om värdena redan är ShippingRule."""
+    return {sid: shipping_rule(store, delivery) for sid, store in store_lookup.items()}
+
+
+def is_flat(rule):
+    """Högst ett prissteg ned till 0 kr, dvs en vanlig fri frakt-gräns (eller ingen)."""
+    return len(rule.prices) == 1 or (len(rule.prices) == 2 and rule.prices[1] == 0)
+
+
+def tier_price(rule, total):
+    """Frakten (utan tillägg per vara) vid ordervärdet total. 0 om butiken inte används."""
+    if total <= 0:
+        return 0.0
+    return rule.prices[bisect.bisect_right(rule.thresholds, total) - 1]
+
+
+def next_threshold(rule, total):
+    """Nästa ordervärde där frakten sjunker, eller None om den redan är som lägst."""
+    i = bisect.bisect_right(rule.thresholds, total)
+    return rule.thresholds[i] if i < len(rule.thresholds) else None
+
+
+class ShippingTable:
+    """
+    Fraktreglerna för flera butiker kompilerade till NumPy-matriser, så att frakten
+    för många butikssummor (t.ex. alla sluttillstånd i DP-motorn) räknas i ett anrop.
+
+    Trappstegen fylls ut till samma bredd med gränsen inf, som aldrig nås.
+    Tillägg per vara ingår inte; lösarna lägger dem på varornas pris.
+    """
+
+    def __init__(self, rules):
+        rules = list(rules)
+        width = max((len(rule.thresholds) for rule in rules), default=1)
+        self.thresholds = np.full((len(rules), width), np.inf)
+        self.prices = np.zeros((len(rules), width))
+        for s, rule in enumerate(rules):
+            n = len(rule.thresholds)
+            self.thresholds[s, :n] = rule.thresholds
+            self.prices[s, :n] = rule.prices
+            self.prices[s, n:] = rule.prices[-1]
+        self._stores = np.arange(len(rules))
+
+    def evaluate(self, totals):
+        """totals har formen (..., antal butiker). Returnerar frakten per butik, 0 för oanvända."""
+        totals = np.asarray(totals, dtype=float)
+        tier = (totals[..., None] >= self.thresholds).sum(axis=-1) - 1
+        return np.where(totals > 0, self.prices[self._stores, np.maximum(tier, 0)], 0.0)
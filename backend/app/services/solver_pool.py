@@ -0,0 +1,91 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.core.logging import get_logger
+
+logger = get_logger("solver_pool")
+
+# Per gunicorn-worker: så många lösarprocesser, plus så många jobb som får vänta i kö
+SOLVER_WORKERS = int(os.getenv("SOLVER_WORKERS", "2"))
+SOLVER_MAX_QUEUE = int(os.getenv("SOLVER_MAX_QUEUE", "8"))
+# Förslag till klienten (sekunder) när poolen är full
+SOLVER_RETRY_AFTER = 2
+# Lösarprocesserna startas med spawn, inte fork: servern kör trådar (scheduler,
+# autocomplete, mätvärden) och fork kopierar bara den anropande tråden, så ett lås
+# som en annan tråd höll just då förblir låst i barnprocessen
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+class SolverBusy(Exception):
+    """Alla lösarprocesser är upptagna och kön är full."""
+
+
+class SolverPool:
+    """
+    Begränsad processpool för CPU-tunga lösningar.
+
+    Jobb utöver workers + kö avvisas direkt med SolverBusy i stället för att
+    staplas på hög, så att en överbelastad worker kan svara 503 snabbt.
+    Platsen släpps när jobbet faktiskt är klart, inte när anroparen slutar vänta:
+    ett avbrutet anrop (t.ex. en klient som kopplat ner) vars jobb redan körs
+    håller sin plats tills processen är klar. Jobbets callback körs i executorns
+    tråd, därför skyddas räknaren av ett lås.
+    """
+
+    def __init__(self, max_workers=SOLVER_WORKERS, max_queue=SOLVER_MAX_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        # Skapas först vid behov, i den worker-process som använder den
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=MP_CONTEXT)
+        return self._executor
+
+    def shutdown(self):
+        """Stänger lösarprocesserna när servern stängs ner; jobb som inte hunnit starta avbryts."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def saturated(self):
+        return self.pending >= self.max_workers + self.max_queue
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.pending -= 1
+
+    def _restart(self):
+        # En lösarprocess dog (t.ex. OOM). Nästa anrop får en ny pool.
+        logger.error("❌ Lösarpoolen kraschade, startar om den")
+        self._executor = None
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                raise SolverBusy()
+            self.pending += 1
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException as e:
+            self._release()
+            if isinstance(e, BrokenProcessPool):
+                self._restart()
+            raise
+        # Även när anropet avbryts: wrap_future avbryter bara jobb som inte hunnit starta
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._restart()
+            raise
+
+solver_pool = SolverPool()
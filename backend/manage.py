@@ -1,4 +1,5 @@
 import click
+import json
 import os
 import sys
 import subprocess
@@ -22,6 +23,8 @@ try:
     from app.services.importer import import_csv_feed
     from app.services.dev_tools import generate_fake_data
     from app.services.categorizer import categorize_uncategorized_products
+    from app.services.benchmark import run_benchmark, run_search_benchmark, SHIPPING_PROFILES, SEARCH_QUERIES
+    from app.services.affiliate import rebuild_tracking_links, REBUILD_BATCH_SIZE
     from app.models import Product, ProductPrice, Store, Category # Behövs för att tabeller ska hittas
 except ImportError as e:
     logger.error("❌ Kritiskt fel: Kunde inte importera backend-moduler.")
@@ -227,5 +230,104 @@ def update_status():
     finally:
         db.close()
 
+@cli.command(name="rebuild-tracking-links")
+@click.option('--store', 'stores', multiple=True, help='Bara denna butik (namn, kan anges flera gånger)')
+@click.option('--batch-size', default=REBUILD_BATCH_SIZE, help='Rader per batch (en commit per batch)')
+def rebuild_tracking_links_cmd(stores, batch_size):
+    """🔗 Räknar om tracking-länkarna, t.ex. efter ändrade affiliate-uppgifter för en butik."""
+    db = get_db()
+    try:
+        store_ids = None
+        if stores:
+            found = dict(db.query(Store.name, Store.id).filter(Store.name.in_(stores)).all())
+            missing = [name for name in stores if name not in found]
+            if missing:
+                raise click.BadParameter(f"Okända butiker: {', '.join(missing)}", param_hint="--store")
+            store_ids = list(found.values())
+
+        updated = rebuild_tracking_links(db, store_ids, batch_size)
+        logger.info(f"✅ {updated} tracking-länkar uppdaterade.")
+    finally:
+        db.close()
+
+# --- 4. PRESTANDA ---
+def _int_list(ctx, param, value):
+    try:
+        return [int(v) for v in value.split(",") if v.strip()]
+    except ValueError:
+        raise click.BadParameter("Ange heltal separerade med komma, t.ex. 2,5,10")
+
+@cli.command()
+@click.option('--seed', default=42, help='Slumpfrö (samma frö ger samma kataloger och korgar)')
+@click.option('--sizes', default="2,5,10,20,50", callback=_int_list, help='Korgstorlekar (antal produkter)')
+@click.option('--offers', default="2,4,8", callback=_int_list, help='Erbjudanden per produkt')
+@click.option('--shipping', default="free,low,high", help=f'Fraktprofiler: {", ".join(SHIPPING_PROFILES)}')
+@click.option('--engines', default=None, help='Lösare, t.ex. auto,recursive,dp (standard: alla)')
+@click.option('--carts', default=10, help='Korgar per scenario')
+@click.option('--repeat', default=3, help='Antal varv per korg (för latensen)')
+@click.option('--time-budget-ms', default=None, type=int, help='Max lösningstid per korg')
+@click.option('--output', default="bench-optimizer.json", type=click.Path(), help='JSON-rapportens fil ("-" för stdout)')
+@click.option('--keep', is_flag=True, help='Behåll de syntetiska katalogerna efteråt')
+def bench_optimizer(seed, sizes, offers, shipping, engines, carts, repeat, time_budget_ms, output, keep):
+    """⏱️  Benchmark av optimeraren på syntetiska korgar (JSON-rapport)."""
+    if check_prod_environment():
+        click.confirm("Benchmarken skapar och tar bort testdata. Fortsätta i produktion?", abort=True)
+
+    profiles = [p.strip() for p in shipping.split(",") if p.strip()]
+    unknown = [p for p in profiles if p not in SHIPPING_PROFILES]
+    if unknown:
+        raise click.BadParameter(f"Okända fraktprofiler: {', '.join(unknown)}", param_hint="--shipping")
+
+    db = get_db()
+    try:
+        report = run_benchmark(
+            db, seed=seed, cart_sizes=sizes, offers=offers, shipping=profiles,
+            engines=engines.split(",") if engines else None, carts_per_scenario=carts,
+            repeat=repeat, time_budget_ms=time_budget_ms, keep=keep
+        )
+    finally:
+        db.close()
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if output == "-":
+        click.echo(payload)
+    else:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(payload)
+        logger.info(f"✅ Rapport sparad i {output} ({len(report['scenarios'])} scenarier)")
+
+@cli.command()
+@click.option('--products', default=1_000_000, help='Antal syntetiska produkter')
+@click.option('--queries', default=",".join(SEARCH_QUERIES), help='Sökfrågor separerade med komma')
+@click.option('--modes', default="trigram,substring", help='Söklägen att jämföra (trigram, fulltext, substring)')
+@click.option('--threshold', default=None, type=float, help='Tröskel för trigram (standard: SEARCH_TRGM_THRESHOLD)')
+@click.option('--repeat', default=5, help='Antal körningar per fråga (för latensen)')
+@click.option('--output', default="bench-search.json", type=click.Path(), help='JSON-rapportens fil ("-" för stdout)')
+@click.option('--keep', is_flag=True, help='Behåll den syntetiska katalogen efteråt')
+def bench_search(products, queries, modes, threshold, repeat, output, keep):
+    """🔎 Benchmark av sökningen på en syntetisk katalog, med EXPLAIN-planer (JSON-rapport)."""
+    if check_prod_environment():
+        click.confirm("Benchmarken skapar och tar bort testdata. Fortsätta i produktion?", abort=True)
+
+    options = {"threshold": threshold} if threshold is not None else {}
+    db = get_db()
+    try:
+        report = run_search_benchmark(
+            db, n_products=products, queries=[q.strip() for q in queries.split(",") if q.strip()],
+            modes=[m.strip() for m in modes.split(",") if m.strip()], repeat=repeat, keep=keep, **options
+        )
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    finally:
+        db.close()
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if output == "-":
+        click.echo(payload)
+    else:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(payload)
+        logger.info(f"✅ Rapport sparad i {output} ({len(report['queries'])} frågor)")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
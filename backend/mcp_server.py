@@ -5,8 +5,12 @@ import os
 if os.getenv("REDIS_URL") is None or "redis:6379" in os.getenv("REDIS_URL"):
     os.environ["REDIS_URL"] = "redis://localhost:6379/0"
 
-from typing import List, Dict, Any
-from app.services.optimizer import calculate_best_basket
+from typing import List, Dict, Any, Optional
+from app.services.optimizer import (
+    calculate_best_basket, calculate_best_baskets, MAX_BATCH_CARTS, MAX_ALTERNATIVES,
+    BasketConstraints, DEFAULT_PREFER_PENALTY
+)
+from app.services.shipping import DELIVERY_MODES
 from app.db.session import SessionLocal
 from app.models import Product
 from pydantic import BaseModel
@@ -19,14 +23,35 @@ class CartItem(BaseModel):
     quantity: int = 1
 
 @mcp.tool()
-def optimize_basket(items: List[Dict[str, int]]) -> List[Dict[str, Any]]:
+def optimize_basket(
+    items: List[Dict[str, int]],
+    time_budget_ms: Optional[int] = None,
+    k: int = 1,
+    max_stores: Optional[int] = None,
+    exclude_store_ids: Optional[List[int]] = None,
+    prefer_store_ids: Optional[List[int]] = None,
+    delivery: str = "pickup"
+) -> List[Dict[str, Any]]:
     """
     Optimera en varukorg för att hitta billigaste totalpris inklusive frakt.
     
     Args:
         items: En lista med objekt som har 'product_id' och 'quantity'.
                Exempel: [{"product_id": 1, "quantity": 2}, {"product_id": 5, "quantity": 1}]
+        time_budget_ms: Max lösningstid. Om tiden tar slut returneras bästa korgen hittills
+               med 'optimal': False och 'gap' (max antal kronor från optimum).
+        k: Antal alternativa korgar (1-5). Varje alternativ använder en annan butikskombination.
+        max_stores: Högst så många butiker (paket) i korgen.
+        exclude_store_ids: Butiker som aldrig får användas.
+        prefer_store_ids: Butiker att föredra. Övriga butiker används bara när de sparar
+               mer än 25 kr per butik.
+        delivery: "pickup" (ombud) eller "home" (hemleverans). Styr vilka frakttabeller som används.
     """
+    if not 1 <= k <= MAX_ALTERNATIVES:
+        raise ValueError(f"k måste vara mellan 1 och {MAX_ALTERNATIVES}")
+    if delivery not in DELIVERY_MODES:
+        raise ValueError(f"delivery måste vara något av {', '.join(DELIVERY_MODES)}")
+
     # Konvertera till objekt som liknar det SQLAlchemy förväntar sig (duck typing)
     class TempItem:
         def __init__(self, pid, qty):
@@ -37,11 +62,41 @@ def optimize_basket(items: List[Dict[str, int]]) -> List[Dict[str, Any]]:
     
     db = SessionLocal()
     try:
-        results = calculate_best_basket(cart_items, db)
+        constraints = BasketConstraints(
+            max_stores=max_stores,
+            exclude_store_ids=tuple(exclude_store_ids or ()),
+            prefer_store_ids=tuple(prefer_store_ids or ()),
+            prefer_penalty=DEFAULT_PREFER_PENALTY,
+            delivery=delivery
+        )
+        results = calculate_best_basket(cart_items, db, time_budget_ms=time_budget_ms, k=k, constraints=constraints)
         return results
     finally:
         db.close()
 
+@mcp.tool()
+def optimize_baskets_batch(carts: List[List[Dict[str, int]]], time_budget_ms: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Optimera många varukorgar på en gång, t.ex. för att hitta det billigaste paketet
+    bland flera kandidater. Mycket snabbare än att anropa optimize_basket per korg.
+
+    Args:
+        carts: En lista med korgar, varje korg i samma format som 'items' i optimize_basket.
+               Max 500 korgar per anrop.
+        time_budget_ms: Max lösningstid per korg.
+
+    Returns:
+        En resultatlista per korg, i samma ordning som 'carts'.
+    """
+    if len(carts) > MAX_BATCH_CARTS:
+        raise ValueError(f"Max {MAX_BATCH_CARTS} korgar per anrop")
+
+    db = SessionLocal()
+    try:
+        return calculate_best_baskets(carts, db, time_budget_ms=time_budget_ms)
+    finally:
+        db.close()
+
 @mcp.tool()
 def get_product_info(product_id: int) -> str:
     """Hämta information om en produkts namn och slug baserat på ID."""
@@ -1,4 +1,4 @@
-from app.models import Category
+from app.models import Category, Product, ProductPrice, Store
 
 def test_get_categories(client, db):
     # 1. Skapa kategoriträd
@@ -52,4 +52,56 @@ def test_category_parent_id(client, db):
     assert child_data["parent_id"] == parent.id
 
     parent_data = next(c for c in data if c["name"] == "Parent")
-    assert parent_data["parent_id"] is None
\ No newline at end of file
+    assert parent_data["parent_id"] is None
+
+def test_category_products_cursor_pagination(client, db):
+    parent = Category(name="Hem", slug="hem")
+    db.add(parent)
+    db.commit()
+    child = Category(name="Kök", slug="kok", parent_id=parent.id)
+    store = Store(name="Butik")
+    db.add_all([child, store])
+    db.commit()
+    products = []
+    for i in range(11):
+        p = Product(name=f"Sak {i % 3}", slug=f"sak-{i}", ean=f"sak-{i}", popularity_score=i % 2,
+                    category_id=parent.id if i % 2 else child.id)
+        db.add(p)
+        products.append(p)
+    db.commit()
+    for i, p in enumerate(products):
+        db.add(ProductPrice(product_id=p.id, store_id=store.id, price=100 - i % 4 * 10,
+                            regular_price=200 if i % 3 else None))
+    db.commit()
+
+    def walk(sort, **params):
+        ids, cursor, total = [], None, None
+        while True:
+            query = {"sort": sort, "limit": 3, **params, **({"cursor": cursor} if cursor else {})}
+            data = client.get("/api/v1/categories/hem", params=query).json()
+            ids += [p["id"] for p in data["products"]]
+            if cursor is None:
+                total = data["pagination"]["total"]
+            else:
+                # Ingen COUNT på följande sidor
+                assert data["pagination"]["total"] is None
+            cursor = data["pagination"]["next_cursor"]
+            if cursor is None:
+                return ids, total
+
+    ids, total = walk("popularity")
+    assert ids == [p.id for p in sorted(products, key=lambda p: (-p.popularity_score, p.name, p.id))]
+    assert total == 11
+
+    price = {p.id: 100 - i % 4 * 10 for i, p in enumerate(products)}
+    ids, _ = walk("price_asc")
+    assert ids == sorted(price, key=lambda pid: (price[pid], pid))
+
+    # Rabatt kräver ordinarie pris; prisfiltret gäller fortfarande
+    ids, total = walk("discount_desc", max_price=85)
+    expected = [p.id for i, p in enumerate(products) if i % 3 and price[p.id] <= 85]
+    assert ids == sorted(expected, key=lambda pid: (-(200 - price[pid]) / 200, -pid))
+    assert total == len(expected)
+
+    assert client.get("/api/v1/categories/hem?cursor=xyz").status_code == 400
+
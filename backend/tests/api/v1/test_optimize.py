@@ -1,3 +1,5 @@
+import json
+from unittest.mock import patch
 from app.models import Product, ProductPrice, Store
 
 def test_optimize_with_valid_cart(client, db):
@@ -63,3 +65,293 @@ def test_optimize_with_quantity(client, db):
     data = response.json()
     # 50 * 3 = 150 kr (ingen frakt)
     assert data[0]["total_cost"] == 150.0
+
+def test_optimize_with_time_budget(client, db):
+    """Testar att time_budget_ms accepteras och att svaret talar om ifall det är optimalt."""
+    store = Store(name="BudgetApiStore", base_shipping=0)
+    db.add(store)
+    db.commit()
+
+    prod = Product(name="BudgetApiProd", ean="budget-api1", slug="budget-api-prod")
+    db.add(prod)
+    db.commit()
+
+    db.add(ProductPrice(product_id=prod.id, store_id=store.id, price=80.0, url="http://url"))
+    db.commit()
+
+    response = client.post("/api/v1/optimize/", json={
+        "items": [{"product_id": prod.id, "quantity": 1}],
+        "time_budget_ms": 500
+    })
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data[0]["optimal"] is True
+    assert data[0]["gap"] == 0
+
+def test_optimize_with_invalid_time_budget(client, db):
+    """En budget på 0 ms eller mindre är ogiltig."""
+    response = client.post("/api/v1/optimize/", json={
+        "items": [{"product_id": 1, "quantity": 1}],
+        "time_budget_ms": 0
+    })
+    assert response.status_code == 422
+
+def test_optimize_returns_503_when_solver_is_saturated(client, db):
+    """Full lösarpool ska ge 503 med Retry-After i stället för att köa fler jobb."""
+    store = Store(name="BusyStore", base_shipping=0)
+    db.add(store)
+    db.commit()
+    prod = Product(name="BusyP", ean="busy1", slug="busy-p")
+    db.add(prod)
+    db.commit()
+    db.add(ProductPrice(product_id=prod.id, store_id=store.id, price=10.0, url="http://url"))
+    db.commit()
+    product_id = prod.id
+
+    with patch("app.services.optimizer.solver_pool.pending", 10 ** 6):
+        response = client.post("/api/v1/optimize/", json={
+            "items": [{"product_id": product_id, "quantity": 1}]
+        })
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+
+def test_optimize_batch_streams_ndjson(client, db):
+    """Batch-endpointen ska ge en NDJSON-rad per korg, med index till korgens position."""
+    store = Store(name="BatchStore", base_shipping=0)
+    db.add(store)
+    db.commit()
+    p1 = Product(name="BatchA", ean="batch1", slug="batch-a")
+    p2 = Product(name="BatchB", ean="batch2", slug="batch-b")
+    db.add_all([p1, p2])
+    db.commit()
+    db.add_all([
+        ProductPrice(product_id=p1.id, store_id=store.id, price=10.0, url="http://url"),
+        ProductPrice(product_id=p2.id, store_id=store.id, price=20.0, url="http://url"),
+    ])
+    db.commit()
+    a, b = p1.id, p2.id
+
+    response = client.post("/api/v1/optimize/batch", json={
+        "carts": [
+            [{"product_id": a, "quantity": 1}],
+            [{"product_id": a, "quantity": 1}, {"product_id": b, "quantity": 2}],
+            [{"product_id": 999999, "quantity": 1}],
+        ]
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = {line["index"]: line for line in map(json.loads, response.text.splitlines())}
+    assert sorted(lines) == [0, 1, 2]
+    assert lines[0]["results"][0]["total_cost"] == 10.0
+    assert lines[1]["results"][0]["total_cost"] == 50.0
+    assert lines[2]["results"] == []
+
+def test_optimize_batch_limits(client, db):
+    assert client.post("/api/v1/optimize/batch", json={"carts": []}).status_code == 422
+
+    with patch("app.services.optimizer.solver_pool.pending", 10 ** 6):
+        response = client.post("/api/v1/optimize/batch", json={"carts": [[{"product_id": 1, "quantity": 1}]]})
+    assert response.status_code == 503
+
+def test_cart_session_incremental_edits(client, db):
+    """En session ska lösa om korgen efter varje ändring och komma ihåg innehållet."""
+    cheap = Store(name="CartCheap", base_shipping=49, free_shipping_limit=100)
+    other = Store(name="CartOther", base_shipping=0)
+    db.add_all([cheap, other])
+    db.commit()
+    p1 = Product(name="CartA", ean="cart1", slug="cart-a")
+    p2 = Product(name="CartB", ean="cart2", slug="cart-b")
+    db.add_all([p1, p2])
+    db.commit()
+    db.add_all([
+        ProductPrice(product_id=p1.id, store_id=cheap.id, price=40.0, url="http://url"),
+        ProductPrice(product_id=p1.id, store_id=other.id, price=60.0, url="http://url"),
+        ProductPrice(product_id=p2.id, store_id=cheap.id, price=70.0, url="http://url"),
+    ])
+    db.commit()
+    a, b = p1.id, p2.id
+
+    created = client.post("/api/v1/optimize/cart", json={"items": [{"product_id": a, "quantity": 1}]})
+    assert created.status_code == 200
+    token = created.json()["token"]
+    # 40 + 49 frakt är dyrare än 60 utan frakt
+    assert created.json()["results"][0]["total_cost"] == 60.0
+
+    # Lägg till B: nu når CartCheap fri frakt (110 kr)
+    updated = client.patch(f"/api/v1/optimize/cart/{token}", json={"items": [{"product_id": b, "quantity": 1}]})
+    assert updated.status_code == 200
+    assert updated.json()["results"][0]["total_cost"] == 110.0
+    assert {i["product_id"] for i in updated.json()["items"]} == {a, b}
+
+    # Ta bort B igen
+    removed = client.patch(f"/api/v1/optimize/cart/{token}", json={"items": [{"product_id": b, "quantity": 0}]})
+    assert removed.json()["results"][0]["total_cost"] == 60.0
+    assert client.get(f"/api/v1/optimize/cart/{token}").json()["items"] == [{"product_id": a, "quantity": 1}]
+
+    assert client.delete(f"/api/v1/optimize/cart/{token}").status_code == 204
+    assert client.get(f"/api/v1/optimize/cart/{token}").status_code == 404
+
+def test_cart_session_keeps_constraints(client, db):
+    """Villkoren från skapandet ska gälla även när korgen ändras."""
+    cheap = Store(name="KeepCheap", base_shipping=49, free_shipping_limit=100)
+    other = Store(name="KeepOther", base_shipping=0)
+    db.add_all([cheap, other])
+    db.commit()
+    p1 = Product(name="KeepA", ean="keep1", slug="keep-a")
+    p2 = Product(name="KeepB", ean="keep2", slug="keep-b")
+    db.add_all([p1, p2])
+    db.commit()
+    db.add_all([
+        ProductPrice(product_id=p1.id, store_id=cheap.id, price=40.0, url="http://url"),
+        ProductPrice(product_id=p1.id, store_id=other.id, price=60.0, url="http://url"),
+        ProductPrice(product_id=p2.id, store_id=cheap.id, price=70.0, url="http://url"),
+    ])
+    db.commit()
+    a, b, excluded = p1.id, p2.id, other.id
+
+    created = client.post("/api/v1/optimize/cart", json={
+        "items": [{"product_id": a, "quantity": 1}], "exclude_store_ids": [excluded], "debug": True
+    })
+    token = created.json()["token"]
+    # Utan villkoret hade KeepOther (60 kr) vunnit
+    assert created.json()["results"][0]["total_cost"] == 89.0
+    assert "timings_ms" in created.json()["results"][0]["debug"]
+
+    client.patch(f"/api/v1/optimize/cart/{token}", json={"items": [{"product_id": b, "quantity": 1}]})
+    removed = client.patch(f"/api/v1/optimize/cart/{token}", json={"items": [{"product_id": b, "quantity": 0}]})
+    assert removed.json()["results"][0]["total_cost"] == 89.0
+    assert "debug" not in removed.json()["results"][0]
+
+def test_optimize_with_alternatives(client, db):
+    """k=3 ska ge vinnaren plus alternativ med andra butiker, billigast först."""
+    stores = [
+        Store(name="AltA", base_shipping=0),
+        Store(name="AltB", base_shipping=0),
+        Store(name="AltC", base_shipping=0),
+    ]
+    db.add_all(stores)
+    db.commit()
+    p1 = Product(name="AltP1", ean="alt1", slug="alt-p1")
+    p2 = Product(name="AltP2", ean="alt2", slug="alt-p2")
+    db.add_all([p1, p2])
+    db.commit()
+    db.add_all([
+        ProductPrice(product_id=p1.id, store_id=stores[0].id, price=10.0, url="http://url"),
+        ProductPrice(product_id=p1.id, store_id=stores[1].id, price=12.0, url="http://url"),
+        ProductPrice(product_id=p2.id, store_id=stores[1].id, price=20.0, url="http://url"),
+        ProductPrice(product_id=p2.id, store_id=stores[2].id, price=25.0, url="http://url"),
+    ])
+    db.commit()
+
+    response = client.post("/api/v1/optimize/", json={
+        "items": [{"product_id": p1.id, "quantity": 1}, {"product_id": p2.id, "quantity": 1}],
+        "k": 3
+    })
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [r["total_cost"] for r in data] == [30.0, 32.0, 35.0]
+    assert data[0]["type"] == "Smart Split (Billigast)"
+    assert data[1]["type"] == "Samlad leverans"
+    assert data[2]["type"] == "Alternativ"
+
+    assert client.post("/api/v1/optimize/", json={
+        "items": [{"product_id": p1.id, "quantity": 1}], "k": 99
+    }).status_code == 422
+
+def test_optimize_with_constraints(client, db):
+    """max_stores, exclude_store_ids och prefer_store_ids styr vilken korg som vinner."""
+    stores = [
+        Store(name="ConA", base_shipping=0),
+        Store(name="ConB", base_shipping=0),
+        Store(name="ConC", base_shipping=0),
+    ]
+    db.add_all(stores)
+    db.commit()
+    p1 = Product(name="ConP1", ean="con1", slug="con-p1")
+    p2 = Product(name="ConP2", ean="con2", slug="con-p2")
+    db.add_all([p1, p2])
+    db.commit()
+    db.add_all([
+        ProductPrice(product_id=p1.id, store_id=stores[0].id, price=10.0, url="http://url"),
+        ProductPrice(product_id=p1.id, store_id=stores[2].id, price=15.0, url="http://url"),
+        ProductPrice(product_id=p2.id, store_id=stores[1].id, price=10.0, url="http://url"),
+        ProductPrice(product_id=p2.id, store_id=stores[2].id, price=14.0, url="http://url"),
+    ])
+    db.commit()
+    items = [{"product_id": p1.id, "quantity": 1}, {"product_id": p2.id, "quantity": 1}]
+
+    def winner(**options):
+        response = client.post("/api/v1/optimize/", json={"items": items, **options})
+        assert response.status_code == 200
+        return response.json()[0]
+
+    assert sorted(winner()["stores"]) == ["ConA", "ConB"]
+    assert winner(max_stores=1)["stores"] == ["ConC"]
+    assert sorted(winner(exclude_store_ids=[stores[1].id])["stores"]) == ["ConA", "ConC"]
+    # Straffet (25 kr per annan butik) gör det värt 9 kr extra att bara handla i ConC
+    preferred = winner(prefer_store_ids=[stores[2].id])
+    assert preferred["stores"] == ["ConC"]
+    assert preferred["total_cost"] == 29.0
+
+    assert client.post("/api/v1/optimize/", json={"items": items, "max_stores": 0}).status_code == 422
+
+def test_optimize_with_delivery_tables(client, db):
+    """delivery väljer butikens frakttabell; frakten i svaret inkluderar tillägg per vara."""
+    store = Store(
+        name="TierStore", base_shipping=49, free_shipping_limit=None,
+        shipping_rules={
+            "pickup": {"tiers": [[0, 39], [100, 19], [300, 0]]},
+            "home": {"tiers": [[0, 89], [500, 0]], "per_item": 10},
+        }
+    )
+    db.add(store)
+    db.commit()
+    prod = Product(name="TierP", ean="tier1", slug="tier-p")
+    db.add(prod)
+    db.commit()
+    db.add(ProductPrice(product_id=prod.id, store_id=store.id, price=60.0, url="http://url"))
+    db.commit()
+    items = [{"product_id": prod.id, "quantity": 2}]
+
+    pickup = client.post("/api/v1/optimize/", json={"items": items}).json()[0]
+    home = client.post("/api/v1/optimize/", json={"items": items, "delivery": "home"}).json()[0]
+
+    assert pickup["details"][0]["shipping"] == 19.0
+    assert pickup["total_cost"] == 139.0
+    assert home["details"][0]["shipping"] == 89.0 + 2 * 10
+    assert home["total_cost"] == 229.0
+
+    assert client.post("/api/v1/optimize/", json={"items": items, "delivery": "drone"}).status_code == 422
+
+def test_optimize_debug_and_metrics(client, db):
+    """debug=true visar cachenivå och tider; /metrics räknar anropen per cachenivå."""
+    store = Store(name="DebugStore", base_shipping=29, free_shipping_limit=None)
+    db.add(store)
+    db.commit()
+    prod = Product(name="DebugP", ean="debug1", slug="debug-p")
+    db.add(prod)
+    db.commit()
+    db.add(ProductPrice(product_id=prod.id, store_id=store.id, price=100.0, url="http://url"))
+    db.commit()
+    payload = {"items": [{"product_id": prod.id, "quantity": 1}], "debug": True}
+
+    first = client.post("/api/v1/optimize/", json=payload).json()[0]
+    second = client.post("/api/v1/optimize/", json=payload).json()[0]
+    plain = client.post("/api/v1/optimize/", json={"items": payload["items"]}).json()[0]
+
+    assert first["debug"]["cache"] == "miss"
+    assert {"cache", "db", "solve", "format", "total"} <= set(first["debug"]["timings_ms"])
+    assert second["debug"]["cache"] in ("l1", "l2")
+    assert set(second["debug"]["timings_ms"]) == {"cache", "total"}
+    assert "debug" not in plain
+    assert "bound" in first["search"]["prunes"]
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'priskombo_optimize_requests_total{cache="miss"}' in response.text
+    assert 'priskombo_optimize_phase_seconds_bucket{le="+Inf",phase="solve"}' in response.text
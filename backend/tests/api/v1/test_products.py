@@ -1,3 +1,4 @@
+import json
 from app.models import Product, ProductPrice, Store, Category
 
 def test_get_products_list_structure(client, db):
@@ -134,4 +135,89 @@ def test_empty_products_list(client, db):
     assert response.status_code == 200
     data = response.json()
     assert data["total"] == 0
-    assert data["data"] == []
\ No newline at end of file
+    assert data["data"] == []
+
+def _paging_catalog(db):
+    """Produkter med lika popularitet, lika priser och utan pris, så att id måste bryta ordningen."""
+    store = Store(name="Pagestore")
+    cat = Category(name="Sidor", slug="sidor")
+    db.add_all([store, cat])
+    db.commit()
+    products = []
+    for i in range(23):
+        p = Product(
+            name=f"Produkt {i % 7}", ean=f"page-{i}", slug=f"page-{i}", category_id=cat.id,
+            popularity_score=i % 4, rating=None if i % 5 == 0 else float(i % 3)
+        )
+        db.add(p)
+        products.append(p)
+    db.commit()
+    for i, p in enumerate(products):
+        if i % 6 != 0:
+            db.add(ProductPrice(product_id=p.id, store_id=store.id, price=float(i % 5) * 10 + 5, url="u"))
+    db.commit()
+    return products
+
+def _walk(client, limit, **params):
+    """Följer next_cursor genom alla sidor: (id:n, antal sidor)."""
+    ids, pages, cursor = [], 0, None
+    while True:
+        query = {"limit": limit, **params, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/v1/products/", params=query).json()
+        pages += 1
+        ids += [p["id"] for p in page["data"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+def test_products_cursor_pagination_follows_sort(client, db):
+    products = _paging_catalog(db)
+    min_price = {p.id: min((pr.price for pr in p.prices), default=None) for p in products}
+    expected = {
+        "popularity": sorted(products, key=lambda p: (-p.popularity_score, p.name, p.id)),
+        "name_asc": sorted(products, key=lambda p: (p.name, p.id)),
+        "newest": sorted(products, key=lambda p: -p.id),
+        "rating_desc": sorted(products, key=lambda p: (p.rating if p.rating is not None else -1, p.id), reverse=True),
+        "price_asc": sorted(products, key=lambda p: (min_price[p.id] is None, min_price[p.id] or 0, p.id)),
+        "price_desc": sorted(products, key=lambda p: (min_price[p.id] is not None, min_price[p.id] or 0, p.id), reverse=True),
+    }
+
+    for sort, order in expected.items():
+        ids, pages = _walk(client, limit=5, sort=sort)
+        assert ids == [p.id for p in order], sort
+        assert pages == 5
+
+    # Utan sort: populärast först
+    assert _walk(client, limit=10)[0] == [p.id for p in expected["popularity"]]
+
+def test_products_rejects_bad_cursor_and_unbounded_limit(client, db):
+    _paging_catalog(db)
+    first = client.get("/api/v1/products/?sort=name_asc&limit=2").json()
+    cursor = first["next_cursor"]
+    assert first["total"] == 23
+
+    second = client.get(f"/api/v1/products/?sort=name_asc&cursor={cursor}")
+    assert second.status_code == 200
+    assert second.json()["total"] is None
+    # Cursorn hör till en annan sortering
+    assert client.get(f"/api/v1/products/?sort=newest&cursor={cursor}").status_code == 400
+    assert client.get("/api/v1/products/?cursor=inte-en-cursor").status_code == 400
+    assert client.get("/api/v1/products/?limit=-1").status_code == 422
+
+def test_products_export_streams_whole_catalog(client, db, monkeypatch):
+    products = _paging_catalog(db)
+    monkeypatch.setattr("app.api.v1.endpoints.products.EXPORT_BATCH_SIZE", 4)
+
+    response = client.get("/api/v1/products/export")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["id"] for r in rows] == sorted(p.id for p in products)
+    assert rows[1]["category"]["slug"] == "sidor"
+
+    # Ett id-fönster, som sitemapens delar använder
+    ids = sorted(p.id for p in products)
+    window = client.get("/api/v1/products/export", params={"after_id": ids[4], "until_id": ids[13]})
+    assert [json.loads(line)["id"] for line in window.text.splitlines()] == ids[5:14]
+
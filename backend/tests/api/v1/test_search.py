@@ -1,3 +1,5 @@
+import pytest
+from sqlalchemy import text, event
 from app.models import Product, ProductPrice, Store, Category
 
 def test_search_endpoint(client, db):
@@ -81,4 +83,134 @@ def test_search_suggestions(client, db):
     cat_names = [c["name"] for c in data_cat["categories"]]
     assert "Hörlurar" in cat_names
     # Kolla att parent info finns med
-    assert data_cat["categories"][0]["parent_name"] == "Elektronik"
\ No newline at end of file
+    assert data_cat["categories"][0]["parent_name"] == "Elektronik"
+
+def test_search_suggestions_uses_constant_number_of_queries(client, db, monkeypatch):
+    monkeypatch.setattr("app.services.search._trigram_available", False)
+    parent = Category(name="Ljud", slug="ljud")
+    db.add(parent)
+    db.commit()
+    stores = [Store(name="A"), Store(name="B"), Store(name="C")]
+    db.add_all(stores)
+    db.commit()
+
+    def add_products(n, offset=0):
+        for i in range(offset, offset + n):
+            category = Category(name=f"Sonyljud {i}", slug=f"sonyljud-{i}", parent_id=parent.id)
+            db.add(category)
+            db.commit()
+            product = Product(name=f"Sony Högtalare {i}", brand="Sony", slug=f"sony-{i}", category_id=category.id)
+            db.add(product)
+            db.commit()
+            for j, store in enumerate(stores):
+                db.add(ProductPrice(product_id=product.id, store_id=store.id, price=100 + i + j * 10))
+            db.commit()
+
+    def count_queries(q):
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.get_bind(), "before_cursor_execute", count)
+        try:
+            data = client.get(f"/api/v1/search/suggestions?q={q}").json()
+        finally:
+            event.remove(db.get_bind(), "before_cursor_execute", count)
+        return data, len(statements)
+
+    add_products(1)
+    data, few = count_queries("Sony")
+    assert data["products"][0]["min_price"] == 100
+    assert data["products"][0]["category_slug"] == "sonyljud-0"
+    assert data["categories"][0]["parent_slug"] == "ljud"
+
+    add_products(6, offset=1)
+    data, many = count_queries("Sony")
+    # En rad per produkt trots tre priser, och inga extra frågor per produkt eller kategori
+    assert len(data["products"]) == 5
+    assert len({p["id"] for p in data["products"]}) == 5
+    assert all(p["min_price"] == 100 + int(p["name"].split()[-1]) for p in data["products"])
+    assert len(data["categories"]) == 3
+    assert many == few == 3
+
+def _ranking_catalog(db):
+    store = Store(name="Apotea")
+    db.add(store)
+    db.commit()
+    products = [
+        Product(name="Nivea Schampo 250 ml", ean="t1", slug="nivea-schampo", popularity_score=5),
+        Product(name="Garnier Schampo 400 ml", ean="t2", slug="garnier-schampo", popularity_score=50),
+        Product(name="Dove Balsam", ean="t3", slug="dove-balsam"),
+    ]
+    db.add_all(products)
+    db.commit()
+    for p in products:
+        db.add(ProductPrice(product_id=p.id, store_id=store.id, price=49, url="url"))
+    db.commit()
+
+def test_search_trigram_ranks_and_tolerates_typos(client, db, monkeypatch):
+    if db.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is None:
+        pytest.skip("pg_trgm finns inte i testdatabasen")
+    db.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    db.commit()
+    monkeypatch.setattr("app.services.search._trigram_available", None)
+    _ranking_catalog(db)
+
+    # Stavfel hittas; lika bra träffar sorteras på popularitet
+    data = client.get("/api/v1/search?q=schampoo&mode=trigram").json()
+    assert [p["name"] for p in data] == ["Garnier Schampo 400 ml", "Nivea Schampo 250 ml"]
+    assert data[0]["score"] >= data[1]["score"] > 0
+
+    # Högre tröskel = färre träffar
+    assert client.get("/api/v1/search?q=schampoo&mode=trigram&threshold=0.99").json() == []
+
+def test_trigram_query_orders_by_indexable_distance():
+    """Sorteringen börjar med name <->> q, så att GiST-indexet kan göra en KNN-sökning med LIMIT."""
+    from sqlalchemy.dialects import postgresql
+    from app.services.search import trigram_query
+
+    sql = str(trigram_query("schampo", limit=10).compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    ))
+    order_by = sql.split("ORDER BY")[1]
+    assert order_by.strip().startswith("products.name <->> 'schampo'")
+    assert sql.rstrip().endswith("LIMIT 10")
+
+def test_search_trigram_falls_back_without_pg_trgm(client, db, monkeypatch):
+    monkeypatch.setattr("app.services.search._trigram_available", False)
+    _ranking_catalog(db)
+
+    data = client.get("/api/v1/search?q=Schampo&mode=trigram").json()
+
+    assert {p["name"] for p in data} == {"Garnier Schampo 400 ml", "Nivea Schampo 250 ml"}
+    assert all("score" not in p for p in data)
+    assert client.get("/api/v1/search?q=Schampo&mode=fuzzy").status_code == 422
+
+def test_search_fulltext_stems_swedish_and_ignores_word_order(client, db, monkeypatch):
+    monkeypatch.setattr("app.services.search._trigram_available", False)
+    category = Category(name="Hudvård", slug="hudvard")
+    db.add(category)
+    db.commit()
+    _ranking_catalog(db)
+    store = db.query(Store).first()
+    cream = Product(name="Kräm för torr hy", brand="Nivea", ean="t4", slug="nivea-kram", category_id=category.id)
+    db.add(cream)
+    db.commit()
+    db.add(ProductPrice(product_id=cream.id, store_id=store.id, price=89, url="url"))
+    db.commit()
+
+    # Böjningsformer matchar grundformen
+    data = client.get("/api/v1/search?q=schampoer&mode=fulltext").json()
+    assert [p["name"] for p in data] == ["Garnier Schampo 400 ml", "Nivea Schampo 250 ml"]
+    assert all(p["score"] > 0 for p in data)
+    assert [p["name"] for p in client.get("/api/v1/search?q=krämer&mode=fulltext").json()] == ["Kräm för torr hy"]
+
+    # Märke och namn i valfri ordning; alla ord måste finnas
+    names = [p["name"] for p in client.get("/api/v1/search?q=kräm nivea&mode=fulltext").json()]
+    assert names == ["Kräm för torr hy"]
+
+    # Kategorinamnet är sökbart och följer med när kategorin byter namn
+    assert [p["name"] for p in client.get("/api/v1/search?q=hudvård&mode=fulltext").json()] == ["Kräm för torr hy"]
+    category.name = "Ansiktsvård"
+    db.commit()
+    assert [p["name"] for p in client.get("/api/v1/search?q=ansiktsvård&mode=fulltext").json()] == ["Kräm för torr hy"]
+    assert client.get("/api/v1/search?q=hudvård&mode=fulltext").json() == []
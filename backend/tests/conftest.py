@@ -5,9 +5,13 @@ from fastapi.testclient import TestClient
 import os
 from dotenv import load_dotenv
 
+# Testerna bygger sitt eget autocomplete-index mot testdatabasen
+os.environ.setdefault("AUTOCOMPLETE_ENABLED", "false")
+
 from app.db.base import Base
 from app.db.session import get_db
 from app.main import app
+from app.services.basket_cache import redis_client
 
 # URL till testdatabasen (som vi skapade i docker-compose)
 # Obs: 'db' är hostnamnet för databas-containern i Docker
@@ -32,6 +36,18 @@ def setup_test_db():
     # (Valfritt) Städa bort tabeller efteråt
     Base.metadata.drop_all(bind=engine)
 
+@pytest.fixture(scope="session", autouse=True)
+def clear_redis_cache():
+    """
+    Tabellerna återskapas, så produkt-ID:n börjar om från 1. Cachade erbjudanden
+    och korgar från en tidigare körning skulle då gälla fel produkter.
+    """
+    if redis_client:
+        for pattern in ("product_offers:*", "product_version:*", "basket_optimization_*"):
+            for key in redis_client.scan_iter(pattern):
+                redis_client.delete(key)
+    yield
+
 @pytest.fixture(scope="function")
 def db():
     """
@@ -1,5 +1,5 @@
-from app.services.affiliate import generate_tracking_link
-from app.models import Store
+from app.services.affiliate import generate_tracking_link, rebuild_tracking_links
+from app.models import Product, ProductPrice, Store
 
 def test_generate_adtraction_link():
     # 1. Skapa en "Adtraction-butik"
@@ -43,4 +43,38 @@ def test_generate_default_link_if_no_network():
     result = generate_tracking_link(original_url, store)
     
     # 3. Ska vara oförändrad
-    assert result == original_url
\ No newline at end of file
+    assert result == original_url
+
+def test_rebuild_tracking_links_after_affiliate_change(db):
+    # 1. Två butiker med förberäknade länkar (utan nätverk = vanlig länk)
+    shop = Store(name="BytButik", affiliate_network=None)
+    other = Store(name="OrördButik", affiliate_network=None)
+    db.add_all([shop, other])
+    db.commit()
+    prices = []
+    for i in range(5):
+        prod = Product(name=f"Länk{i}", ean=f"rebuild{i}", slug=f"lank-{i}")
+        db.add(prod)
+        db.commit()
+        for store in (shop, other):
+            url = f"https://{store.id}.se/{i}"
+            prices.append(ProductPrice(product_id=prod.id, store_id=store.id, price=10.0, url=url, tracking_url=url))
+    db.add_all(prices)
+    db.commit()
+
+    # 2. Butiken går med i Adrecord
+    shop.affiliate_network = "adrecord"
+    shop.affiliate_program_id = "555"
+    db.commit()
+
+    # 3. Bara den butikens rader räknas om (i flera batchar), och bara en gång
+    assert rebuild_tracking_links(db, [shop.id], batch_size=2) == 5
+    assert rebuild_tracking_links(db, batch_size=2) == 0
+
+    db.expire_all()
+    for price in db.query(ProductPrice).all():
+        if price.store_id == shop.id:
+            assert price.tracking_url == generate_tracking_link(price.url, shop)
+            assert "p=555" in price.tracking_url
+        else:
+            assert price.tracking_url == price.url
@@ -0,0 +1,169 @@
+import json
+import time
+from app.models import Product, ProductPrice, Store, Category
+from app.services import autocomplete
+from app.services.autocomplete import AutocompleteIndex, search_keys, notify_products_changed, handle_message, AUTOCOMPLETE_CHANNEL
+from app.services.basket_cache import redis_client
+
+
+def _catalog(db):
+    parent = Category(name="Elektronik", slug="elektronik")
+    db.add(parent)
+    db.commit()
+    child = Category(name="Hörlurar", slug="horlurar", parent_id=parent.id)
+    store = Store(name="AcStore", base_shipping=0)
+    db.add_all([child, store])
+    db.commit()
+    products = [
+        Product(name="Sony WH-1000XM5", brand="Sony", slug="sony-xm5", category_id=child.id, popularity_score=10),
+        Product(name="Sony In-Ear", brand="Sony", slug="sony-inear", popularity_score=90),
+        Product(name="Samsung TV", brand="Samsung", slug="samsung-tv"),
+        Product(name="Sony Utan Pris", brand="Sony", slug="sony-utan-pris"),
+    ]
+    db.add_all(products)
+    db.commit()
+    db.add_all([
+        ProductPrice(product_id=products[0].id, store_id=store.id, price=3000),
+        ProductPrice(product_id=products[0].id, store_id=store.id, price=2800),
+        ProductPrice(product_id=products[1].id, store_id=store.id, price=1500),
+        ProductPrice(product_id=products[2].id, store_id=store.id, price=9000),
+    ])
+    db.commit()
+    return products, store
+
+
+def test_search_keys_start_at_every_word():
+    assert search_keys("Sony WH-1000XM5") == {"sony wh-1000xm5", "wh-1000xm5", "1000xm5"}
+
+
+def test_index_suggests_like_the_database(client, db, monkeypatch):
+    products, _ = _catalog(db)
+    from_db = client.get("/api/v1/search/suggestions?q=Son").json()
+
+    index = AutocompleteIndex()
+    index.build(db)
+    monkeypatch.setattr(autocomplete, "index", index)
+    data = client.get("/api/v1/search/suggestions?q=Son").json()
+
+    # Samma svar från indexet som från databasen
+    assert data == from_db
+    assert data["brands"] == ["Sony"]
+    # Bara produkter med pris, populärast först
+    assert [p["name"] for p in data["products"]] == ["Sony In-Ear", "Sony WH-1000XM5"]
+    xm5 = data["products"][1]
+    assert xm5["min_price"] == 2800 and xm5["category_slug"] == "horlurar"
+
+    # Mitt i namnet (ordbörjan) och kategorier med förälder
+    assert [p["name"] for p in index.suggest("wh-10")["products"]] == ["Sony WH-1000XM5"]
+    assert index.suggest("hör")["categories"][0]["parent_name"] == "Elektronik"
+
+
+def test_fallback_matches_word_starts_like_the_index(client, db, monkeypatch):
+    """Förslagen matchar från ordbörjan, oavsett om indexet är byggt eller inte."""
+    _catalog(db)
+    store = db.query(Store).first()
+    mid_word = Product(name="Parasony Kabel", brand="Kabelbolaget", slug="parasony", popularity_score=99)
+    db.add(mid_word)
+    db.commit()
+    db.add(ProductPrice(product_id=mid_word.id, store_id=store.id, price=99))
+    db.commit()
+
+    queries = ["son", "wh-10", "1000", "hör", "lur", "kabel", "50%"]
+    from_db = {q: client.get("/api/v1/search/suggestions", params={"q": q}).json() for q in queries}
+
+    index = AutocompleteIndex()
+    index.build(db)
+    monkeypatch.setattr(autocomplete, "index", index)
+    for q in queries:
+        assert client.get("/api/v1/search/suggestions", params={"q": q}).json() == from_db[q], q
+
+    # "son" finns mitt i "Parasony" men är inte en ordbörjan; "lur" likaså i "Hörlurar"
+    assert "Parasony Kabel" not in [p["name"] for p in from_db["son"]["products"]]
+    assert from_db["lur"]["categories"] == []
+    assert [p["name"] for p in from_db["1000"]["products"]] == ["Sony WH-1000XM5"]
+    assert [p["name"] for p in from_db["kabel"]["products"]] == ["Parasony Kabel"]
+
+
+def test_ranks_every_match_before_truncating(client, db, monkeypatch):
+    """Fler än 200 träffar: de populäraste vinner, även om de kommer sist i bokstavsordning."""
+    store = Store(name="Butik", base_shipping=0)
+    db.add(store)
+    db.commit()
+    products = [Product(name=f"Sony X{i}", brand="Sony", slug=f"sony-x{i}", popularity_score=i) for i in range(300)]
+    # Lika popularitet och namn som bara skiljer i skiftläge avgörs likadant i båda vägarna
+    products += [
+        Product(name="sony Xtra", brand="SONY", slug="sony-xtra-a", popularity_score=299),
+        Product(name="Sony xtra", brand="sony", slug="sony-xtra-b", popularity_score=299),
+    ]
+    categories = [Category(name=f"Sony {c}", slug=f"sony-{i}") for i, c in enumerate(("b", "A", "a", "C"))]
+    db.add_all(products + categories)
+    db.commit()
+    db.add_all([ProductPrice(product_id=p.id, store_id=store.id, price=100) for p in products])
+    db.commit()
+
+    from_db = client.get("/api/v1/search/suggestions", params={"q": "sony"}).json()
+    index = AutocompleteIndex()
+    index.build(db)
+    monkeypatch.setattr(autocomplete, "index", index)
+    from_index = client.get("/api/v1/search/suggestions", params={"q": "sony"}).json()
+
+    assert from_index == from_db
+    assert [p["name"] for p in from_db["products"]] == ["Sony X299", "sony Xtra", "Sony xtra", "Sony X298", "Sony X297"]
+    assert [c["name"] for c in from_db["categories"]] == ["Sony A", "Sony a", "Sony b"]
+    assert from_db["brands"] == ["SONY"]
+
+    # Samma svar när indexet går igenom produkterna i rankningsordning, även efter en ändring
+    monkeypatch.setattr(autocomplete, "RANKED_WALK_THRESHOLD", 0)
+    assert index.suggest("sony") == from_index
+    products[0].popularity_score = 1000
+    db.commit()
+    index.update_products(db, [products[0].id])
+    assert [p["name"] for p in index.suggest("sony")["products"]][:2] == ["Sony X0", "Sony X299"]
+
+
+def test_incremental_updates(db, monkeypatch):
+    products, store = _catalog(db)
+    index = AutocompleteIndex()
+    index.build(db)
+
+    # Nytt namn och pris, en produkt får pris och en förlorar alla sina
+    products[0].name = "Bose QC45"
+    db.add(ProductPrice(product_id=products[3].id, store_id=store.id, price=10))
+    db.query(ProductPrice).filter(ProductPrice.product_id == products[1].id).delete()
+    db.commit()
+    index.update_products(db, [products[0].id, products[1].id, products[3].id])
+
+    assert [p["name"] for p in index.suggest("son")["products"]] == ["Sony Utan Pris"]
+    assert [p["name"] for p in index.suggest("bose")["products"]] == ["Bose QC45"]
+
+    # Sammanslagningen tar bort nycklar som inte längre gäller
+    monkeypatch.setattr(autocomplete, "MAX_DELTA_KEYS", 0)
+    index.update_products(db, [products[2].id])
+    assert index._delta_keys == []
+    assert not any(key.startswith("sony wh") for key, _ in index._product_keys)
+    assert [p["name"] for p in index.suggest("bose")["products"]] == ["Bose QC45"]
+
+
+def test_changes_are_published_to_every_worker(db, monkeypatch):
+    products, store = _catalog(db)
+    index = AutocompleteIndex()
+    index.build(db)
+    monkeypatch.setattr(autocomplete, "index", index)
+
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(AUTOCOMPLETE_CHANNEL)
+    try:
+        db.add(ProductPrice(product_id=products[2].id, store_id=store.id, price=5))
+        db.commit()
+        notify_products_changed([products[2].id])
+
+        message = None
+        deadline = time.monotonic() + 2
+        while message is None and time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=0.1)
+        assert json.loads(message["data"]) == {"products": [products[2].id]}
+
+        handle_message(lambda: db, message["data"])
+        assert index.suggest("samsung")["products"][0]["min_price"] == 5
+    finally:
+        pubsub.close()
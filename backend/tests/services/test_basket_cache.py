@@ -0,0 +1,137 @@
+import asyncio
+import random
+import threading
+import time
+from app.services.basket_cache import BasketCache, SingleFlight, bump_product_versions, redis_client
+
+def _cart():
+    """Slumpade produkt-ID:n så att testerna inte krockar med annat i Redis."""
+    base = random.randint(10 ** 8, 10 ** 9)
+    return {base: 1, base + 1: 2}
+
+def test_l2_hit_is_promoted_to_l1():
+    cart = _cart()
+    writer = BasketCache()
+    key = writer.key_for(redis_client, cart)
+    writer.set(redis_client, key, [{"type": "Samlad leverans", "total_cost": 100.0}])
+
+    # En annan worker har tom L1 och hämtar från Redis första gången
+    reader = BasketCache()
+    assert reader.get(redis_client, key)[0]["total_cost"] == 100.0
+    assert reader.get(redis_client, key)[0]["total_cost"] == 100.0
+
+    stats = reader.stats()
+    assert stats["l2_hits"] == 1
+    assert stats["l1_hits"] == 1
+    assert stats["l1_hit_ratio"] == 0.5
+
+def test_version_bump_invalidates_only_affected_baskets():
+    cache = BasketCache()
+    affected, untouched = _cart(), _cart()
+    for cart in (affected, untouched):
+        cache.set(redis_client, cache.key_for(redis_client, cart), [{"total_cost": 1.0}])
+
+    bump_product_versions([next(iter(affected))])
+
+    assert cache.get(redis_client, cache.key_for(redis_client, affected)) is None
+    assert cache.get(redis_client, cache.key_for(redis_client, untouched)) == [{"total_cost": 1.0}]
+    assert cache.stats()["misses"] == 1
+
+def test_l1_is_bounded():
+    cache = BasketCache(max_entries=2)
+    for _ in range(3):
+        cart = _cart()
+        cache.set(redis_client, cache.key_for(redis_client, cart), [])
+
+    assert cache.stats()["l1_size"] == 2
+
+def test_without_redis_nothing_is_cached():
+    """Utan delade versionsräknare går det inte att invalidera, så ingen cache alls."""
+    cache = BasketCache()
+    key = cache.key_for(None, _cart())
+    cache.set(None, key, [{"total_cost": 1.0}])
+
+    assert key is None
+    assert cache.get(None, key) is None
+    assert cache.stats()["l1_size"] == 0
+
+def _run_concurrently(calls):
+    results = [None] * len(calls)
+    errors = [None] * len(calls)
+
+    def run(i):
+        try:
+            results[i] = calls[i]()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(calls))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+def test_single_flight_coalesces_in_process():
+    flight = SingleFlight()
+    computed = []
+
+    def compute():
+        computed.append(1)
+        time.sleep(0.2)
+        return [{"total_cost": 42.0}]
+
+    results, _ = _run_concurrently([lambda: flight.do(None, "cart", compute)] * 5)
+
+    assert len(computed) == 1
+    assert all(r == [{"total_cost": 42.0}] for r in results)
+    assert flight.counts["coalesced_local"] == 4
+
+def test_single_flight_propagates_leader_error():
+    flight = SingleFlight()
+
+    def compute():
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    _, errors = _run_concurrently([lambda: flight.do(None, "cart", compute)] * 3)
+
+    assert all(isinstance(e, ValueError) for e in errors)
+
+def test_single_flight_coalesces_across_workers():
+    """Två instanser motsvarar två gunicorn-workers som delar Redis."""
+    worker_a, worker_b = SingleFlight(), SingleFlight()
+    key = f"test-{random.randint(0, 10 ** 9)}"
+    computed = []
+
+    def compute():
+        computed.append(1)
+        time.sleep(0.3)
+        return [{"total_cost": 7.0}]
+
+    def follower():
+        time.sleep(0.05)  # Låt ledaren ta låset först
+        return worker_b.do(redis_client, key, compute)
+
+    results, _ = _run_concurrently([lambda: worker_a.do(redis_client, key, compute), follower])
+
+    assert len(computed) == 1
+    assert results == [[{"total_cost": 7.0}], [{"total_cost": 7.0}]]
+    assert worker_b.counts["coalesced_remote"] == 1
+
+def test_single_flight_async_coalesces_in_process():
+    flight = SingleFlight()
+    computed = []
+
+    async def compute():
+        computed.append(1)
+        await asyncio.sleep(0.1)
+        return [{"total_cost": 3.0}]
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async(None, "cart", compute) for _ in range(4)))
+
+    results = asyncio.run(main())
+
+    assert len(computed) == 1
+    assert results == [[{"total_cost": 3.0}]] * 4
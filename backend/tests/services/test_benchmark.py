@@ -0,0 +1,49 @@
+from app.models import Category, Product, Store
+from app.services import optimizer
+from app.services.benchmark import run_benchmark, run_search_benchmark, make_carts, _percentile
+
+
+def test_percentile_interpolates():
+    assert _percentile([1, 2, 3, 4], 50) == 2.5
+    assert _percentile([5], 95) == 5
+    assert _percentile(list(range(101)), 95) == 95
+
+
+def test_make_carts_is_reproducible():
+    product_ids = list(range(1, 40))
+    assert make_carts(product_ids, 5, 3, seed=7) == make_carts(product_ids, 5, 3, seed=7)
+    assert all(len(cart) == 5 for cart in make_carts(product_ids, 5, 3, seed=7))
+
+
+def test_run_benchmark_reports_every_engine_and_cleans_up(db):
+    db.add(Category(name="Bänk", slug="bank"))
+    db.commit()
+    client_before = optimizer.redis_client
+
+    report = run_benchmark(
+        db, seed=1, cart_sizes=(3,), offers=(2,), shipping=("low",), carts_per_scenario=2, repeat=1
+    )
+
+    engines = {s["engine"] for s in report["scenarios"]}
+    assert engines == {"auto", *optimizer.SOLVER_ENGINES}
+    for scenario in report["scenarios"]:
+        assert scenario["nodes"]["p50"] >= 1
+        assert scenario["latency_ms"]["p95"] >= scenario["latency_ms"]["p50"] > 0
+        assert scenario["peak_memory_kb"] > 0
+        assert scenario["optimal_ratio"] == 1.0
+
+    # Katalogen tas bort och Redis slås på igen
+    assert db.query(Product).count() == 0
+    assert db.query(Store).count() == 0
+    assert optimizer.redis_client is client_before
+
+
+def test_run_search_benchmark_explains_and_cleans_up(db):
+    report = run_search_benchmark(db, n_products=500, queries=["schampo", "xyzzy"], modes=("substring",), repeat=1)
+
+    by_query = {entry["query"]: entry for entry in report["queries"]}
+    assert by_query["schampo"]["hits"] > 0
+    assert by_query["xyzzy"]["hits"] == 0
+    assert by_query["schampo"]["plan"]["Node Type"] == "Limit"
+    assert isinstance(by_query["schampo"]["indexes"], list)
+    assert db.query(Product).count() == 0
@@ -1,4 +1,5 @@
 import os
+from unittest.mock import patch
 from app.services.importer import import_csv_feed
 from app.models import Product, ProductPrice, Store
 
@@ -31,7 +32,28 @@ def test_import_csv_feed_integration(db):
         price = db.query(ProductPrice).filter_by(product_id=p1.id).first()
         assert price.price == 99.50
         assert price.store_id == store.id
+        # Utan affiliate-nätverk är länken den vanliga
+        assert price.tracking_url == "http://link.se"
 
     finally:
         if os.path.exists(TEST_FILENAME):
-            os.remove(TEST_FILENAME)
\ No newline at end of file
+            os.remove(TEST_FILENAME)
+def test_import_bumps_versions_for_changed_prices(db):
+    """Importen ska bara ogiltigförklara cachade korgar för produkter vars pris ändrats."""
+    with open(TEST_FILENAME, "w", encoding="utf-8") as f:
+        f.write(TEST_CSV_CONTENT)
+
+    try:
+        with patch("app.services.importer.bump_product_versions") as mock_bump:
+            import_csv_feed(TEST_FILENAME, "TestStore", db)
+            ids = {p.id for p in db.query(Product).filter(Product.ean.in_(["731001", "731002"]))}
+            mock_bump.assert_called_once_with(ids)
+
+            # Samma fil igen: inga priser ändras
+            mock_bump.reset_mock()
+            import_csv_feed(TEST_FILENAME, "TestStore", db)
+            mock_bump.assert_called_once_with(set())
+
+    finally:
+        if os.path.exists(TEST_FILENAME):
+            os.remove(TEST_FILENAME)
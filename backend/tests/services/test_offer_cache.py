@@ -0,0 +1,55 @@
+from app.models import Product, ProductPrice, Store
+from app.services.basket_cache import bump_product_versions, redis_client
+from app.services.offer_cache import load_product_offers, refresh_product_offers
+
+def _product_with_price(db, price):
+    store = Store(name="OfferStore", base_shipping=0)
+    prod = Product(name="OfferP", ean="offer1", slug="offer-p")
+    db.add_all([store, prod])
+    db.commit()
+    row = ProductPrice(product_id=prod.id, store_id=store.id, price=price, url="http://offer.se")
+    db.add(row)
+    db.commit()
+    return prod, store, row
+
+def test_offers_are_served_from_cache(db):
+    prod, store, row = _product_with_price(db, 100.0)
+
+    first = load_product_offers(db, [prod.id], redis_client)
+    assert first[prod.id]["offers"] == [[store.id, 100.0, "http://offer.se", None]]
+    assert first[prod.id]["slug"] == "offer-p"
+
+    # Ändring utan import: cachen svarar fortfarande med det gamla priset
+    row.price = 80.0
+    db.commit()
+    assert load_product_offers(db, [prod.id], redis_client)[prod.id]["offers"][0][1] == 100.0
+
+def test_import_write_through_updates_cached_offers(db):
+    prod, _, row = _product_with_price(db, 100.0)
+    load_product_offers(db, [prod.id], redis_client)
+
+    row.price = 80.0
+    db.commit()
+    bump_product_versions([prod.id])
+    refresh_product_offers(db, [prod.id])
+
+    assert load_product_offers(db, [prod.id], redis_client)[prod.id]["offers"][0][1] == 80.0
+
+def test_stale_version_is_refetched(db):
+    """En post från före en versionsökning används inte, även om write-through uteblev."""
+    prod, _, row = _product_with_price(db, 100.0)
+    load_product_offers(db, [prod.id], redis_client)
+
+    row.price = 70.0
+    db.commit()
+    bump_product_versions([prod.id])
+
+    assert load_product_offers(db, [prod.id], redis_client)[prod.id]["offers"][0][1] == 70.0
+
+def test_products_without_offers_and_without_redis(db):
+    prod, store, _ = _product_with_price(db, 50.0)
+
+    entries = load_product_offers(db, [prod.id, 999999], None)
+
+    assert entries[prod.id]["offers"] == [[store.id, 50.0, "http://offer.se", None]]
+    assert entries[999999]["offers"] == []
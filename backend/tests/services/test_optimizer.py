@@ -1,10 +1,23 @@
+import itertools
+import random
+import time
+import pytest
 from app.models import Product, ProductPrice, Store
-from app.services.optimizer import calculate_best_basket
+from app.services.optimizer import (
+    calculate_best_basket, calculate_shipping, solve_recursive, BasketProblem, SearchState, build_bounds,
+    run_recursive_engine, run_dp_engine, choose_engine, assignment_cost, eliminate_dominated,
+    split_components, solve_components, calculate_best_baskets, best_single_store,
+    solve_basket, BasketConstraints, store_penalties
+)
+from app.services.shipping import parse_rule
+from app.services.affiliate import generate_tracking_link
 from unittest.mock import patch
+from sqlalchemy import event
 
 # Vi patchar bort redis_client så att vi alltid testar logiken, inte cachen
-@patch("app.services.optimizer.redis_client", None) 
-def test_single_store_cheapest(db):
+@pytest.mark.parametrize("engine", ["recursive", "dp"])
+@patch("app.services.optimizer.redis_client", None)
+def test_single_store_cheapest(db, engine):
     """Testar att algoritmen väljer billigaste butiken när allt finns där."""
     
     # 1. Setup Data
@@ -25,7 +38,7 @@ def test_single_store_cheapest(db):
 
     # 2. Kör algoritmen
     cart_items = [{"product_id": prod.id, "quantity": 1}]
-    results = calculate_best_basket(cart_items, db)
+    results = calculate_best_basket(cart_items, db, engine=engine)
     
     # 3. Verifiera
     best = results[0] # Listan är sorterad billigast först
@@ -33,8 +46,9 @@ def test_single_store_cheapest(db):
     assert best["stores"][0] == "Apotea"
     assert best["total_cost"] == 149.0 # 100 + 49 frakt
 
+@pytest.mark.parametrize("engine", ["recursive", "dp"])
 @patch("app.services.optimizer.redis_client", None)
-def test_smart_split(db):
+def test_smart_split(db, engine):
     """Testar att algoritmen delar upp köpet om det lönar sig."""
     s1 = Store(name="Store A", base_shipping=50)
     s2 = Store(name="Store B", base_shipping=50)
@@ -59,7 +73,7 @@ def test_smart_split(db):
         {"product_id": p1.id, "quantity": 1},
         {"product_id": p2.id, "quantity": 1}
     ]
-    results = calculate_best_basket(cart_items, db)
+    results = calculate_best_basket(cart_items, db, engine=engine)
     
     best = results[0]
     
@@ -69,8 +83,9 @@ def test_smart_split(db):
     assert len(best["stores"]) == 2
     assert best["type"] == "Smart Split (Billigast)"
 
+@pytest.mark.parametrize("engine", ["recursive", "dp"])
 @patch("app.services.optimizer.redis_client", None)
-def test_quantity_calculation(db):
+def test_quantity_calculation(db, engine):
     """Testar att priset multipliceras korrekt med antal."""
     store = Store(name="BulkStore", base_shipping=0, free_shipping_limit=0)
     db.add(store)
@@ -88,15 +103,16 @@ def test_quantity_calculation(db):
     quantity = 5
     cart_items = [{"product_id": prod.id, "quantity": quantity}]
     
-    results = calculate_best_basket(cart_items, db)
+    results = calculate_best_basket(cart_items, db, engine=engine)
     best = results[0]
 
     expected_cost = price * quantity # 500.0
     assert best["details"][0]["products_cost"] == expected_cost
     assert best["total_cost"] == expected_cost
 
+@pytest.mark.parametrize("engine", ["recursive", "dp"])
 @patch("app.services.optimizer.redis_client", None)
-def test_smart_split_suppressed_if_single_store(db):
+def test_smart_split_suppressed_if_single_store(db, engine):
     """
     Om den rekursiva lösaren hittar att bästa priset är i en och samma butik,
     ska den returnera det som 'Samlad leverans', inte 'Smart Split'.
@@ -123,7 +139,7 @@ def test_smart_split_suppressed_if_single_store(db):
         {"product_id": p1.id, "quantity": 1},
         {"product_id": p2.id, "quantity": 1}
     ]
-    results = calculate_best_basket(cart_items, db)
+    results = calculate_best_basket(cart_items, db, engine=engine)
     
     best_option = results[0]
     
@@ -133,8 +149,9 @@ def test_smart_split_suppressed_if_single_store(db):
     # Eftersom vinnaren är "Samlad leverans" ska ingen fallback läggas till, så len==1
     assert len(results) == 1
 
+@pytest.mark.parametrize("engine", ["recursive", "dp"])
 @patch("app.services.optimizer.redis_client", None)
-def test_fallback_to_single_store(db):
+def test_fallback_to_single_store(db, engine):
     """
     NYTT TEST: Om vinnaren är en 'Smart Split', ska vi ändå få 
     ett alternativ #2 som är 'Samlad leverans' (om möjligt).
@@ -187,7 +204,7 @@ def test_fallback_to_single_store(db):
         {"product_id": p1.id, "quantity": 1},
         {"product_id": p2.id, "quantity": 1}
     ]
-    results = calculate_best_basket(cart_items, db)
+    results = calculate_best_basket(cart_items, db, engine=engine)
 
     # Vi förväntar oss TVÅ resultat
     assert len(results) == 2
@@ -201,8 +218,9 @@ def test_fallback_to_single_store(db):
     assert results[1]["stores"][0] == "HarAllt"
     assert results[1]["total_cost"] == 410.0
 
+@pytest.mark.parametrize("engine", ["recursive", "dp"])
 @patch("app.services.optimizer.redis_client", None)
-def test_complex_shipping_threshold(db):
+def test_complex_shipping_threshold(db, engine):
     """
     NYTT TEST: Verifierar att algoritmen klarar av 'Fri frakt'-trösklar.
     Här är det billigare att köpa en DYRARE vara för att få fri frakt.
@@ -245,7 +263,7 @@ def test_complex_shipping_threshold(db):
         {"product_id": p1.id, "quantity": 1},
         {"product_id": p2.id, "quantity": 1}
     ]
-    results = calculate_best_basket(cart_items, db)
+    results = calculate_best_basket(cart_items, db, engine=engine)
     
     best = results[0]
     
@@ -281,4 +299,555 @@ def test_optimizer_returns_tracking_links(db):
     offer_url = results[0]["details"][0]["products"][0].get("url")
     
     assert "at.track.adtr.co" in offer_url
-    assert "112233" in offer_url
\ No newline at end of file
+    assert "112233" in offer_url
+
+@patch("app.services.optimizer.redis_client", None)
+def test_tracking_links_only_for_returned_offers(db):
+    """Länkar skapas bara för erbjudandena i svaret, inte för alla som söks igenom."""
+    stores = [Store(name=f"LinkStore{i}", base_shipping=0, affiliate_network="adrecord", affiliate_program_id=str(i)) for i in range(6)]
+    db.add_all(stores)
+    db.commit()
+    cart = []
+    for n in range(4):
+        prod = Product(name=f"LinkP{n}", ean=f"link{n}", slug=f"link-p{n}")
+        db.add(prod)
+        db.commit()
+        for i, store in enumerate(stores):
+            db.add(ProductPrice(product_id=prod.id, store_id=store.id, price=100.0 + i + n, url=f"https://butik.se/{n}"))
+        cart.append({"product_id": prod.id, "quantity": 1})
+    db.commit()
+
+    with patch("app.services.optimizer.generate_tracking_link", wraps=generate_tracking_link) as link:
+        results = calculate_best_basket(cart, db)
+
+    shown = [p for r in results for d in r["details"] for p in d["products"]]
+    assert link.call_count == len(shown) == 4
+    assert all("click.adrecord.com" in p["url"] for p in shown)
+
+def _brute_force_cost(products_list, store_lookup, quantity_map):
+    """Referens: testar ALLA kombinationer och returnerar lägsta totalkostnad."""
+    best = float('inf')
+    for combo in itertools.product(*[offers for _, offers in products_list]):
+        totals = {}
+        for offer in combo:
+            sid = offer['store_id']
+            totals[sid] = totals.get(sid, 0.0) + offer['price'] * quantity_map[offer['product_id']]
+        cost = sum(totals.values()) + sum(calculate_shipping(store_lookup[sid], t) for sid, t in totals.items())
+        best = min(best, cost)
+    return best
+
+def _synthetic_problem(seed, n_products, n_stores, price_range=(20, 400), spread=0.2):
+    """Bygger ett problem i minnet (utan databas) med slumpade priser och fraktregler."""
+    rng = random.Random(seed)
+    store_lookup = {}
+    for sid in range(1, n_stores + 1):
+        store_lookup[sid] = Store(
+            id=sid,
+            name=f"S{sid}",
+            base_shipping=rng.choice([0, 29, 39, 49, 59]),
+            free_shipping_limit=rng.choice([None, 0, 199, 299, 499])
+        )
+
+    products_list = []
+    quantity_map = {}
+    for pid in range(1, n_products + 1):
+        quantity_map[pid] = rng.randint(1, 3)
+        base = rng.randint(*price_range)
+        offers = [
+            {"product_id": pid, "store_id": sid, "price": float(round(base * rng.uniform(1 - spread, 1 + spread)))}
+            for sid in rng.sample(sorted(store_lookup), k=rng.randint(1, n_stores))
+        ]
+        products_list.append((pid, offers))
+    return products_list, store_lookup, quantity_map
+
+def test_lower_bound_pruning_keeps_optimum():
+    """Den undre gränsen får aldrig beskära bort den optimala lösningen."""
+    total_pruned = 0
+    for seed in range(10):
+        products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products=5, n_stores=4)
+        problem = BasketProblem(products_list, store_lookup, quantity_map)
+        state = SearchState(problem)
+        solve_recursive(problem, 0, 0.0, state)
+
+        assert state.best_cost == pytest.approx(_brute_force_cost(products_list, store_lookup, quantity_map))
+        total_pruned += state.pruned
+
+    assert total_pruned > 0
+
+@patch("app.services.optimizer.redis_client", None)
+def test_optimizer_returns_search_stats(db):
+    """Vinnaren ska innehålla antal besökta noder från sökningen."""
+    store = Store(name="StatsStore", base_shipping=0)
+    db.add(store)
+    db.commit()
+
+    prod = Product(name="StatsP", ean="stats1", slug="stats-p")
+    db.add(prod)
+    db.commit()
+
+    db.add(ProductPrice(product_id=prod.id, store_id=store.id, price=10.0, url=""))
+    db.commit()
+
+    results = calculate_best_basket([{"product_id": prod.id, "quantity": 1}], db)
+
+    assert results[0]["search"]["nodes"] >= 1
+    assert "pruned" in results[0]["search"]
+    assert "memo_hits" in results[0]["search"]
+    assert results[0]["search"]["offers_before"] == 1
+
+def test_dp_engine_matches_brute_force():
+    """DP-motorn ska vara exakt, precis som den rekursiva."""
+    for seed in range(20):
+        products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products=5, n_stores=4)
+        solution = run_dp_engine(products_list, store_lookup, quantity_map)
+
+        assert solution['cost'] == pytest.approx(_brute_force_cost(products_list, store_lookup, quantity_map))
+        assert assignment_cost(solution['assignments'], store_lookup, quantity_map) == pytest.approx(solution['cost'])
+
+def test_choose_engine_by_cart_size():
+    small, _, _ = _synthetic_problem(1, n_products=2, n_stores=3)
+    large, _, _ = _synthetic_problem(1, n_products=30, n_stores=8)
+
+    assert choose_engine(small) == "recursive"
+    assert choose_engine(large) == "dp"
+
+@pytest.mark.parametrize("engine", [run_recursive_engine, run_dp_engine])
+def test_expired_time_budget_returns_best_so_far(engine):
+    """Är tiden redan slut ska vi få heuristikens korg, optimal=False och en giltig undre gräns."""
+    products_list, store_lookup, quantity_map = _synthetic_problem(3, n_products=8, n_stores=5)
+    exact = run_recursive_engine(products_list, store_lookup, quantity_map)
+
+    solution = engine(products_list, store_lookup, quantity_map, deadline=time.perf_counter())
+
+    assert solution['optimal'] is False
+    assert len(solution['assignments']) == len(products_list)
+    assert assignment_cost(solution['assignments'], store_lookup, quantity_map) == pytest.approx(solution['cost'])
+    assert solution['lower_bound'] <= exact['cost'] + 1e-9 <= solution['cost'] + 1e-9
+
+@patch("app.services.optimizer.redis_client", None)
+def test_generous_time_budget_is_optimal(db):
+    store = Store(name="BudgetStore", base_shipping=29)
+    db.add(store)
+    db.commit()
+
+    prod = Product(name="BudgetP", ean="budget1", slug="budget-p")
+    db.add(prod)
+    db.commit()
+
+    db.add(ProductPrice(product_id=prod.id, store_id=store.id, price=100.0, url=""))
+    db.commit()
+
+    results = calculate_best_basket([{"product_id": prod.id, "quantity": 1}], db, time_budget_ms=5000)
+
+    assert results[0]["optimal"] is True
+    assert results[0]["gap"] == 0
+    assert results[0]["total_cost"] == 129.0
+
+def _dict_search(product_idx, products_list, store_totals, cost_so_far, best, store_lookup, quantity_map, bounds):
+    """
+    Referens för benchmarken: sökningen som den såg ut före BasketProblem, med offer-dicts,
+    en dict med butikssummor och sortering av erbjudandena i varje nod.
+    """
+    best['nodes'] += 1
+    if product_idx == len(products_list):
+        total = cost_so_far + sum(calculate_shipping(store_lookup[sid], t) for sid, t in store_totals.items() if t > 0)
+        best['cost'] = min(best['cost'], total)
+        return
+
+    bound = cost_so_far + bounds['suffix_min'][product_idx]
+    reach = bounds['store_reach'][product_idx]
+    for sid, total in store_totals.items():
+        if total > 0:
+            bound += calculate_shipping(store_lookup[sid], total + reach.get(sid, 0.0))
+    if bound >= best['cost']:
+        return
+
+    pid, offers = products_list[product_idx]
+    qty = quantity_map[pid]
+    for offer in sorted(offers, key=lambda o: (o['price'], -(store_totals.get(o['store_id'], 0) > 0))):
+        sid = offer['store_id']
+        old_total = store_totals.get(sid, 0.0)
+        store_totals[sid] = old_total + offer['price'] * qty
+        _dict_search(product_idx + 1, products_list, store_totals, cost_so_far + offer['price'] * qty,
+                     best, store_lookup, quantity_map, bounds)
+        store_totals[sid] = old_total
+
+def test_compiled_search_matches_dict_search():
+    """Den kompilerade sökningen på BasketProblem ska hitta samma optimum som den dict-baserade."""
+    for seed in range(5):
+        products_list, store_lookup, quantity_map = _synthetic_problem(
+            seed, 8, n_stores=6, price_range=(30, 150), spread=0.05
+        )
+        products_list.sort(key=lambda x: len(x[1]))
+
+        best = {'cost': float('inf'), 'nodes': 0}
+        _dict_search(0, products_list, {}, 0.0, best, store_lookup, quantity_map, build_bounds(products_list, quantity_map))
+
+        problem = BasketProblem(products_list, store_lookup, quantity_map)
+        state = SearchState(problem)
+        solve_recursive(problem, 0, 0.0, state)
+
+        assert state.best_cost == pytest.approx(best['cost'])
+
+@pytest.mark.benchmark
+def test_compiled_search_node_throughput():
+    """
+    Mikrobenchmark (körs bara med -m benchmark): noder per sekund för den dict-baserade
+    sökningen och den kompilerade sökningen på BasketProblem, med samma undre gräns.
+    Kör med -s för att se siffrorna.
+    """
+    products_list, store_lookup, quantity_map = _synthetic_problem(
+        1, 10, n_stores=8, price_range=(30, 150), spread=0.05
+    )
+    products_list.sort(key=lambda x: len(x[1]))
+
+    best = {'cost': float('inf'), 'nodes': 0}
+    start = time.perf_counter()
+    _dict_search(0, products_list, {}, 0.0, best, store_lookup, quantity_map, build_bounds(products_list, quantity_map))
+    before = best['nodes'] / (time.perf_counter() - start)
+
+    problem = BasketProblem(products_list, store_lookup, quantity_map)
+    state = SearchState(problem)
+    start = time.perf_counter()
+    solve_recursive(problem, 0, 0.0, state)
+    after = state.nodes / (time.perf_counter() - start)
+
+    print(f"\nnoder/s dict: {before:,.0f} ({best['nodes']} noder), kompilerad: {after:,.0f} ({state.nodes} noder)")
+    assert state.best_cost == pytest.approx(best['cost'])
+    assert after > before
+
+def test_eliminate_dominated_preserves_optimum():
+    """Förbehandlingen får krympa sökrymden men aldrig ändra det optimala priset."""
+    shrunk = 0
+    for seed in range(40):
+        products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products=5, n_stores=5)
+        reduced, stats = eliminate_dominated(products_list, store_lookup, quantity_map)
+
+        assert all(offers for _, offers in reduced)
+        assert _brute_force_cost(reduced, store_lookup, quantity_map) == pytest.approx(
+            _brute_force_cost(products_list, store_lookup, quantity_map)
+        )
+        shrunk += stats["offers_before"] - stats["offers_after"]
+
+    assert shrunk > 0
+
+def test_eliminate_dominated_collapses_store():
+    """En butik som säljer samma saker dyrare och med sämre frakt tas bort helt."""
+    good = Store(id=1, name="Bra", base_shipping=29, free_shipping_limit=199)
+    worse = Store(id=2, name="Sämre", base_shipping=49, free_shipping_limit=499)
+    other = Store(id=3, name="Annan", base_shipping=0)
+    store_lookup = {1: good, 2: worse, 3: other}
+    quantity_map = {1: 1, 2: 1}
+    products_list = [
+        (1, [
+            {"product_id": 1, "store_id": 1, "price": 100.0},
+            {"product_id": 1, "store_id": 2, "price": 100.0},
+            {"product_id": 1, "store_id": 3, "price": 105.0},
+        ]),
+        (2, [
+            {"product_id": 2, "store_id": 1, "price": 50.0},
+            {"product_id": 2, "store_id": 2, "price": 55.0},
+        ]),
+    ]
+
+    reduced, stats = eliminate_dominated(products_list, store_lookup, quantity_map)
+
+    assert stats["stores_removed"] == 1
+    assert all(o["store_id"] != 2 for _, offers in reduced for o in offers)
+    assert stats["search_space_after"] < stats["search_space_before"]
+
+def _disjoint_problem():
+    """Två produktgrupper som inte delar någon butik (t.ex. apotek + elektronik)."""
+    first, first_stores, first_qty = _synthetic_problem(1, n_products=4, n_stores=3)
+    second, second_stores, second_qty = _synthetic_problem(2, n_products=4, n_stores=3)
+
+    # Flytta andra gruppen till egna produkt- och butiks-id:n
+    offset = 100
+    second = [
+        (pid + offset, [dict(o, product_id=pid + offset, store_id=o['store_id'] + offset) for o in offers])
+        for pid, offers in second
+    ]
+    store_lookup = dict(first_stores)
+    store_lookup.update({sid + offset: store for sid, store in second_stores.items()})
+    quantity_map = dict(first_qty)
+    quantity_map.update({pid + offset: qty for pid, qty in second_qty.items()})
+    return first + second, store_lookup, quantity_map
+
+def test_split_components_separates_disjoint_stores():
+    products_list, _, _ = _disjoint_problem()
+
+    components = split_components(products_list)
+
+    assert len(components) == 2
+    assert sorted(len(c) for c in components) == [4, 4]
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_solve_components_matches_whole_problem(parallel):
+    """Att lösa komponenterna var för sig (även i egna processer) ger samma pris som helheten."""
+    products_list, store_lookup, quantity_map = _disjoint_problem()
+    whole = run_recursive_engine(products_list, store_lookup, quantity_map)
+
+    min_work = 0 if parallel else 10 ** 9
+    with patch("app.services.optimizer.PARALLEL_COMPONENT_MIN_WORK", min_work):
+        merged = solve_components(products_list, store_lookup, quantity_map)
+
+    assert merged['components'] == 2
+    assert merged['optimal'] is True
+    assert merged['cost'] == pytest.approx(whole['cost'])
+    assert assignment_cost(merged['assignments'], store_lookup, quantity_map) == pytest.approx(whole['cost'])
+
+def test_state_key_buckets_totals_by_free_shipping_limit():
+    """Summor över gränsen, och butiker som inte längre kan nå den, ger samma nyckel."""
+    store_lookup = {
+        1: Store(id=1, name="A", base_shipping=49, free_shipping_limit=300),
+        2: Store(id=2, name="B", base_shipping=0, free_shipping_limit=None),
+    }
+    products_list = [
+        (1, [{"product_id": 1, "store_id": 1, "price": 200.0}, {"product_id": 1, "store_id": 2, "price": 190.0}]),
+        (2, [{"product_id": 2, "store_id": 1, "price": 50.0}, {"product_id": 2, "store_id": 2, "price": 45.0}]),
+    ]
+    problem = BasketProblem(products_list, store_lookup, {1: 1, 2: 1})
+    a, b = problem.store_index[1], problem.store_index[2]
+
+    def key(total_a, total_b):
+        totals = [0.0, 0.0]
+        totals[a], totals[b] = total_a, total_b
+        return problem.state_key(1, totals)
+
+    # Fri frakt uppnådd: exakt summa spelar ingen roll
+    assert key(350.0, 0.0) == key(420.0, 0.0)
+    # 200 + 50 < 300: frakten är avgjord oavsett resten
+    assert key(200.0, 0.0) == key(120.0, 0.0)
+    # 260 + 50 kan fortfarande nå gränsen och måste särskiljas
+    assert key(260.0, 0.0) != key(200.0, 0.0)
+    # Butik utan grundfrakt ingår inte i nyckeln
+    assert key(200.0, 0.0) == key(200.0, 190.0)
+
+def test_memo_preserves_optimum():
+    """Transpositionstabellen får inte ändra svaret, och ska träffa när priser är lika."""
+    hits = 0
+    for seed in range(10):
+        products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products=6, n_stores=4, spread=0.0)
+        problem = BasketProblem(products_list, store_lookup, quantity_map)
+        plain = SearchState(problem, memo_size=0)
+        solve_recursive(problem, 0, 0.0, plain)
+        memoized = SearchState(problem)
+        solve_recursive(problem, 0, 0.0, memoized)
+
+        expected = _brute_force_cost(products_list, store_lookup, quantity_map)
+        assert plain.best_cost == pytest.approx(expected)
+        assert memoized.best_cost == pytest.approx(expected)
+        assert assignment_cost(
+            problem.assignments_for(memoized.best_choices), store_lookup, quantity_map
+        ) == pytest.approx(expected)
+        hits += memoized.memo_hits
+
+    assert hits > 0
+
+def test_memo_is_bounded():
+    """Tabellen slänger äldst använda delproblem när den blir full."""
+    products_list, store_lookup, quantity_map = _synthetic_problem(3, n_products=8, n_stores=4, spread=0.0)
+    problem = BasketProblem(products_list, store_lookup, quantity_map)
+    state = SearchState(problem, memo_size=5)
+    solve_recursive(problem, 0, 0.0, state)
+
+    assert state.memo_misses > 5
+    assert len(state.memo) <= 5
+    assert state.best_cost == pytest.approx(_brute_force_cost(products_list, store_lookup, quantity_map))
+
+@patch("app.services.optimizer.redis_client", None)
+def test_batch_matches_single_carts_with_one_offer_query(db):
+    """Batchen ska ge samma svar som enskilda anrop men bara fråga efter priser en gång."""
+    stores = [Store(name=f"BatchS{i}", base_shipping=39, free_shipping_limit=200) for i in range(3)]
+    products = [Product(name=f"BatchP{i}", ean=f"batchp{i}", slug=f"batch-p{i}") for i in range(4)]
+    db.add_all(stores + products)
+    db.commit()
+    for i, prod in enumerate(products):
+        for j, store in enumerate(stores):
+            db.add(ProductPrice(product_id=prod.id, store_id=store.id, price=50.0 + 10 * ((i + j) % 3), url=""))
+    db.commit()
+
+    ids = [p.id for p in products]
+    carts = [
+        [{"product_id": ids[0], "quantity": 1}, {"product_id": ids[1], "quantity": 2}],
+        [{"product_id": ids[2], "quantity": 1}],
+        [{"product_id": pid, "quantity": 1} for pid in ids],
+        [],
+    ]
+    expected = [calculate_best_basket(cart, db) for cart in carts]
+
+    statements = []
+    def count(conn, cursor, statement, *args):
+        if "product_prices" in statement:
+            statements.append(statement)
+
+    event.listen(db.get_bind(), "before_cursor_execute", count)
+    try:
+        results = calculate_best_baskets(carts, db)
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", count)
+
+    assert len(statements) == 1
+    assert [r[0]["total_cost"] if r else None for r in results] == [r[0]["total_cost"] if r else None for r in expected]
+
+def test_warm_start_hint_keeps_optimum():
+    """Förra optimum som varmstart får inte ändra svaret efter en ändring av korgen."""
+    for seed in range(8):
+        products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products=6, n_stores=4)
+        before = run_recursive_engine(products_list, store_lookup, quantity_map)
+        hint = {o['product_id']: o['store_id'] for o in before['assignments']}
+
+        quantity_map[products_list[0][0]] += 1
+        expected = _brute_force_cost(products_list, store_lookup, quantity_map)
+        for engine in (run_recursive_engine, run_dp_engine):
+            warm = engine(products_list, store_lookup, quantity_map, hint=hint)
+            assert warm['cost'] == pytest.approx(expected)
+
+def _brute_force_by_store_set(products_list, store_lookup, quantity_map):
+    """Referens: lägsta kostnad för varje uppsättning använda butiker."""
+    best = {}
+    for combo in itertools.product(*[offers for _, offers in products_list]):
+        totals = {}
+        for offer in combo:
+            sid = offer['store_id']
+            totals[sid] = totals.get(sid, 0.0) + offer['price'] * quantity_map[offer['product_id']]
+        cost = sum(totals.values()) + sum(calculate_shipping(store_lookup[sid], t) for sid, t in totals.items())
+        stores = frozenset(totals)
+        best[stores] = min(best.get(stores, float('inf')), cost)
+    return best
+
+def test_top_k_alternatives_match_brute_force():
+    """Med k > 1 ska sökningen ge de k billigaste korgarna med olika butiksuppsättningar."""
+    for seed in range(8):
+        products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products=5, n_stores=4)
+        by_store_set = _brute_force_by_store_set(products_list, store_lookup, quantity_map)
+        expected = sorted(by_store_set.values())[:3]
+
+        solution = run_recursive_engine(products_list, store_lookup, quantity_map, k=3)
+        found = [solution['cost']] + [
+            assignment_cost(alt, store_lookup, quantity_map) for alt in solution['alternatives']
+        ]
+
+        assert found == pytest.approx(expected)
+        store_sets = [frozenset(o['store_id'] for o in solution['assignments'])] + [
+            frozenset(o['store_id'] for o in alt) for alt in solution['alternatives']
+        ]
+        assert len(set(store_sets)) == len(store_sets)
+
+def test_best_single_store_uses_store_index():
+    products_list, store_lookup, quantity_map = _synthetic_problem(4, n_products=5, n_stores=4, spread=0.1)
+    # Lägg till en butik som har allt, så att det finns minst ett alternativ
+    store_lookup[99] = Store(id=99, name="Allt", base_shipping=49, free_shipping_limit=None)
+    for pid, offers in products_list:
+        offers.append({"product_id": pid, "store_id": 99, "price": 500.0})
+
+    by_store_set = _brute_force_by_store_set(products_list, store_lookup, quantity_map)
+    expected = min(cost for stores, cost in by_store_set.items() if len(stores) == 1)
+
+    items = best_single_store(dict(products_list), store_lookup, quantity_map)
+
+    assert len({o['store_id'] for o in items}) == 1
+    assert assignment_cost(items, store_lookup, quantity_map) == pytest.approx(expected)
+
+def _brute_force_constrained(products_list, store_lookup, quantity_map, constraints):
+    """Referens: lägsta målvärde (kostnad + straff) bland korgar som uppfyller villkoren."""
+    penalties = store_penalties(constraints, store_lookup)
+    best = float('inf')
+    for combo in itertools.product(*[offers for _, offers in products_list]):
+        totals = {}
+        for offer in combo:
+            sid = offer['store_id']
+            totals[sid] = totals.get(sid, 0.0) + offer['price'] * quantity_map[offer['product_id']]
+        if set(totals) & set(constraints.exclude_store_ids):
+            continue
+        if constraints.max_stores and len(totals) > constraints.max_stores:
+            continue
+        cost = sum(totals.values()) + sum(
+            calculate_shipping(store_lookup[sid], t) + penalties.get(sid, 0.0) for sid, t in totals.items()
+        )
+        best = min(best, cost)
+    return best
+
+@pytest.mark.parametrize("constraints", [
+    BasketConstraints(max_stores=1),
+    BasketConstraints(max_stores=2),
+    BasketConstraints(prefer_store_ids=(1, 2), prefer_penalty=30.0),
+    BasketConstraints(max_stores=2, prefer_store_ids=(3,), prefer_penalty=15.0),
+])
+def test_constraints_enforced_in_search(constraints):
+    """Villkoren ska ge samma optimum som en uttömmande sökning över de tillåtna korgarna."""
+    for seed in range(10):
+        products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products=6, n_stores=4)
+        expected = _brute_force_constrained(products_list, store_lookup, quantity_map, constraints)
+
+        solution = run_recursive_engine(products_list, store_lookup, quantity_map, constraints=constraints)
+
+        assert solution['cost'] == pytest.approx(expected)
+        if expected == float('inf'):
+            assert solution['assignments'] == []
+        else:
+            used = {o['store_id'] for o in solution['assignments']}
+            assert len(used) <= (constraints.max_stores or len(store_lookup))
+
+def test_solve_basket_excludes_stores_and_limits_packages():
+    for seed in range(6):
+        products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products=5, n_stores=4)
+        for pid, offers in products_list:
+            for o in offers:
+                o.update(product_name=f"P{pid}", product_slug=f"p{pid}", url="")
+        constraints = BasketConstraints(max_stores=2, exclude_store_ids=(1,))
+        allowed = [(pid, [o for o in offers if o['store_id'] != 1]) for pid, offers in products_list]
+        allowed = [(pid, offers) for pid, offers in allowed if offers]
+        expected = _brute_force_constrained(allowed, store_lookup, quantity_map, constraints)
+
+        results, optimal = solve_basket(dict(products_list), store_lookup, quantity_map, constraints=constraints)
+
+        assert optimal
+        if expected == float('inf'):
+            assert results == []
+            continue
+        winner = results[0]
+        assert 1 not in {d['store_id'] for d in winner['details']}
+        assert len(winner['details']) <= 2
+        assert winner['total_cost'] == pytest.approx(expected)
+        for result in results:
+            assert 1 not in {d['store_id'] for d in result['details']}
+
+def _tiered_problem(seed, n_products, n_stores):
+    """Som _synthetic_problem, men med frakttrappor och tillägg per vara för hälften av butikerna."""
+    products_list, store_lookup, quantity_map = _synthetic_problem(seed, n_products, n_stores)
+    rng = random.Random(seed)
+    rules = {}
+    for sid, store in store_lookup.items():
+        if rng.random() < 0.5:
+            rules[sid] = parse_rule(store.name, {
+                "tiers": [[0, 79], [rng.choice([150, 250]), rng.choice([49, 39])], [rng.choice([400, 600]), 0]],
+                "per_item": rng.choice([0, 5, 15])
+            })
+        else:
+            rules[sid] = store
+    return products_list, rules, quantity_map
+
+@pytest.mark.parametrize("engine", [run_recursive_engine, run_dp_engine])
+def test_tiered_shipping_matches_brute_force(engine):
+    """Frakttrappor och tillägg per vara ska ge exakt optimum i båda motorerna."""
+    for seed in range(12):
+        products_list, store_lookup, quantity_map = _tiered_problem(seed, n_products=5, n_stores=4)
+        expected = min(
+            assignment_cost(list(combo), store_lookup, quantity_map)
+            for combo in itertools.product(*[offers for _, offers in products_list])
+        )
+
+        solution = engine(products_list, store_lookup, quantity_map)
+
+        assert solution['cost'] == pytest.approx(expected)
+        assert assignment_cost(solution['assignments'], store_lookup, quantity_map) == pytest.approx(expected)
+
+def test_eliminate_dominated_preserves_tiered_optimum():
+    for seed in range(12):
+        products_list, store_lookup, quantity_map = _tiered_problem(seed, n_products=5, n_stores=4)
+        reduced, _ = eliminate_dominated(products_list, store_lookup, quantity_map)
+
+        assert run_recursive_engine(reduced, store_lookup, quantity_map)['cost'] == pytest.approx(
+            run_recursive_engine(products_list, store_lookup, quantity_map)['cost']
+        )
@@ -0,0 +1,71 @@
+import random
+import pytest
+from app.models import Store
+from app.services.shipping import (
+    ShippingTable, parse_rule, flat_rule, shipping_rule, tier_price, next_threshold
+)
+
+
+def _legacy_shipping(base_shipping, free_shipping_limit, total):
+    """Den gamla platta modellen, som referens."""
+    if total <= 0:
+        return 0.0
+    if free_shipping_limit and total >= free_shipping_limit:
+        return 0.0
+    return base_shipping
+
+
+@pytest.mark.parametrize("base, limit", [(49, 499), (49, None), (0, 299), (29, 0)])
+def test_flat_rule_matches_legacy_model(base, limit):
+    rule = flat_rule("S", base, limit)
+    for total in [0, 0.5, 100, 298.99, 299, 498, 499, 500, 10_000]:
+        assert tier_price(rule, total) == _legacy_shipping(base, limit, total)
+
+
+def test_parse_rule_sorts_merges_and_validates():
+    rule = parse_rule("S", {"tiers": [[599, 0], [0, 49], [299, 29], [399, 29]], "per_item": 5})
+
+    assert rule.thresholds == (0.0, 299.0, 599.0)
+    assert rule.prices == (49.0, 29.0, 0.0)
+    assert rule.per_item == 5.0
+    assert next_threshold(rule, 100) == 299.0
+    assert next_threshold(rule, 700) is None
+
+    with pytest.raises(ValueError):
+        parse_rule("S", {"tiers": [[100, 49]]})
+    with pytest.raises(ValueError):
+        parse_rule("S", {"tiers": [[0, 29], [300, 49]]})
+
+
+def test_shipping_rule_picks_delivery_table_and_falls_back():
+    store = Store(
+        name="Tiered", base_shipping=39, free_shipping_limit=499,
+        shipping_rules={
+            "home": {"tiers": [[0, 79], [999, 0]], "per_item": 10},
+            "pickup": {"tiers": [[0, 49], [100, 99]]},  # Ogiltig: frakten ökar
+        }
+    )
+
+    home = shipping_rule(store, "home")
+    assert home.prices == (79.0, 0.0) and home.per_item == 10.0
+    # Ogiltig tabell -> de vanliga kolumnerna
+    assert shipping_rule(store, "pickup") == flat_rule("Tiered", 39, 499)
+    assert shipping_rule(Store(name="Flat", base_shipping=19), "home") == flat_rule("Flat", 19, None)
+
+
+def test_shipping_table_matches_scalar_evaluation():
+    rng = random.Random(7)
+    rules = [
+        flat_rule("A", 49, 499),
+        flat_rule("B", 0, None),
+        parse_rule("C", {"tiers": [[0, 89], [200, 59], [500, 19], [900, 0]]}),
+        parse_rule("D", {"tiers": [[0, 25]], "per_item": 3}),
+    ]
+    table = ShippingTable(rules)
+    totals = [[rng.choice([0, rng.uniform(0, 1200), 200, 499, 900]) for _ in rules] for _ in range(200)]
+
+    shipping = table.evaluate(totals)
+
+    assert shipping.shape == (200, len(rules))
+    for row, expected_row in zip(shipping, totals):
+        assert list(row) == pytest.approx([tier_price(rule, t) for rule, t in zip(rules, expected_row)])
@@ -0,0 +1,55 @@
+import asyncio
+import time
+from app.services.solver_pool import SolverPool, SolverBusy
+
+
+def test_cancelled_call_keeps_slot_until_job_finishes():
+    pool = SolverPool(max_workers=1, max_queue=0)
+
+    async def main():
+        # Starta processen först, så att jobbet nedan säkert hinner börja köras
+        await pool.run(time.sleep, 0)
+        assert pool.pending == 0
+
+        task = asyncio.create_task(pool.run(time.sleep, 1.0))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        # Klienten har gett upp, men jobbet körs fortfarande i poolen
+        assert task.cancelled()
+        assert pool.pending == 1 and pool.saturated()
+        try:
+            await pool.run(time.sleep, 0)
+            assert False, "poolen borde vara full"
+        except SolverBusy:
+            pass
+
+        deadline = time.monotonic() + 5
+        while pool.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        assert pool.pending == 0
+        assert await pool.run(time.sleep, 0) is None
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool._executor.shutdown()
+
+
+def test_shutdown_stops_processes_and_pool_restarts():
+    pool = SolverPool(max_workers=1, max_queue=0)
+    asyncio.run(pool.run(time.sleep, 0))
+    executor = pool._executor
+    processes = list(executor._processes.values())
+    assert executor._mp_context.get_start_method() == "spawn"
+
+    pool.shutdown()
+    assert pool._executor is None
+    assert processes and not any(p.is_alive() for p in processes)
+
+    # En ny pool skapas vid nästa anrop
+    try:
+        assert asyncio.run(pool.run(time.sleep, 0)) is None
+    finally:
+        pool.shutdown()
@@ -0,0 +1,46 @@
+from app.core.metrics import MetricsRegistry
+from app.services.basket_cache import redis_client
+
+
+def _registry(key=None):
+    registry = MetricsRegistry(key=key) if key else MetricsRegistry()
+    registry.counter("jobs_total", "Jobb")
+    registry.histogram("job_seconds", "Tid per jobb", buckets=(0.1, 1.0))
+    return registry
+
+
+def test_render_counters_and_cumulative_buckets():
+    registry = _registry()
+    registry.inc("jobs_total", kind="a")
+    registry.inc("jobs_total", 2, kind="a")
+    for value in (0.05, 0.5, 3.0):
+        registry.observe("job_seconds", value)
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE jobs_total counter" in lines
+    assert 'jobs_total{kind="a"} 3' in lines
+    assert "# TYPE job_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith("job_seconds_bucket")]
+    assert buckets == [
+        'job_seconds_bucket{le="0.1"} 1',
+        'job_seconds_bucket{le="1.0"} 2',
+        'job_seconds_bucket{le="+Inf"} 3',
+    ]
+    assert "job_seconds_count 3" in lines
+    assert "job_seconds_sum 3.55" in lines
+
+
+def test_workers_are_summed_via_redis():
+    """Två registries (som två workers) som delar Redis-hash visar samma summa."""
+    key = "metrics:test"
+    redis_client.delete(key)
+    try:
+        worker_a, worker_b = _registry(key), _registry(key)
+        worker_a.inc("jobs_total", kind="a")
+        worker_b.inc("jobs_total", 4, kind="a")
+        worker_b.flush(redis_client)
+
+        assert 'jobs_total{kind="a"} 5' in worker_a.render(redis_client).splitlines()
+    finally:
+        redis_client.delete(key)
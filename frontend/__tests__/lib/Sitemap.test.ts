@@ -1,4 +1,8 @@
-import sitemap from '@/app/sitemap';
+/**
+ * @jest-environment node
+ */
+import sitemap, { generateSitemaps, PRODUCTS_PER_SITEMAP } from '@/app/sitemap';
+import robots from '@/app/robots';
 
 // 1. MOCKA CONFIG-MODULEN
 jest.mock('@/lib/config', () => ({
@@ -8,37 +12,63 @@ jest.mock('@/lib/config', () => ({
 }));
 
 // 2. MOCKA FETCH
+const LATEST_ID = PRODUCTS_PER_SITEMAP + 10;
+
 // @ts-ignore
 global.fetch = jest.fn((url: string) => {
     const urlString = url.toString();
 
     if (urlString.includes('/categories')) {
-        return Promise.resolve({
-            ok: true,
-            json: () => Promise.resolve([{ slug: 'test-kategori', updated_at: '2024-01-01' }]),
-        });
+        return Promise.resolve(Response.json([{ slug: 'test-kategori', updated_at: '2024-01-01' }]));
     }
-    if (urlString.includes('/products')) {
-        return Promise.resolve({
-            ok: true,
-            json: () => Promise.resolve({
-                data: [{ slug: 'test-produkt', category: { slug: 'test-kategori' } }]
-            }),
+    if (urlString.includes('/products/export')) {
+        // NDJSON: en produkt per rad, med en rad delad mellan två bitar av strömmen
+        const params = new URL(urlString).searchParams;
+        const lines = [
+            { id: Number(params.get('after_id')) + 1, slug: 'test-produkt', category: { slug: 'test-kategori' } },
+            { id: Number(params.get('after_id')) + 2, slug: 'utan-kategori' },
+        ].map((p) => JSON.stringify(p) + '\n').join('');
+        const encoder = new TextEncoder();
+        const body = new ReadableStream({
+            start(controller) {
+                controller.enqueue(encoder.encode(lines.slice(0, 30)));
+                controller.enqueue(encoder.encode(lines.slice(30)));
+                controller.close();
+            },
         });
+        return Promise.resolve(new Response(body));
     }
-    return Promise.resolve({ ok: false });
+    if (urlString.includes('/products/')) {
+        return Promise.resolve(Response.json({ data: [{ id: LATEST_ID, slug: 'senaste' }], total: 1, next_cursor: null }));
+    }
+    return Promise.resolve(new Response(null, { status: 404 }));
 });
 
 describe('Sitemap Generator', () => {
-    it('genererar URL:er korrekt med BASE_URL', async () => {
-        const result = await sitemap();
+    it('delar upp produkterna i id-fönster', async () => {
+        // Del 0: sidor och kategorier, del 1-2: produkter
+        expect(await generateSitemaps()).toEqual([{ id: 0 }, { id: 1 }, { id: 2 }]);
+    });
 
-        // Vi förväntar oss Hem, Deals, 1 Kategori, 1 Produkt = 4 entries
-        expect(result.length).toBeGreaterThanOrEqual(4);
+    it('genererar URL:er korrekt med BASE_URL', async () => {
+        const pages = await sitemap({ id: Promise.resolve('0') });
+        expect(pages.map((r) => r.url)).toEqual([
+            'https://test.com', 'https://test.com/deals', 'https://test.com/test-kategori',
+        ]);
 
-        // Kolla att domänen från mocken används
-        const productEntry = result.find(r => r.url.includes('test-produkt'));
+        const products = await sitemap({ id: Promise.resolve('2') });
+        expect(products.map((r) => r.url)).toEqual([
+            'https://test.com/test-kategori/test-produkt', 'https://test.com/utan-kategori',
+        ]);
+        expect(global.fetch).toHaveBeenCalledWith(
+            `http://mock-api/products/export?after_id=${PRODUCTS_PER_SITEMAP}&until_id=${2 * PRODUCTS_PER_SITEMAP}`,
+            expect.anything()
+        );
+    });
 
-        expect(productEntry?.url).toBe('https://test.com/test-kategori/test-produkt');
+    it('listar alla delar i robots.txt', async () => {
+        expect((await robots()).sitemap).toEqual([
+            'https://test.com/sitemap/0.xml', 'https://test.com/sitemap/1.xml', 'https://test.com/sitemap/2.xml',
+        ]);
     });
 });
@@ -1,13 +1,17 @@
 import { MetadataRoute } from 'next';
 import { BASE_URL } from '@/lib/config';
+import { generateSitemaps } from './sitemap';
+
+export default async function robots(): Promise<MetadataRoute.Robots> {
+  // Sitemapen är uppdelad i delar (se sitemap.ts); alla listas här
+  const sitemaps = await generateSitemaps();
 
-export default function robots(): MetadataRoute.Robots {
   return {
     rules: {
       userAgent: '*',
       allow: '/',
       disallow: ['/admin/', '/profile/'],
     },
-    sitemap: `${BASE_URL}/sitemap.xml`,
+    sitemap: sitemaps.map(({ id }) => `${BASE_URL}/sitemap/${id}.xml`),
   };
-}
\ No newline at end of file
+}
@@ -7,36 +7,65 @@ type Category = {
 };
 
 type Product = {
+  id: number;
   slug: string;
   updated_at?: string;
   category?: { slug: string };
 };
 
-export default async function sitemap(): Promise<MetadataRoute.Sitemap> {
-  // 1. Hämta Kategorier
-  let categories: Category[] = [];
-  try {
-    const res = await fetch(`${API_URL}/categories`, { next: { revalidate: 3600 } });
-    if (res.ok) categories = await res.json();
-  } catch (error) {
-    console.error('Sitemap Error (Categories):', error);
+// Sitemap-protokollet tillåter högst 50 000 URL:er per fil. Del 0 innehåller statiska
+// sidor och kategorier, del 1..n varsitt id-fönster av produkter: id i ((n-1)*N, n*N].
+// Fönstren kan bli glesa (borttagna produkter) men aldrig större än N.
+export const PRODUCTS_PER_SITEMAP = 50000;
+
+// Läser NDJSON (en produkt per rad) i takt med att svaret kommer, utan att buffra hela svaret
+async function* readNdjson<T>(res: Response): AsyncGenerator<T> {
+  if (!res.body) return;
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    buffer += decoder.decode(value, { stream: !done });
+    const lines = buffer.split('\n');
+    buffer = lines.pop() ?? '';
+    for (const line of lines) {
+      if (line.trim()) yield JSON.parse(line);
+    }
+    if (done) break;
   }
+  if (buffer.trim()) yield JSON.parse(buffer);
+}
 
-  // 2. Hämta Produkter
-  // OBS: Vi sätter en hög limit för att få med så många som möjligt.
-  // Om du har 100 000+ produkter behöver du en mer avancerad lösning senare.
-  let products: Product[] = [];
+async function latestProductId(): Promise<number> {
   try {
-    const res = await fetch(`${API_URL}/products/?limit=2000`, { next: { revalidate: 3600 } });
+    const res = await fetch(`${API_URL}/products/?sort=newest&limit=1`, { next: { revalidate: 3600 } });
     if (res.ok) {
       const json = await res.json();
-      products = json.data; // Viktigt: Vi hämtar arrayen från "data" propertyn
+      return json.data[0]?.id ?? 0;
     }
   } catch (error) {
     console.error('Sitemap Error (Products):', error);
   }
+  return 0;
+}
+
+export async function generateSitemaps() {
+  const productSitemaps = Math.ceil((await latestProductId()) / PRODUCTS_PER_SITEMAP);
+  return Array.from({ length: productSitemaps + 1 }, (_, id) => ({ id }));
+}
+
+async function pageRoutes(): Promise<MetadataRoute.Sitemap> {
+  // 1. Hämta Kategorier
+  let categories: Category[] = [];
+  try {
+    const res = await fetch(`${API_URL}/categories`, { next: { revalidate: 3600 } });
+    if (res.ok) categories = await res.json();
+  } catch (error) {
+    console.error('Sitemap Error (Categories):', error);
+  }
 
-  // 3. Bygg URL:er för statiska sidor
+  // 2. Bygg URL:er för statiska sidor
   const routes = [
     '', // Hem
     '/deals',
@@ -47,7 +76,7 @@ export default async function sitemap(): Promise<MetadataRoute.Sitemap> {
     priority: 1.0,
   }));
 
-  // 4. Bygg URL:er för Kategorier
+  // 3. Bygg URL:er för Kategorier
   const categoryRoutes = categories.map((cat) => ({
     url: `${BASE_URL}/${cat.slug}`,
     lastModified: new Date(),
@@ -55,23 +84,41 @@ export default async function sitemap(): Promise<MetadataRoute.Sitemap> {
     priority: 0.8,
   }));
 
-  // 5. Bygg URL:er för Produkter
-  // Här använder vi din "Hybrid URL" logik. 
-  // Om produkten har en kategori, lägg till den i URLen för snyggare SEO.
-  const productRoutes = products.map((prod) => {
-    // Om backend skickar med category-objektet (som vi fixade i förra steget)
-    // så kan vi bygga /kategori/produkt-slug. Annars bara /produkt-slug.
-    const urlPath = prod.category?.slug
-      ? `/${prod.category.slug}/${prod.slug}`
-      : `/${prod.slug}`;
+  return [...routes, ...categoryRoutes];
+}
 
-    return {
-      url: `${BASE_URL}${urlPath}`,
-      lastModified: new Date(), // Eller prod.updated_at om det finns
-      changeFrequency: 'daily' as const,
-      priority: 0.6,
-    };
+async function productRoutes(part: number): Promise<MetadataRoute.Sitemap> {
+  // Hämta Produkter: exporten strömmar produkterna i id-fönstret som NDJSON
+  const routes: MetadataRoute.Sitemap = [];
+  const params = new URLSearchParams({
+    after_id: ((part - 1) * PRODUCTS_PER_SITEMAP).toString(),
+    until_id: (part * PRODUCTS_PER_SITEMAP).toString(),
   });
+  try {
+    const res = await fetch(`${API_URL}/products/export?${params.toString()}`, { cache: 'no-store' });
+    if (!res.ok) return routes;
+
+    for await (const prod of readNdjson<Product>(res)) {
+      // Här använder vi din "Hybrid URL" logik.
+      // Om produkten har en kategori, lägg till den i URLen för snyggare SEO.
+      const urlPath = prod.category?.slug
+        ? `/${prod.category.slug}/${prod.slug}`
+        : `/${prod.slug}`;
+
+      routes.push({
+        url: `${BASE_URL}${urlPath}`,
+        lastModified: new Date(), // Eller prod.updated_at om det finns
+        changeFrequency: 'daily' as const,
+        priority: 0.6,
+      });
+    }
+  } catch (error) {
+    console.error('Sitemap Error (Products):', error);
+  }
+  return routes;
+}
 
-  return [...routes, ...categoryRoutes, ...productRoutes];
-}
\ No newline at end of file
+export default async function sitemap(props: { id: Promise<string> }): Promise<MetadataRoute.Sitemap> {
+  const part = Number(await props.id);
+  return part === 0 ? pageRoutes() : productRoutes(part);
+}
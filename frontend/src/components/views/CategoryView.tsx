@@ -96,6 +96,8 @@ export default function CategoryView() {
   const [totalCount, setTotalCount] = useState(0);
 
   const LIMIT = 50;
+  // next_cursor från varje hämtad sida; sida N hämtas med cursorn från sida N-1
+  const nextCursors = useRef<Record<number, string | null>>({});
 
   const observer = useRef<IntersectionObserver | null>(null);
 
@@ -202,13 +204,14 @@ export default function CategoryView() {
       setLoadingMore(true);
       try {
         const responseData = await fetchCategoryProducts(idsToFetch, {
-          skip: (page - 1) * LIMIT,
+          cursor: page > 1 ? nextCursors.current[page - 1] ?? undefined : undefined,
           limit: LIMIT,
           search: currentSearch || undefined,
           sort: currentSort,
         });
 
-        setTotalCount(responseData.total);
+        // Totalen skickas bara med första sidan
+        if (page === 1) setTotalCount(responseData.total ?? 0);
         const newProducts = responseData.data;
 
         setProducts((prev) => {
@@ -220,11 +223,8 @@ export default function CategoryView() {
           return [...prev, ...uniqueNew];
         });
 
-        if (newProducts.length < LIMIT) {
-          setHasMore(false);
-        } else {
-          setHasMore(true);
-        }
+        nextCursors.current[page] = responseData.next_cursor;
+        setHasMore(responseData.next_cursor !== null);
       } catch (err) {
         console.error("Failed to fetch products", err);
       } finally {
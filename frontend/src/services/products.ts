@@ -20,16 +20,16 @@ export async function fetchProductBySlug(
 export async function fetchCategoryProducts(
     categoryIds: number[],
     options: {
-        skip?: number;
+        cursor?: string;
         limit?: number;
         search?: string;
         sort?: string;
     } = {}
-): Promise<{ data: Product[]; total: number }> {
+): Promise<{ data: Product[]; total: number | null; next_cursor: string | null }> {
     const query = new URLSearchParams();
     categoryIds.forEach((id) => query.append("category_ids", id.toString()));
 
-    if (options.skip !== undefined) query.set("skip", options.skip.toString());
+    if (options.cursor) query.set("cursor", options.cursor);
     if (options.limit !== undefined) query.set("limit", options.limit.toString());
     if (options.search) query.set("search", options.search);
     if (options.sort && options.sort !== "popularity")